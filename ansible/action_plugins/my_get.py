@@ -4,11 +4,36 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
 from ansible.errors import AnsibleError, AnsibleFileNotFound
-from ansible.utils.hashing import checksum
+from ansible.module_utils._text import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
 
-from minio import Minio
 from minio.error import S3Error
+from urllib3.exceptions import HTTPError
+
+import os
+import sys
+import shutil
+
+# role 的 module_utils 目录，管控端插件共用的代码放在这里
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.append(MODULE_UTILS_DIR)
+
+from my_artifact_cache import ArtifactCache, task_option  # noqa: E402
+from my_download_pool import run_parallel, DEFAULT_CONCURRENCY, DEFAULT_RETRIES  # noqa: E402
+from my_ranged_download import RangedDownloader, RangedDownloadError  # noqa: E402
+from my_client_pool import get_minio_client  # noqa: E402
+from my_background_job import job_status, start_job  # noqa: E402
+from my_governor import Governor  # noqa: E402
+from my_stream import BUDGET  # noqa: E402
+
+display = Display()
+
+# 下载过程中可重试的网络错误，本地文件错误不重试
+RETRY_ERRORS = (HTTPError, ConnectionError, TimeoutError, RangedDownloadError)
 
 
 class MinioUtils(object):
@@ -16,7 +41,7 @@ class MinioUtils(object):
     操作minio
     """
 
-    def __init__(self, module) -> None:
+    def __init__(self, module, governor=None) -> None:
         self.module = module
         self.endpoint = module['endpoint']
         self.access_key = module['access_key']
@@ -32,7 +57,15 @@ class MinioUtils(object):
             'secret_key': self.secret_key,
             'secure': False,
         }
-        self.client = Minio(**self.minio_conf)
+        # 本次任务内按端点与凭据复用客户端及其长连接
+        self.client = get_minio_client(pool_size=module.get('pool_size'),
+                                       **self.minio_conf)
+        self.downloader = RangedDownloader(
+            self.client, chunk_size=module.get('chunk_size'),
+            parts=module.get('parts'), retries=module.get('retries'),
+            retry_on=RETRY_ERRORS, governor=governor,
+            buffer_size=module.get('stream_buffer'))
+        BUDGET.configure(module.get('memory_limit'))
 
     def bucket_list_files(self):
         """
@@ -47,68 +80,126 @@ class MinioUtils(object):
                 bucket_name=self.bucket, prefix=self.src, recursive=True)
             lists = []
             for obj in files_list:
-                lists.append(obj.object_name)
+                lists.append(obj)
             return lists
         except S3Error as err:
-            print("[error]:", err)
+            display.warning("failed to list objects under %s: %s"
+                            % (self.src, to_text(err)))
 
-    def fget_minio(self):
+    def cache_key(self, obj):
         """
-        下载保存文件保存本地
-        :param bucket_name:
-        :param file:
-        :param file_path:
-        :return:
+        对象的缓存键：优先使用对象版本，其次使用ETag
+        """
+        return ArtifactCache.make_key('minio', self.endpoint, self.bucket,
+                                      obj.object_name,
+                                      obj.version_id or obj.etag)
+
+    def download(self, obj, file_path, part_path=None):
+        """
+        下载单个对象，大对象分段并发下载
+        :return: (对象信息, 下载过程中计算的sha1)
+        """
+        return self.downloader.download(
+            self.bucket, obj.object_name, file_path, part_path=part_path,
+            version_id=obj.version_id)
+
+    def fget_object(self, obj, fullname, cache=None):
+        """
+        下载单个对象到本地，启用缓存时从缓存复制
+        """
+        result = {}
+        if cache is not None:
+            key = self.cache_key(obj)
+            cached, hit = cache.fetch(
+                key, lambda path: self.download(
+                    obj, path, part_path=cache.partial_path(key))[1])
+            if os.path.dirname(fullname):
+                os.makedirs(os.path.dirname(fullname), exist_ok=True)
+            shutil.copyfile(cached, fullname)
+            data = obj
+            result['cached'] = hit
+            result['checksum'] = cache.file_checksum(key)
+        else:
+            data, result['checksum'] = self.download(obj, fullname)
+            result['cached'] = False
+
+        result['size'] = data.size
+        result['etag'] = data.etag
+        result['content_type'] = data.content_type
+        result['last_modified'] = data.last_modified
+        result['metadata'] = data.metadata
+        result['fullname'] = fullname
+        result['object_name'] = obj.object_name
+        return result
+
+    def fget_minio(self, cache=None, concurrency=DEFAULT_CONCURRENCY,
+                   retries=DEFAULT_RETRIES):
+        """
+        下载保存文件保存本地，前缀下的多个对象并发下载
+        :param cache: ArtifactCache，为None时直接从minio下载
+        :param concurrency: 并发下载数
+        :param retries: 单个对象失败后的重试次数
+        :return: 最后一个对象的信息，objects 为全部对象的信息
         """
         try:
             lists = self.bucket_list_files()
+            if not lists:
+                return 'Object %s does not exist' % self.src
 
             if len(lists) > 1:
                 target = self.dest
                 if len(target.split(".")) > 1:
                     return 'A directory should be a target'
 
-                for obj in lists:
-                    if not self.client.bucket_exists(self.bucket):
-                        return 'Bucket does not exist'
+                if not self.client.bucket_exists(self.bucket):
+                    return 'Bucket does not exist'
 
-                    fullname = "{}/{}".format(self.dest, obj.split("/")[-1])
+                objects = run_parallel(
+                    lambda obj: self.fget_object(
+                        obj, "{}/{}".format(
+                            self.dest, obj.object_name.split("/")[-1]),
+                        cache),
+                    lists, concurrency=concurrency, retries=retries,
+                    retry_on=RETRY_ERRORS)
 
-                    data = self.client.fget_object(self.bucket, obj, fullname)
-
-                    result = {}
-                    result['size'] = data.size
-                    result['etag'] = data.etag
-                    result['content_type'] = data.content_type
-                    result['last_modified'] = data.last_modified
-                    result['metadata'] = data.metadata
-                    result['fullname'] = fullname
+                result = dict(objects[-1])
+                result['objects'] = objects
+                return result
             else:
 
                 obj = lists[0]
                 target = self.dest
 
                 if len(target.split(".")) == 1:
-                    fullname = "{}/{}".format(self.dest, obj.split("/")[-1])
+                    fullname = "{}/{}".format(
+                        self.dest, obj.object_name.split("/")[-1])
                 else:
                     fullname = target
 
-                data = self.client.fget_object(self.bucket, obj, fullname)
-
-                result = {}
-                result['size'] = data.size
-                result['etag'] = data.etag
-                result['content_type'] = data.content_type
-                result['last_modified'] = data.last_modified
-                result['metadata'] = data.metadata
-                result['fullname'] = fullname
-
+                result = self.fget_object(obj, fullname, cache)
+                result['objects'] = [dict(result)]
                 return result
 
-        except S3Error as err:
+        except (S3Error, HTTPError, OSError) as err:
             return err
 
 
+def background_fetch(params, cache):
+    """
+    后台任务入口（见 my_background_job）：下载对象到管控端的dest
+    :return: 各对象的信息
+    """
+    governor = Governor.from_task(params['endpoint'], params, {})
+    res = MinioUtils(params, governor).fget_minio(
+        cache, concurrency=params.get('concurrency') or DEFAULT_CONCURRENCY,
+        retries=params.get('retries') or DEFAULT_RETRIES)
+    if not isinstance(res, dict):
+        raise AnsibleError(to_text(res))
+    return [dict(object_name=obj['object_name'], size=obj['size'],
+                 etag=obj['etag'], checksum=obj['checksum'])
+            for obj in res['objects']]
+
+
 class ActionModule(ActionBase):
 
     """
@@ -138,6 +229,51 @@ class ActionModule(ActionBase):
 
         return result
 
+    def _job_status(self, result, task_vars):
+        """
+        查询后台下载任务的状态，配合 until/retries 轮询
+        """
+        cache = ArtifactCache.from_task(self._task.args, task_vars)
+        if cache is None:
+            result['failed'] = True
+            result['msg'] = "job_id requires the artifact cache"
+            return result
+
+        status = job_status(cache, self._task.args['job_id'])
+        result.update(changed=False, job_id=status['job_id'],
+                      finished=status.get('finished', False),
+                      result=status.get('result'))
+        if status.get('failed'):
+            result['failed'] = True
+            result['msg'] = status.get('msg')
+        return result
+
+    def _start_background(self, result, module_args, cache, task_vars):
+        """
+        background=true：在管控端后台进程中下载并立即返回job_id，
+        相同对象的任务共用一个后台进程
+        """
+        if cache is None:
+            result['failed'] = True
+            result['msg'] = "background requires the artifact cache"
+            return result
+
+        params = dict(module_args)
+        params['concurrency'] = task_option(module_args, task_vars,
+                                            'concurrency',
+                                            'artifact_download_concurrency',
+                                            DEFAULT_CONCURRENCY)
+        for arg, var in (('source_limits', 'artifact_source_limits'),
+                         ('governor_dir', 'artifact_governor_dir')):
+            params[arg] = task_option(module_args, task_vars, arg, var)
+        job_id = ArtifactCache.make_key(
+            'my_get', module_args['endpoint'], module_args['bucket'],
+            module_args['src'], module_args['dest'])[:16]
+        status = start_job(cache, os.path.abspath(__file__), params, job_id)
+        result.update(changed=False, job_id=job_id, started=status['started'],
+                      finished=False)
+        return result
+
     def run(self, tmp=None, task_vars=None):
         ''' handler for file transfer operations '''
 
@@ -147,6 +283,10 @@ class ActionModule(ActionBase):
         result = super(ActionModule, self).run(tmp, task_vars)
         del tmp  # tmp no longer has any effect
 
+        # 查询后台下载任务的状态
+        if self._task.args.get('job_id'):
+            return self._job_status(result, task_vars)
+
         # 获取参数
         module_args = self._task.args.copy()
         module_args['src'] = self._task.args.get(
@@ -167,6 +307,23 @@ class ActionModule(ActionBase):
         module_args['secret_key'] = self._task.args.get(
             'secret_key', None)
 
+        # 大对象分段下载参数
+        module_args['chunk_size'] = task_option(
+            module_args, task_vars, 'chunk_size', 'artifact_download_chunk_size')
+        module_args['parts'] = task_option(
+            module_args, task_vars, 'parts', 'artifact_download_parts')
+        module_args['retries'] = task_option(
+            module_args, task_vars, 'retries', 'artifact_download_retries',
+            DEFAULT_RETRIES)
+        module_args['pool_size'] = task_option(
+            module_args, task_vars, 'pool_size', 'artifact_http_pool_size')
+        # 流式下载的块大小与每个fork的缓冲内存上限
+        module_args['stream_buffer'] = task_option(
+            module_args, task_vars, 'stream_buffer', 'artifact_stream_buffer')
+        module_args['memory_limit'] = task_option(
+            module_args, task_vars, 'memory_limit',
+            'artifact_stream_memory_limit')
+
         # 判定参数
         result['failed'] = True
         if module_args['src'] is None or module_args['dest'] is None:
@@ -179,13 +336,37 @@ class ActionModule(ActionBase):
             return self._ensure_invocation(result)
 
         # 获取minio 文件
-        mcli = MinioUtils(module_args)
-
-        res = mcli.fget_minio()
-
-        local_checksum = checksum(res['fullname'])
+        # 按端点限制拉取的带宽与并发连接数，所有fork共用
+        governor = Governor.from_task(module_args['endpoint'], module_args,
+                                      task_vars)
+        mcli = MinioUtils(module_args, governor)
+
+        cache = ArtifactCache.from_task(module_args, task_vars)
+        if boolean(module_args.get('background', False), strict=False):
+            return self._start_background(result, module_args, cache,
+                                          task_vars)
+
+        res = mcli.fget_minio(
+            cache,
+            concurrency=task_option(module_args, task_vars, 'concurrency',
+                                    'artifact_download_concurrency',
+                                    DEFAULT_CONCURRENCY),
+            retries=module_args['retries'])
+
+        if not isinstance(res, dict):
+            result['failed'] = True
+            result['msg'] = str(res)
+            return result
+
+        # 下载时已计算sha1，无需再读一遍文件
+        local_checksum = res['checksum']
 
         result = {}
         result['checksum'] = local_checksum
+        result['cached'] = res['cached']
+        result['objects'] = [
+            dict(object_name=obj['object_name'], fullname=obj['fullname'],
+                 size=obj['size'], etag=obj['etag'], cached=obj['cached'])
+            for obj in res['objects']]
 
         return result
@@ -5,74 +5,354 @@ from __future__ import (absolute_import, division, print_function)
 import re
 __metaclass__ = type
 
+import fnmatch
+import hashlib
 import json
 import os
+import posixpath
 import stat
+import sys
+import tarfile
 import tempfile
-import gitlab
+import uuid
 
 from ansible.errors import AnsibleError, AnsibleFileNotFound
 from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.module_utils.common.text.formatters import human_to_bytes
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.action import ActionBase
-from ansible.utils.hashing import checksum
+from ansible.utils.display import Display
 
 from tempfile import TemporaryDirectory
 
+# role 的 module_utils 目录，管控端插件共用的代码放在这里
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.append(MODULE_UTILS_DIR)
+
+from my_artifact_cache import ArtifactCache, task_option  # noqa: E402
+from my_client_pool import get_gitlab_client  # noqa: E402
+from my_download_pool import run_parallel, DEFAULT_CONCURRENCY  # noqa: E402
+from my_delta import prepare_delta, DEFAULT_BLOCK_SIZE  # noqa: E402
+from my_compress import prepare_compressed  # noqa: E402
+from my_sync import make_bundle, TMP_PREFIX  # noqa: E402
+from my_governor import Governor, NULL_GOVERNOR  # noqa: E402
+from my_digest import available, source_digest  # noqa: E402
+from my_stream import BUDGET, buffer_size, stream_to_file  # noqa: E402
+
+display = Display()
+
+# 只在管控端使用的参数，不传给远程模块
+CONTROLLER_ARGS = ('cache', 'cache_dir', 'cache_max_size', 'pool_size',
+                   'batch_mode', 'concurrency', 'delta_transfer',
+                   'delta_block_size', 'compression', 'source_limits',
+                   'governor_dir', 'staging_dir', 'stream_buffer',
+                   'memory_limit', 'checksum_algorithm', 'pin_ref')
+# src 中出现这些字符时按通配符匹配多个文件
+GLOB_CHARS = '*?['
+# 完整的commit SHA，无需再解析
+COMMIT_SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
 
 class GitlabUtils(object):
     """
     操作Gitlab
     """
 
-    def __init__(self, module) -> None:
+    def __init__(self, module, governor=None) -> None:
         self.module = module
+        # 拉取带宽与并发连接数限制，见 my_governor
+        self.governor = governor or NULL_GOVERNOR
+        # 流式下载的块大小与进程内缓冲总量上限，见 my_stream
+        self.buffer_size = buffer_size(module.get('stream_buffer'))
+        BUDGET.configure(module.get('memory_limit'))
         self.url = module['url']
         self.access_token = module['accessToken']
         self.src = module['src']
         self.dest = module['dest']
         self.project_id = module['projectID']
         self.branch = module['branch']
+        # branch 解析得到的commit SHA，见 resolve_ref
+        self.sha = None
         # self.filenameTmp = module['filenameTmp']
         self.tmp_fp = tempfile.TemporaryDirectory()
-        self.git_gl = gitlab.Gitlab(
-            self.url, self.access_token, api_version='4', ssl_verify=False)
+        # 本次任务内按地址与token复用会话及其长连接
+        self.git_gl = get_gitlab_client(
+            self.url, self.access_token, ssl_verify=False,
+            pool_size=module.get('pool_size'))
 
 
     # 获得项目：projectID的格式随意，反正我就写了个数字进去
     def get_project(self) -> any:
         """ 获取项目列表"""
-        projectss = self.git_gl.projects.get(self.project_id)
+        # lazy：不请求项目信息，后续接口直接按id拼接路径
+        projectss = self.git_gl.projects.get(self.project_id, lazy=True)
         return projectss
 
-    def get_file(self):
+    @property
+    def ref(self):
+        """
+        请求使用的ref，已解析时为commit SHA
+        """
+        return self.sha or self.branch
+
+    def resolve_ref(self, cache=None, play_id=None):
+        """
+        将branch解析为commit SHA，保证各主机拿到同一版本的文件
+        启用缓存时按 play 记忆化，同一个play内所有主机只请求一次
+        """
+        if COMMIT_SHA_RE.match(self.branch):
+            self.sha = self.branch
+            return self.sha
+
+        def resolve():
+            return self.get_project().commits.get(self.branch).id
+
+        if cache is not None and play_id:
+            key = ArtifactCache.make_key('gitlab-ref', self.url,
+                                         self.project_id, self.branch,
+                                         play_id)
+            self.sha = cache.memoize(key, resolve)
+        else:
+            self.sha = resolve()
+        return self.sha
+
+    def file_cache_key(self, path):
+        """
+        文件内容的缓存键 (project, sha, path)，命中时无需请求Gitlab
+        """
+        return ArtifactCache.make_key('gitlab', self.url, self.project_id,
+                                      self.ref, path)
+
+    def file_headers(self, projects=None):
+        """
+        HEAD 请求获取文件元数据（blob id、sha256、大小），不下载内容
+        """
+        projects = projects or self.get_project()
+        return projects.files.head(file_path=self.src, ref=self.ref)
+
+    def get_file(self, cache=None):
         """
         获得project下单个文件
+        :param cache: ArtifactCache，启用时按 (project, sha, path) 缓存文件内容
         """
         projects = self.get_project()
         result = {}
-
-        # tmpdir = self.create_tmp()
-        filename_tmp = "{}/{}".format(self.tmp_fp.name,
-                                      self.src.split("/")[-1])
-        print("filename_tmp:", filename_tmp)
+        basename = self.src.split("/")[-1]
 
         try:
-            # 获得文件
-            with open(filename_tmp, 'wb') as f:
-                projects.files.raw(
-                    file_path=self.src, ref=self.branch, streamed=True, action=f.write)
+            if cache is not None:
+                key = self.file_cache_key(self.src)
+                filename_tmp, hit = cache.fetch(
+                    key, lambda path: self._download(projects, path))
+                file_checksum = cache.file_checksum(key)
+            else:
+                filename_tmp = "{}/{}".format(self.tmp_fp.name, basename)
+                file_checksum = self._download(projects, filename_tmp)
+                hit = False
+            display.vvv("downloaded %s to %s" % (self.src, filename_tmp))
 
-            result = {'changed': True, 'msg': "success", "file": filename_tmp}
+            result = {'changed': True, 'msg': "success", "file": filename_tmp,
+                      'basename': basename, 'cached': hit,
+                      'checksum': file_checksum}
 
         except Exception as err:
-            print("Exception err: ", err)
-            self._clean_fp_
+            display.vvv("failed to get %s: %s" % (self.src, to_text(err)))
+            self._clean_fp_()
             result = {'changed': False, 'msg': err}
 
         return result
 
+    def _download(self, projects, filename):
+        """
+        流式下载文件内容，边写边计算sha1
+        :return: 文件sha1
+        """
+        return stream_to_file(
+            lambda action, size: projects.files.raw(
+                file_path=self.src, ref=self.ref, streamed=True,
+                action=action, chunk_size=size),
+            filename, self.governor, self.buffer_size)
+
+    def is_batch(self):
+        """
+        src 为路径列表、通配符或以 / 结尾的目录时批量获取
+        """
+        if isinstance(self.src, (list, tuple)):
+            return True
+        return self.src.endswith('/') or any(c in self.src for c in GLOB_CHARS)
+
+    def resolve_files(self, projects, cache=None):
+        """
+        通过一次 repository tree 请求解析 src 对应的全部文件
+        启用缓存且ref已解析为SHA时，目录列表按 (project, sha, 目录) 记忆化
+        :return: ([(仓库内路径, 目标目录下的相对路径, blob id)], 公共目录)
+        """
+        if isinstance(self.src, (list, tuple)):
+            wanted = [p.strip('/') for p in self.src]
+            dirs = [posixpath.dirname(p) for p in wanted]
+            base = posixpath.commonpath(dirs) if all(dirs) else ''
+
+            def match(path):
+                return path in wanted
+        else:
+            pattern = self.src.strip('/')
+            if self.src.endswith('/'):
+                base = pattern
+                pattern = pattern + '/*'
+            else:
+                first = min(pattern.find(c) for c in GLOB_CHARS
+                            if c in pattern)
+                base = posixpath.dirname(pattern[:first])
+
+            def match(path):
+                return fnmatch.fnmatchcase(path, pattern)
+
+        # 保留相对公共目录的路径，不同目录下的同名文件不会互相覆盖
+        def relpath(path):
+            return posixpath.relpath(path, base) if base else path
+
+        def list_tree():
+            tree = projects.repository_tree(path=base, ref=self.ref,
+                                            recursive=True, get_all=True)
+            return json.dumps([(item['path'], item['id']) for item in tree
+                               if item['type'] == 'blob'])
+
+        if cache is not None and self.sha:
+            tree = cache.memoize(ArtifactCache.make_key(
+                'gitlab-tree', self.url, self.project_id, self.sha, base),
+                list_tree)
+        else:
+            tree = list_tree()
+        files = [(path, relpath(path), blob_id)
+                 for path, blob_id in json.loads(tree) if match(path)]
+
+        if isinstance(self.src, (list, tuple)):
+            missing = set(wanted) - set(path for path, rel, blob in files)
+            if missing:
+                raise AnsibleError("files not found in %s@%s: %s" % (
+                    self.project_id, self.branch, ', '.join(sorted(missing))))
+        elif not files:
+            raise AnsibleError("no files match %s in %s@%s" % (
+                self.src, self.project_id, self.branch))
+        return files, base
+
+    def get_files(self, cache=None, batch_mode='concurrent',
+                  concurrency=DEFAULT_CONCURRENCY):
+        """
+        批量获得多个文件
+        :param batch_mode: concurrent 按blob并发下载；archive 下载一个仓库归档在本地解包
+        :return: [{'file', 'basename', 'cached', 'checksum'}]
+        """
+        projects = self.get_project()
+        files, base = self.resolve_files(projects, cache)
+
+        if batch_mode == 'archive':
+            return self._get_files_archive(projects, files, base, cache)
+
+        def fetch(item):
+            path, rel, blob_id = item
+            if cache is not None:
+                key = self.blob_cache_key(blob_id)
+                filename, hit = cache.fetch(
+                    key, lambda tmp_path: self._download_blob(
+                        projects, blob_id, tmp_path))
+                file_checksum = cache.file_checksum(key)
+            else:
+                filename = os.path.join(self.tmp_fp.name, rel)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                file_checksum = self._download_blob(projects, blob_id,
+                                                    filename)
+                hit = False
+            return {'file': filename, 'basename': rel, 'cached': hit,
+                    'checksum': file_checksum}
+
+        return run_parallel(fetch, files, concurrency=concurrency)
+
+    def _get_files_archive(self, projects, files, base, cache):
+        """
+        下载一次仓库归档（限定在 base 目录），解出需要的文件
+        启用缓存时只在有文件未命中时才请求归档
+        """
+        results = {}
+        pending = {}
+        for path, rel, blob_id in files:
+            key = self.blob_cache_key(blob_id)
+            filename = cache.get(key) if cache is not None else None
+            if filename is not None:
+                results[path] = {'file': filename, 'basename': rel,
+                                 'cached': True,
+                                 'checksum': cache.file_checksum(key)}
+            else:
+                pending[path] = (rel, key)
+
+        if pending:
+            archive = os.path.join(self.tmp_fp.name, 'archive.tar.gz')
+
+            stream_to_file(
+                lambda action, size: projects.repository_archive(
+                    sha=self.ref, format='tar.gz', path=base or None,
+                    streamed=True, action=action, chunk_size=size),
+                archive, self.governor, self.buffer_size, digest=False)
+
+            with tarfile.open(archive, 'r:gz') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    # 归档的第一层目录为 <project>-<ref>-<sha>[-<path>]
+                    name = member.name.split('/', 1)[-1]
+                    path = name if name in pending else posixpath.join(base, name)
+                    if path not in pending:
+                        continue
+
+                    rel, key = pending.pop(path)
+                    if cache is not None:
+                        filename = cache.mkstemp()
+                    else:
+                        filename = os.path.join(self.tmp_fp.name, 'files', rel)
+                        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+                    digest = hashlib.sha1()
+                    with BUDGET.reserve(self.buffer_size), \
+                            tar.extractfile(member) as fsrc, \
+                            open(filename, 'wb') as fdst:
+                        for data in iter(lambda: fsrc.read(self.buffer_size), b''):
+                            fdst.write(data)
+                            digest.update(data)
+
+                    if cache is not None:
+                        cache.set_checksum(key, digest.hexdigest())
+                        filename = cache.put(key, filename)
+                    results[path] = {'file': filename, 'basename': rel,
+                                     'cached': False,
+                                     'checksum': digest.hexdigest()}
+            os.remove(archive)
+
+        if pending:
+            raise AnsibleError("files missing from repository archive: %s"
+                               % ', '.join(sorted(pending)))
+        return [results[path] for path, rel, blob_id in files]
+
+    def blob_cache_key(self, blob_id):
+        """
+        文件内容的缓存键，blob id 即内容的SHA
+        """
+        return ArtifactCache.make_key('gitlab', self.url, self.project_id,
+                                      blob_id)
+
+    def _download_blob(self, projects, blob_id, filename):
+        """
+        按blob id流式下载文件内容，边写边计算sha1
+        :return: 文件sha1
+        """
+        return stream_to_file(
+            lambda action, size: projects.repository_raw_blob(
+                blob_id, streamed=True, action=action, chunk_size=size),
+            filename, self.governor, self.buffer_size)
+
     def _clean_fp_(self):
-        self.tmp_fp.cleanup
+        self.tmp_fp.cleanup()
 
 
 class ActionModule(ActionBase):
@@ -80,6 +360,376 @@ class ActionModule(ActionBase):
     ansible 类
     """
 
+    def _module_args(self, task_vars):
+        """
+        远程模块参数：去掉只在管控端使用的参数，补充role变量中的默认值
+        """
+        new_module_args = self._task.args.copy()
+        for arg in CONTROLLER_ARGS:
+            new_module_args.pop(arg, None)
+        new_module_args['checksum_index'] = boolean(task_option(
+            self._task.args, task_vars, 'checksum_index',
+            'artifact_checksum_index', False), strict=False)
+        return new_module_args
+
+    def _fetch_remote(self, gl, module_args, cache, task_vars):
+        """
+        fetch_mode=remote：目标主机直接从Gitlab下载
+        管控端通过HEAD请求获得文件的sha256，由远程模块校验
+        """
+        try:
+            # 已解析为SHA时文件内容不变，sha256可以跨主机复用
+            if cache is not None and gl.sha:
+                checksum_sha256 = cache.memoize(
+                    ArtifactCache.make_key('gitlab-sha256',
+                                           gl.file_cache_key(gl.src)),
+                    lambda: gl.file_headers()['X-Gitlab-Content-Sha256'])
+            else:
+                checksum_sha256 = gl.file_headers().get(
+                    'X-Gitlab-Content-Sha256')
+        except Exception as err:
+            return dict(failed=True, msg=to_text(err))
+
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(
+                branch=gl.ref,
+                original_basename=module_args['src'].split("/")[-1],
+                fetch_mode='remote',
+                checksum_sha256=checksum_sha256,
+            )
+        )
+
+        return self._execute_module(module_name='my_gitlab',
+                                    module_args=new_module_args,
+                                    task_vars=task_vars)
+
+    def _delta_block_size(self, task_vars):
+        """
+        差量传输的块大小，未启用差量传输时返回None
+        """
+        enabled = task_option(self._task.args, task_vars, 'delta_transfer',
+                              'artifact_delta_transfer', False)
+        if not boolean(enabled, strict=False):
+            return None
+        return human_to_bytes(task_option(
+            self._task.args, task_vars, 'delta_block_size',
+            'artifact_delta_block_size', DEFAULT_BLOCK_SIZE))
+
+    def _push_file(self, source_full, dest, rel, checksum, task_vars,
+                   compression='none'):
+        """
+        传输文件到目标文件旁（或远程临时目录）
+        启用差量传输且目标文件已存在时，先取回目标文件的分块签名，只传输差量
+        :param compression: 传输压缩算法 auto/zstd/gzip/none
+        :return: 远程模块的附加参数（含 src）；目标文件已是最新、无需传输时返回None
+        """
+        extra_args = {}
+        delta_path = None
+        block_size = self._delta_block_size(task_vars)
+        if block_size:
+            new_module_args = self._module_args(task_vars)
+            new_module_args.update(
+                dict(src=rel, dest=dest, original_basename=rel,
+                     delta_signature=True, delta_block_size=block_size))
+            status = self._execute_module(module_name='my_gitlab',
+                                          module_args=new_module_args,
+                                          task_vars=task_vars)
+            if status.get('failed'):
+                raise AnsibleError("Failed to get information on remote file (%s): %s"
+                                   % (dest, status.get('msg', '')))
+            if status['exists'] and status['checksum'] == checksum:
+                return None
+            if status['exists']:
+                delta_path = prepare_delta(source_full, status['signatures'],
+                                           block_size)
+            if delta_path:
+                extra_args = dict(delta=True, delta_block_size=block_size)
+
+        # 差量之后再压缩，已压缩的内容原样传输
+        codec, packed_path = prepare_compressed(delta_path or source_full,
+                                                compression)
+        extra_args['compression'] = codec
+
+        try:
+            extra_args['src'], extra_args['remove_src'] = self._upload(
+                packed_path or delta_path or source_full,
+                posixpath.join(dest, rel), checksum)
+        finally:
+            for path in (delta_path, packed_path):
+                if path:
+                    os.remove(path)
+        return extra_args
+
+    def _upload(self, local_path, final_dest, checksum):
+        """
+        上传单个文件：优先放在目标文件所在的目录，与目标同一文件系统，模块安装时只需rename；
+        目录不存在或不可写时放到远程临时目录
+        :return: (远程路径, 是否放在目标目录，此时由模块负责删除)
+        """
+        shell = self._connection._shell
+        name = '%s-%s-%s' % (TMP_PREFIX, checksum, uuid.uuid4().hex[:8])
+        dest_dir = posixpath.dirname(final_dest)
+        if dest_dir:
+            path = shell.join_path(dest_dir, name)
+            try:
+                self._transfer_file(local_path, path)
+                self._fixup_perms2((path,), execute=False)
+                return path, True
+            except AnsibleError:
+                self._remote_remove(path)
+
+        if shell.tmpdir is None:
+            self._make_tmp_path()
+        path = shell.join_path(shell.tmpdir, name)
+        self._transfer_file(local_path, path)
+        self._fixup_perms2((shell.tmpdir, path), execute=False)
+        return path, False
+
+    def _remote_remove(self, path):
+        """
+        删除目标目录中残留的上传文件
+        """
+        self._low_level_execute_command(self._connection._shell.remove(path))
+
+    def _digest_args(self, src, task_vars):
+        """
+        checksum_algorithm 不是sha1时，附带管控端计算的源文件摘要，
+        目标主机按该算法校验传输结果，代替计算sha1
+        """
+        algorithm = task_option(self._task.args, task_vars,
+                                'checksum_algorithm',
+                                'artifact_checksum_algorithm', 'sha1')
+        if algorithm == 'sha1' or not available(algorithm):
+            return {}
+        cache = ArtifactCache.from_task(self._task.args, task_vars)
+        return dict(digest=source_digest(src, algorithm, cache),
+                    digest_algorithm=algorithm)
+
+    def _install_staged(self, dest, rel, checksum, task_vars):
+        """
+        文件已由 my_prefetch 暂存到目标主机时，只需在主机本地校验并移动
+        :return: 模块返回值，未配置暂存目录或文件未暂存时返回None
+        """
+        staging_dir = task_option(self._task.args, task_vars, 'staging_dir',
+                                  'artifact_staging_dir')
+        if not staging_dir:
+            return None
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(src=checksum, dest=dest, original_basename=rel,
+                 checksum=checksum, fetch_mode='controller',
+                 staging_dir=staging_dir))
+        module_return = self._execute_module(module_name='my_gitlab',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+        if module_return.get('staged_missing'):
+            return None
+        return module_return
+
+    def _remote_copy(self, source_full, dest, rel, checksum, task_vars,
+                     compression=None):
+        """
+        传输单个文件到远程临时目录，由远程模块校验后移动到 dest/rel
+        :param compression: 传输压缩算法，默认取role变量
+        """
+        if compression is None:
+            # gzip重试时已确认文件未暂存
+            module_return = self._install_staged(dest, rel, checksum, task_vars)
+            if module_return is not None:
+                return module_return
+            compression = task_option(self._task.args, task_vars,
+                                      'compression',
+                                      'artifact_transfer_compression', 'none')
+        try:
+            extra_args = self._push_file(source_full, dest, rel, checksum,
+                                         task_vars, compression)
+        except AnsibleError as err:
+            return dict(failed=True, msg=to_text(err))
+        if extra_args is None:
+            return dict(changed=False, dest=dest, checksum=checksum,
+                        msg="file already exists")
+
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(
+                dest=dest,
+                original_basename=rel,
+                checksum=checksum,
+            )
+        )
+        new_module_args.update(extra_args)
+        new_module_args.update(self._digest_args(source_full, task_vars))
+        module_return = self._execute_module(module_name='my_gitlab',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+
+        # 目标主机不支持该摘要算法时改用sha1校验，临时文件仍在原处
+        if module_return.get('unsupported_digest'):
+            for arg in ('digest', 'digest_algorithm'):
+                new_module_args.pop(arg, None)
+            module_return = self._execute_module(module_name='my_gitlab',
+                                                 module_args=new_module_args,
+                                                 task_vars=task_vars)
+
+        if module_return.get('failed') and extra_args['remove_src']:
+            self._remote_remove(extra_args['src'])
+
+        # 目标主机无法解压zstd时改用gzip重新传输
+        if (module_return.get('unsupported_compression')
+                and extra_args['compression'] != 'gzip'):
+            return self._remote_copy(source_full, dest, rel, checksum,
+                                     task_vars, compression='gzip')
+        return module_return
+
+    def _run_batch(self, gl, module_args, cache, task_vars):
+        """
+        批量获取：一次 tree 请求解析文件列表，并发或通过归档下载，再批量下发
+        """
+        try:
+            files = gl.get_files(
+                cache,
+                batch_mode=task_option(module_args, task_vars, 'batch_mode',
+                                       'artifact_gitlab_batch_mode', 'concurrent'),
+                concurrency=task_option(module_args, task_vars,
+                                        'concurrency',
+                                        'artifact_download_concurrency',
+                                        DEFAULT_CONCURRENCY))
+        except Exception as err:
+            return dict(failed=True, msg=to_text(err))
+
+        result = dict(changed=False, dest=module_args['dest'], files=[])
+
+        # 差量传输需要逐个文件取回分块签名，此时逐个下发
+        if self._delta_block_size(task_vars):
+            for item in files:
+                module_return = self._remote_copy(
+                    item['file'], module_args['dest'], item['basename'],
+                    item['checksum'], task_vars)
+                if module_return.get('failed'):
+                    result.update(failed=True, msg=module_return.get('msg'),
+                                  failed_file=item['basename'])
+                    break
+
+                result['changed'] = result['changed'] or module_return.get('changed', False)
+                result['files'].append(
+                    dict(dest=module_return.get('dest'),
+                         checksum=item['checksum'],
+                         changed=module_return.get('changed', False),
+                         cached=item['cached']))
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+
+        entries = [dict(src=item['basename'], checksum=item['checksum'],
+                        dest=self._connection._shell.join_path(
+                            module_args['dest'], item['basename']))
+                   for item in files]
+        try:
+            module_return = self._install_batch(files, entries, task_vars)
+        finally:
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+
+        result['files'] = [
+            dict(dest=res.get('dest'), checksum=item['checksum'],
+                 changed=res.get('changed', False), cached=item['cached'])
+            for item, res in zip(files, module_return.get('results', []))]
+        result['changed'] = any(res['changed'] for res in result['files'])
+        if module_return.get('failed'):
+            result.update(failed=True, msg=module_return.get('msg'))
+        return result
+
+    def _install_batch(self, files, entries, task_vars):
+        """
+        批量下发：一次模块调用查询全部目标文件的sha1，
+        变化的文件打包为一个tar传输，再一次模块调用校验并移动
+        :return: {'results': 与 entries 顺序一致的每个文件的结果}
+        """
+        staging_dir = task_option(self._task.args, task_vars, 'staging_dir',
+                                  'artifact_staging_dir')
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(src='', batch=[dict(dest=entry['dest'],
+                                     checksum=entry['checksum'])
+                                for entry in entries],
+                 batch_stat=True, staging_dir=staging_dir or None))
+        status = self._execute_module(module_name='my_gitlab',
+                                      module_args=new_module_args,
+                                      task_vars=task_vars)
+        if status.get('failed'):
+            return status
+
+        results = [dict(dest=entry['dest'], checksum=entry['checksum'],
+                        changed=False) for entry in entries]
+        pending = [i for i, current in enumerate(status['results'])
+                   if current['checksum'] != entries[i]['checksum']]
+        if not pending:
+            return dict(changed=False, results=results)
+
+        # 已由 my_prefetch 暂存的文件在主机本地移动，其余打包传输
+        staged = set(status.get('staged') or [])
+        local = [i for i in pending if entries[i]['checksum'] in staged]
+        pending = [i for i in pending if entries[i]['checksum'] not in staged]
+
+        module_return = dict(changed=False)
+        if local:
+            new_module_args = self._module_args(task_vars)
+            new_module_args.update(dict(src='', batch=[
+                dict(entries[i], src=self._connection._shell.join_path(
+                    staging_dir, entries[i]['checksum']))
+                for i in local]))
+            module_return = self._execute_module(module_name='my_gitlab',
+                                                 module_args=new_module_args,
+                                                 task_vars=task_vars)
+            for i, res in zip(local, module_return.get('results', [])):
+                results[i] = res
+        if pending and not module_return.get('failed'):
+            module_return = self._push_batch(
+                [files[i]['file'] for i in pending],
+                [entries[i] for i in pending], task_vars)
+            for i, res in zip(pending, module_return.get('results', [])):
+                results[i] = res
+        module_return['results'] = results
+        return module_return
+
+    def _push_batch(self, paths, entries, task_vars, compression=None):
+        """
+        打包传输并执行一次批量安装
+        :param paths: 与 entries 对应的本地文件路径
+        """
+        if compression is None:
+            compression = task_option(self._task.args, task_vars,
+                                      'compression',
+                                      'artifact_transfer_compression', 'none')
+        if self._connection._shell.tmpdir is None:
+            self._make_tmp_path()
+        tmp = self._connection._shell.tmpdir
+        tmp_src = self._connection._shell.join_path(tmp, 'bundle')
+
+        bundle = make_bundle([(path, entry['src'])
+                              for path, entry in zip(paths, entries)])
+        codec, packed_path = prepare_compressed(bundle, compression)
+        try:
+            remote_path = self._transfer_file(packed_path or bundle, tmp_src)
+        finally:
+            for path in (bundle, packed_path):
+                if path:
+                    os.remove(path)
+        if remote_path:
+            self._fixup_perms2((tmp, remote_path))
+
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(src='', batch=entries, bundle=tmp_src, compression=codec))
+        module_return = self._execute_module(module_name='my_gitlab',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+
+        # 目标主机无法解压zstd时改用gzip重新传输
+        if module_return.get('unsupported_compression') and codec != 'gzip':
+            return self._push_batch(paths, entries, task_vars,
+                                    compression='gzip')
+        return module_return
+
     def run(self, tmp=None, task_vars=None):
         ''' handler for file transfer operations '''
         if task_vars is None:
@@ -116,21 +766,64 @@ class ActionModule(ActionBase):
         if module_args['branch'] is None:
             module_args['branch'] = 'master'
 
+        module_args['pool_size'] = task_option(
+            module_args, task_vars, 'pool_size', 'artifact_http_pool_size')
+        # 流式下载的块大小与每个fork的缓冲内存上限
+        module_args['stream_buffer'] = task_option(
+            module_args, task_vars, 'stream_buffer', 'artifact_stream_buffer')
+        module_args['memory_limit'] = task_option(
+            module_args, task_vars, 'memory_limit',
+            'artifact_stream_memory_limit')
+
         if result.get('failed'):
             return result
 
-        # 获取gitlab 文件
-        gl = GitlabUtils(module_args)
-        res = gl.get_file()
+        # 获取gitlab 文件，按地址限制拉取的带宽与并发连接数
+        gl = GitlabUtils(module_args, Governor.from_task(
+            module_args['url'], module_args, task_vars))
+
+        cache = ArtifactCache.from_task(module_args, task_vars)
+
+        # 分支解析为commit SHA，同一个play内只解析一次
+        # 缓存键需要SHA；未启用缓存时只在 pin_ref 时解析，不为每台主机多一次API请求
+        pin_ref = boolean(task_option(module_args, task_vars, 'pin_ref',
+                                      'artifact_gitlab_pin_ref', False),
+                          strict=False)
+        if cache is not None or pin_ref:
+            try:
+                play_id = self._task.get_play()._uuid
+            except AttributeError:
+                play_id = None
+            try:
+                gl.resolve_ref(cache, play_id)
+            except Exception as err:
+                result['failed'] = True
+                result['msg'] = "failed to resolve %s: %s" % (
+                    module_args['branch'], to_text(err))
+                return result
+
+        fetch_mode = task_option(module_args, task_vars, 'fetch_mode',
+                                 'artifact_fetch_mode', 'controller')
+        if fetch_mode == 'remote':
+            if gl.is_batch():
+                result['failed'] = True
+                result['msg'] = "fetch_mode=remote supports a single src file only"
+                return result
+            result.update(self._fetch_remote(gl, module_args, cache,
+                                             task_vars))
+            return result
+
+        # 路径列表、通配符或目录：批量获取
+        if gl.is_batch():
+            result.update(self._run_batch(gl, module_args, cache, task_vars))
+            return result
+        res = gl.get_file(cache)
 
         # 找到source的路径地址
         try:
             if (res['changed']):
-                print("true")
                 source = self._find_needle('files', res['file'])
-                print("source", source)
             else:
-                print("false", res['msg'])
                 result['failed'] = True
                 result['msg'] = str(res['msg'])
                 return result
@@ -142,11 +835,7 @@ class ActionModule(ActionBase):
         # 获取本地文件，不存在抛出异常
         try:
             source_full = self._loader.get_real_file(source)
-            source_rel = os.path.basename(source_full)
-
-            print(os.path.isfile(source_full))
-
-            print(source_full, source_rel)
+            source_rel = res['basename']
         except AnsibleFileNotFound as err:
             result['failed'] = True
             result['msg'] = "could not find src=%s, %s" % (source, err)
@@ -154,15 +843,6 @@ class ActionModule(ActionBase):
 
             return result
 
-        try:
-            # 定义拷贝到远程的文件路径
-            tmp_src = self._connection._shell.join_path(
-                "/tmp", 'source')
-        except Exception as err:
-            print(err)
-
-        print("tmp_src: ", tmp_src)
-
         # 判断文件保存的路径
         dest = module_args['dest']
         if self._connection._shell.path_has_trailing_slash(dest):
@@ -170,30 +850,13 @@ class ActionModule(ActionBase):
         else:
             dest_file = dest
 
-        local_checksum = checksum(source_full)
-
-        # 远程文件
-        remote_path = None
-        remote_path = self._transfer_file(source_full, tmp_src)
-
-        # 确保我们的文件具有执行权限
-        if remote_path:
-            self._fixup_perms2(("/tmp", remote_path))
-
-        # 运行remote_copy 模块
-        new_module_args = self._task.args.copy()
-        new_module_args.update(
-            dict(
-                src=tmp_src,
-                dest=dest_file,
-                original_basename=source_rel,
-                checksum=local_checksum
-            )
-        )
+        # 下载时已计算sha1，无需再读一遍文件
+        local_checksum = res['checksum']
 
-        module_return = self._execute_module(module_name='my_gitlab',
-                                             module_args=new_module_args, task_vars=task_vars,
-                                             tmp=tmp)
+        # 传输到远程临时目录并运行 my_gitlab 模块，
+        # 启用差量传输时只传输变化的块，启用压缩时压缩后传输
+        module_return = self._remote_copy(source_full, dest_file, source_rel,
+                                          local_checksum, task_vars)
 
         # 判断运行结果
         if module_return.get('failed'):
@@ -204,12 +867,13 @@ class ActionModule(ActionBase):
 
         if module_return:
             result.update(module_return)
+            result['cached'] = res['cached']
         else:
             result.update(
                 dict(dest=module_args['dest'], src=module_args['src'], changed=changed))
 
         # 清理临时文件
-        self._remove_tmp_path(tmp)
+        self._remove_tmp_path(self._connection._shell.tmpdir)
 
         # 返回结果
         return result
@@ -4,28 +4,76 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
 from ansible.errors import AnsibleError, AnsibleFileNotFound
 from ansible.module_utils._text import to_text
-from ansible.utils.hashing import checksum
+from ansible.module_utils.common.text.formatters import human_to_bytes
+from ansible.module_utils.parsing.convert_bool import boolean
 
-from minio import Minio
 from minio.error import S3Error
+from urllib3.exceptions import HTTPError
 
 from tempfile import TemporaryDirectory
+from datetime import timedelta
 
 
 import os
+import posixpath
+import sys
 import shutil
+import uuid
 import random
 import string
 
+# role 的 module_utils 目录，管控端插件共用的代码放在这里
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.append(MODULE_UTILS_DIR)
+
+from my_artifact_cache import ArtifactCache, task_option  # noqa: E402
+from my_download_pool import run_parallel, DEFAULT_CONCURRENCY, DEFAULT_RETRIES  # noqa: E402
+from my_ranged_download import RangedDownloader, RangedDownloadError  # noqa: E402
+from my_client_pool import get_minio_client  # noqa: E402
+from my_background_job import job_status, start_job  # noqa: E402
+from my_governor import Governor  # noqa: E402
+from my_digest import available, source_digest  # noqa: E402
+from my_stream import BUDGET  # noqa: E402
+from my_delta import prepare_delta, DEFAULT_BLOCK_SIZE  # noqa: E402
+from my_compress import prepare_compressed  # noqa: E402
+from my_sync import make_bundle, safe_relpath, TMP_PREFIX  # noqa: E402
+from my_fanout import (Board, tree_parent, DEFAULT_FANOUT, DEFAULT_PORT,  # noqa: E402
+                       DEFAULT_SEED_DIR, DEFAULT_TIMEOUT, DEFAULT_TTL)
+
+display = Display()
+
+# 只在管控端使用的参数，不传给远程模块
+CONTROLLER_ARGS = ('cache', 'cache_dir', 'cache_max_size',
+                   'concurrency', 'retries', 'chunk_size', 'parts',
+                   'pool_size',
+                   'check_dest_first', 'presign_expires',
+                   'delta_transfer', 'delta_block_size', 'compression',
+                   'sync', 'delete', 'background', 'job_id',
+                   'source_limits', 'governor_dir', 'staging_dir',
+                   'stream_buffer', 'memory_limit',
+                   'distribution', 'distribution_fanout', 'distribution_port',
+                   'distribution_ttl', 'distribution_timeout',
+                   'distribution_bind', 'seed_dir',
+                   'checksum_algorithm')
+# 下载过程中可重试的网络错误，本地文件错误不重试
+RETRY_ERRORS = (HTTPError, ConnectionError, TimeoutError, RangedDownloadError)
+# 对象用户元数据中记录sha1的字段
+SHA1_META = 'x-amz-meta-sha1'
+# fetch_mode=remote 时预签名URL的默认有效期（秒）
+DEFAULT_PRESIGN_EXPIRES = 3600
+
 
 class MinioUtils(object):
     """
     操作minio
     """
 
-    def __init__(self, module) -> None:
+    def __init__(self, module, governor=None) -> None:
         self.module = module
         self.name = module['name']
         self.state = module['state']
@@ -43,24 +91,33 @@ class MinioUtils(object):
             'secret_key': self.secret_key,
             'secure': False,
         }
-        self.client = Minio(**self.minio_conf)
+        # 本次任务内按端点与凭据复用客户端及其长连接
+        self.client = get_minio_client(pool_size=module.get('pool_size'),
+                                       **self.minio_conf)
+        self.downloader = RangedDownloader(
+            self.client, chunk_size=module.get('chunk_size'),
+            parts=module.get('parts'), retries=module.get('retries'),
+            retry_on=RETRY_ERRORS, governor=governor,
+            buffer_size=module.get('stream_buffer'))
+        BUDGET.configure(module.get('memory_limit'))
 
     def bucket_list_files(self):
         """
         列出存储桶中所有对象
         :param bucket_name: 桶名
         :param prefix: 前缀
-        :return:
+        :return: 对象列表（含 etag、version_id 等信息）
         """
         try:
             files_list = self.client.list_objects(
                 bucket_name=self.bucket, prefix=self.src, recursive=True)
             lists = []
             for obj in files_list:
-                lists.append(obj.object_name)
+                lists.append(obj)
             return lists
         except S3Error as e:
-            print("[error]:", e)
+            display.warning("failed to list objects under %s: %s"
+                            % (self.src, to_text(e)))
 
     def CreateTmp(self):
         """
@@ -71,44 +128,136 @@ class MinioUtils(object):
         with TemporaryDirectory() as dirname:
             return dirname
 
-    def fget_minio(self):
+    def cache_key(self, obj):
+        """
+        对象的缓存键：优先使用对象版本，其次使用ETag
+        """
+        return ArtifactCache.make_key('minio', self.endpoint, self.bucket,
+                                      obj.object_name,
+                                      obj.version_id or obj.etag)
+
+    def expected_checksum(self, obj, cache=None):
+        """
+        不下载对象获取其内容的sha1
+        优先使用缓存记录的 ETag→sha1 映射，其次使用对象用户元数据中的sha1
+        :return: sha1，无法获得时返回None
+        """
+        if cache is not None:
+            value = cache.get_checksum(self.cache_key(obj))
+            if value:
+                return value
+
+        try:
+            stat = self.client.stat_object(
+                self.bucket, obj.object_name, version_id=obj.version_id)
+        except (S3Error, HTTPError):
+            return None
+        return (stat.metadata or {}).get(SHA1_META)
+
+    def presigned_url(self, obj, expires=DEFAULT_PRESIGN_EXPIRES):
+        """
+        生成对象的预签名下载地址，目标主机无需minio凭据即可直接下载
+        """
+        return self.client.presigned_get_object(
+            self.bucket, obj.object_name,
+            expires=timedelta(seconds=int(expires)),
+            version_id=obj.version_id)
+
+    def download(self, obj, file_path, part_path=None):
+        """
+        下载单个对象，大对象分段并发下载
+        :return: (对象信息, 下载过程中计算的sha1)
+        """
+        return self.downloader.download(
+            self.bucket, obj.object_name, file_path, part_path=part_path,
+            version_id=obj.version_id)
+
+    def fget_object(self, obj, tmpdir, cache=None):
+        """
+        下载单个对象，启用缓存时从缓存获取
+        :return: 对象信息
+        """
+        basename = obj.object_name.split("/")[-1]
+        result = {}
+
+        if cache is not None:
+            key = self.cache_key(obj)
+            fullname, hit = cache.fetch(
+                key, lambda path: self.download(
+                    obj, path, part_path=cache.partial_path(key))[1])
+            data = obj
+            result['cached'] = hit
+            result['checksum'] = cache.file_checksum(key)
+        else:
+            ran_str = ''.join(random.sample(
+                string.ascii_letters + string.digits, 12))
+            filenameTmp = "{}/{}".format(tmpdir, ran_str)
+
+            fullname = "{}/{}".format(filenameTmp, basename)
+
+            data, result['checksum'] = self.download(obj, fullname)
+            result['cached'] = False
+
+        result['object_name'] = obj.object_name
+        result['cache_key'] = self.cache_key(obj)
+        result['size'] = data.size
+        result['etag'] = data.etag
+        result['content_type'] = data.content_type
+        result['last_modified'] = data.last_modified
+        result['metadata'] = data.metadata
+        result['fullname'] = fullname
+        result['basename'] = basename
+        result['tmpdir'] = tmpdir
+        return result
+
+    def fget_minio(self, cache=None, concurrency=DEFAULT_CONCURRENCY,
+                   retries=DEFAULT_RETRIES, lists=None):
         """
-        下载保存文件保存本地
-        :param bucket_name:
-        :param file:
-        :param file_path:
-        :return:
+        下载保存文件保存本地，前缀下的多个对象并发下载
+        :param cache: ArtifactCache，为None时下载到临时目录
+        :param concurrency: 并发下载数
+        :param retries: 单个对象失败后的重试次数
+        :param lists: 已列出的对象，为None时重新列出
+        :return: 最后一个对象的信息，objects 为全部对象的信息
         """
         try:
+            if not self.client.bucket_exists(self.bucket):
+                return 'Bucket does not exist'
+
             tmpdir = self.CreateTmp()
-            lists = self.bucket_list_files()
-            for obj in lists:
-                if not self.client.bucket_exists(self.bucket):
-                    return 'Bucket does not exist'
-
-                ran_str = ''.join(random.sample(
-                    string.ascii_letters + string.digits, 12))
-                filenameTmp = "{}/{}".format(tmpdir, ran_str)
-
-                fullname = "{}/{}".format(filenameTmp,
-                                          obj.split("/")[-1])
-
-                data = self.client.fget_object(
-                    self.bucket, obj, fullname)
-                result = {}
-                result['size'] = data.size
-                result['etag'] = data.etag
-                result['content_type'] = data.content_type
-                result['last_modified'] = data.last_modified
-                result['metadata'] = data.metadata
-                result['fullname'] = fullname
-                result['tmpdir'] = tmpdir
+            if lists is None:
+                lists = self.bucket_list_files()
+            if not lists:
+                return 'Object %s does not exist' % self.src
+
+            objects = run_parallel(
+                lambda obj: self.fget_object(obj, tmpdir, cache), lists,
+                concurrency=concurrency, retries=retries,
+                retry_on=RETRY_ERRORS)
 
+            result = dict(objects[-1])
+            result['objects'] = objects
             return result
-        except S3Error as err:
+        except (S3Error, HTTPError, OSError) as err:
             return err
 
 
+def background_fetch(params, cache):
+    """
+    后台任务入口（见 my_background_job）：把对象下载到管控端缓存，稍后的任务直接从缓存传输
+    :return: 各对象的信息
+    """
+    governor = Governor.from_task(params['endpoint'], params, {})
+    res = MinioUtils(params, governor).fget_minio(
+        cache, concurrency=params.get('concurrency') or DEFAULT_CONCURRENCY,
+        retries=params.get('retries') or DEFAULT_RETRIES)
+    if not isinstance(res, dict):
+        raise AnsibleError(to_text(res))
+    return [dict(object_name=obj['object_name'], size=obj['size'],
+                 etag=obj['etag'], checksum=obj['checksum'])
+            for obj in res['objects']]
+
+
 class ActionModule(ActionBase):
     """
     在ansible 管控端执行的逻辑
@@ -137,51 +286,611 @@ class ActionModule(ActionBase):
 
         return result
 
-    def _remote_copy(self, src, desc, rel, checksum, task_vars):
+    def _module_args(self, task_vars):
+        """
+        远程模块参数：去掉只在管控端使用的参数，补充role变量中的默认值
+        """
+        new_module_args = self._task.args.copy()
+        for arg in CONTROLLER_ARGS:
+            new_module_args.pop(arg, None)
+        new_module_args['checksum_index'] = boolean(task_option(
+            self._task.args, task_vars, 'checksum_index',
+            'artifact_checksum_index', False), strict=False)
+        return new_module_args
+
+    def _remote_checksum(self, path, task_vars):
+        """
+        获取目标文件的sha1
+        启用校验值索引时由远程模块查询索引，否则使用stat模块计算
+        :return: {'exists': ..., 'checksum': ...}
+        """
+        new_module_args = self._module_args(task_vars)
+        if not new_module_args['checksum_index']:
+            return self._execute_remote_stat(
+                path, all_vars=task_vars, follow="yes", checksum="yes")
+
+        new_module_args.update(
+            dict(dest=path, stat_only=True, fetch_mode='controller',
+                 original_basename=None))
+        module_return = self._execute_module(module_name='my_minio',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+        if module_return.get('failed'):
+            raise AnsibleError("Failed to get information on remote file (%s): %s"
+                               % (path, module_return.get('msg', '')))
+        return module_return
+
+    def _delta_block_size(self, task_vars):
+        """
+        差量传输的块大小，未启用差量传输时返回None
+        """
+        enabled = task_option(self._task.args, task_vars, 'delta_transfer',
+                              'artifact_delta_transfer', False)
+        if not boolean(enabled, strict=False):
+            return None
+        return human_to_bytes(task_option(
+            self._task.args, task_vars, 'delta_block_size',
+            'artifact_delta_block_size', DEFAULT_BLOCK_SIZE))
+
+    def _dest_signature(self, path, block_size, task_vars):
+        """
+        获取目标文件的sha1与分块签名，一次远程调用代替stat
+        :return: {'exists': ..., 'checksum': ..., 'signatures': [...]}
+        """
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(dest=path, delta_signature=True, delta_block_size=block_size,
+                 fetch_mode='controller', original_basename=None))
+        module_return = self._execute_module(module_name='my_minio',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+        if module_return.get('failed'):
+            raise AnsibleError("Failed to get information on remote file (%s): %s"
+                               % (path, module_return.get('msg', '')))
+        return module_return
+
+    def _upload(self, local_path, final_dest, checksum):
+        """
+        上传单个文件：优先放在目标文件所在的目录，与目标同一文件系统，模块安装时只需rename；
+        目录不存在或不可写时放到远程临时目录
+        :return: (远程路径, 是否放在目标目录，此时由模块负责删除)
+        """
+        shell = self._connection._shell
+        name = '%s-%s-%s' % (TMP_PREFIX, checksum, uuid.uuid4().hex[:8])
+        dest_dir = posixpath.dirname(final_dest)
+        if dest_dir:
+            path = shell.join_path(dest_dir, name)
+            try:
+                self._transfer_file(local_path, path)
+                self._fixup_perms2((path,), execute=False)
+                return path, True
+            except AnsibleError:
+                self._remote_remove(path)
+
+        if shell.tmpdir is None:
+            self._make_tmp_path()
+        path = shell.join_path(shell.tmpdir, name)
+        self._transfer_file(local_path, path)
+        self._fixup_perms2((shell.tmpdir, path), execute=False)
+        return path, False
+
+    def _remote_remove(self, path):
+        """
+        删除目标目录中残留的上传文件
+        """
+        self._low_level_execute_command(self._connection._shell.remove(path))
+
+    def _digest_args(self, src, task_vars):
+        """
+        checksum_algorithm 不是sha1时，附带管控端计算的源文件摘要，
+        目标主机按该算法校验传输结果，代替计算sha1
+        """
+        algorithm = task_option(self._task.args, task_vars,
+                                'checksum_algorithm',
+                                'artifact_checksum_algorithm', 'sha1')
+        if algorithm == 'sha1' or not available(algorithm):
+            return {}
+        cache = ArtifactCache.from_task(self._task.args, task_vars)
+        return dict(digest=source_digest(src, algorithm, cache),
+                    digest_algorithm=algorithm)
+
+    def _install_staged(self, desc, rel, checksum, task_vars):
+        """
+        文件已由 my_prefetch 暂存到目标主机时，只需在主机本地校验并移动
+        :return: 模块返回值，未配置暂存目录或文件未暂存时返回None
+        """
+        staging_dir = task_option(self._task.args, task_vars, 'staging_dir',
+                                  'artifact_staging_dir')
+        if not staging_dir:
+            return None
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(src=checksum, dest=desc, original_basename=rel,
+                 checksum=checksum, fetch_mode='controller',
+                 staging_dir=staging_dir))
+        module_return = self._execute_module(module_name='my_minio',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+        if module_return.get('staged_missing'):
+            return None
+        return module_return
+
+    def _remote_copy(self, src, desc, rel, checksum, task_vars,
+                     signatures=None, block_size=None, compression=None):
         """
         传输文件
+        :param signatures: 目标文件的分块签名，提供时只传输差量
+        :param compression: 传输压缩算法 auto/zstd/gzip/none，默认取role变量
         """
+        if compression is None:
+            # gzip重试时已确认文件未暂存
+            module_return = self._install_staged(desc, rel, checksum, task_vars)
+            if module_return is not None:
+                return module_return
+            compression = task_option(self._task.args, task_vars,
+                                      'compression',
+                                      'artifact_transfer_compression', 'none')
 
         # print("_remote_copy", task_vars)
 
-        # 传输文件
-        remote_path = None
-        remote_path = self._transfer_file(src, desc)
-        tmp = "/tmp"
+        delta_path = None
+        if signatures:
+            delta_path = prepare_delta(src, signatures, block_size)
 
-        # 确保我们的文件具有执行权限
-        if remote_path:
-            self._fixup_perms2((tmp, remote_path))
+        # 差量之后再压缩，已压缩的内容原样传输
+        codec, packed_path = prepare_compressed(delta_path or src, compression)
+
+        # 传输文件到目标文件旁（或远程临时目录），由远程模块校验后移动到目标路径
+        final_dest = desc
+        if rel and desc.endswith('/'):
+            final_dest = posixpath.join(desc, rel)
+        try:
+            tmp_src, beside_dest = self._upload(
+                packed_path or delta_path or src, final_dest, checksum)
+        finally:
+            for path in (delta_path, packed_path):
+                if path:
+                    os.remove(path)
 
         # 远程验证
-        new_module_args = self._task.args.copy()
+        new_module_args = self._module_args(task_vars)
         new_module_args.update(
             dict(
-                src=src,
+                src=tmp_src,
                 dest=desc,
                 checksum=checksum,
                 original_basename=rel,
+                delta=delta_path is not None,
+                delta_block_size=block_size or DEFAULT_BLOCK_SIZE,
+                compression=codec,
+                remove_src=beside_dest,
             )
         )
+        new_module_args.update(self._digest_args(src, task_vars))
 
         module_return = self._execute_module(module_name='my_minio',
                                              module_args=new_module_args, task_vars=task_vars
                                              )
 
+        # 目标主机不支持该摘要算法时改用sha1校验，临时文件仍在原处
+        if module_return.get('unsupported_digest'):
+            for arg in ('digest', 'digest_algorithm'):
+                new_module_args.pop(arg, None)
+            module_return = self._execute_module(module_name='my_minio',
+                                                 module_args=new_module_args,
+                                                 task_vars=task_vars)
+
+        if module_return.get('failed') and beside_dest:
+            self._remote_remove(tmp_src)
+
+        # 目标主机无法解压zstd时改用gzip重新传输
+        if module_return.get('unsupported_compression') and codec != 'gzip':
+            return self._remote_copy(src, desc, rel, checksum, task_vars,
+                                     signatures=signatures,
+                                     block_size=block_size,
+                                     compression='gzip')
+
         return module_return
 
+    def _distribution(self, task_vars):
+        """
+        树形分发的参数，未启用或本批只有一台主机时返回None
+        """
+        args = self._task.args
+        mode = task_option(args, task_vars, 'distribution',
+                           'artifact_distribution', 'controller')
+        hosts = list(task_vars.get('ansible_play_batch') or [])
+        if mode != 'tree' or len(hosts) < 2:
+            return None
+        return dict(
+            hosts=hosts,
+            fanout=int(task_option(args, task_vars, 'distribution_fanout',
+                                   'artifact_distribution_fanout',
+                                   DEFAULT_FANOUT)),
+            port=int(task_option(args, task_vars, 'distribution_port',
+                                 'artifact_distribution_port', DEFAULT_PORT)),
+            ttl=int(task_option(args, task_vars, 'distribution_ttl',
+                                'artifact_distribution_ttl', DEFAULT_TTL)),
+            timeout=int(task_option(args, task_vars, 'distribution_timeout',
+                                    'artifact_distribution_timeout',
+                                    DEFAULT_TIMEOUT)),
+            bind=task_option(args, task_vars, 'distribution_bind',
+                             'artifact_distribution_bind'),
+            seed_dir=task_option(args, task_vars, 'seed_dir',
+                                 'artifact_seed_dir', DEFAULT_SEED_DIR))
+
+    @staticmethod
+    def _seed_address(host, bind, task_vars):
+        """
+        host 提供下载时监听的地址：distribution_bind，未设置时为 ansible_host
+        """
+        if bind:
+            return bind
+        try:
+            return task_vars['hostvars'][host].get('ansible_host') or host
+        except (KeyError, TypeError):
+            return host
+
+    @staticmethod
+    def _seed_url(address, port, token, checksum):
+        """
+        下级主机从 host 下载文件的URL
+        """
+        if ':' in address:
+            address = '[%s]' % address
+        return 'http://%s:%d/%s/%s' % (address, port, token, checksum)
+
+    def _fetch_peer(self, url, desc, checksum, size, task_vars):
+        """
+        从上级主机下载，复用 fetch_mode=remote 的下载与sha1/大小校验
+        """
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(dest=desc, original_basename=None, fetch_mode='remote',
+                 presigned_url=url, checksum=checksum, etag=None, size=size))
+        return self._execute_module(module_name='my_minio',
+                                    module_args=new_module_args,
+                                    task_vars=task_vars)
+
+    def _distribute(self, desc, checksum, size, task_vars, copy=None):
+        """
+        树形分发：前 fanout 台主机从管控端接收，其余主机从上级主机下载，
+        完成后再通过 my_seed 提供给自己的下级。上级失败或超时时改为从管控端传输
+        :param copy: 从管控端传输的函数，返回模块结果；为None时目标文件已是最新，只提供下载
+        :return: 模块返回值，未启用树形分发且 copy 为None时返回None
+        """
+        dist = self._distribution(task_vars)
+        if dist is None:
+            return copy() if copy else None
+
+        host = task_vars.get('inventory_hostname')
+        board = Board(self._task._uuid)
+        url = None
+        try:
+            module_return = dict(changed=False, dest=desc,
+                                 msg="file already exists")
+            if copy is not None:
+                module_return = None
+                parent = tree_parent(dist['hosts'], host, dist['fanout'])
+                marker = None
+                if parent is not None:
+                    marker = board.wait(parent, dist['timeout'])
+                if (marker and marker.get('url')
+                        and marker.get('checksum') == checksum):
+                    module_return = self._fetch_peer(marker['url'], desc,
+                                                     checksum, size, task_vars)
+                    if module_return.get('failed'):
+                        module_return = None
+                    else:
+                        module_return['distributed_from'] = parent
+                if module_return is None:
+                    module_return = copy()
+                    module_return['distributed_from'] = 'controller'
+
+            if not module_return.get('failed'):
+                address = self._seed_address(host, dist['bind'], task_vars)
+                seed = self._execute_module(
+                    module_name='my_seed',
+                    module_args=dict(path=module_return.get('dest') or desc,
+                                     checksum=checksum,
+                                     seed_dir=dist['seed_dir'],
+                                     bind=address,
+                                     port=dist['port'], ttl=dist['ttl']),
+                    task_vars=task_vars)
+                if seed.get('serving') and seed.get('token'):
+                    url = self._seed_url(address, dist['port'],
+                                         seed['token'], checksum)
+        finally:
+            # 无论成功与否都要记录，下级主机不必等到超时
+            board.publish(host, checksum, url)
+            self._published = True
+        return module_return
+
+    def _publish_unavailable(self, task_vars):
+        """
+        树形分发时本主机在分发前就已失败或返回，记录为无法提供下载，
+        下级主机立即改为从管控端获取
+        """
+        if self._distribution(task_vars) is None:
+            return
+        Board(self._task._uuid).publish(task_vars.get('inventory_hostname'),
+                                        None)
+
+    @staticmethod
+    def _dest_path(dest, basename):
+        """
+        判断文件保存的路径：dest 不带扩展名时视为目录
+        """
+        if len(dest.split(".")) == 1:
+            return "{}/{}".format(dest, basename)
+        return dest
+
+    def _dest_status(self, path, task_vars):
+        """
+        目标文件的状态，启用差量传输时同时取回分块签名
+        """
+        block_size = self._delta_block_size(task_vars)
+        if block_size:
+            return self._dest_signature(path, block_size, task_vars)
+        return self._remote_checksum(path, task_vars)
+
+    def _check_dest_first(self, mcli, lists, cache, task_vars):
+        """
+        下载前先检查目标主机上的文件，sha1与对象一致时无需下载
+        :return: (目标文件已是最新时为 (sha1, 目标路径)，否则为None,
+                  已获取的 {目标路径: 目标文件状态}，下载后直接使用，不再查询)
+        """
+        if not lists:
+            return None, {}
+
+        # 与下载流程一致，以最后一个对象作为传输的文件
+        obj = lists[-1]
+        expected = mcli.expected_checksum(obj, cache)
+        if not expected:
+            return None, {}
+
+        descfull = self._dest_path(mcli.dest, obj.object_name.split("/")[-1])
+        dest_status = self._dest_status(descfull, task_vars)
+        if dest_status['exists'] and dest_status['checksum'] == expected:
+            return (expected, descfull), {}
+        return None, {descfull: dest_status}
+
+    def _fetch_remote(self, mcli, lists, cache, task_vars):
+        """
+        fetch_mode=remote：目标主机通过预签名URL直接从minio下载
+        管控端只负责列出对象、提供期望的sha1/ETag/大小，由远程模块校验
+        """
+        obj = lists[-1]
+        expected = mcli.expected_checksum(obj, cache)
+        expires = task_option(self._task.args, task_vars, 'presign_expires',
+                              'artifact_presign_expires',
+                              DEFAULT_PRESIGN_EXPIRES)
+
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(
+                src=obj.object_name,
+                dest=self._dest_path(mcli.dest,
+                                     obj.object_name.split("/")[-1]),
+                fetch_mode='remote',
+                presigned_url=mcli.presigned_url(obj, expires),
+                checksum=expected,
+                etag=obj.etag,
+                size=obj.size,
+            )
+        )
+
+        module_return = self._execute_module(module_name='my_minio',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+
+        # ETag(md5)校验通过时主机返回的sha1可信，记录下来供后续比对
+        if (cache is not None and expected is None
+                and module_return.get('etag_verified')):
+            cache.set_checksum(mcli.cache_key(obj), module_return['checksum'])
+
+        return module_return
+
+    def _push_bundle(self, send, extras, dest, task_vars, compression=None):
+        """
+        变化的文件打包为一个tar传输，由远程模块逐个校验、移动，并删除多余文件
+        :param send: [(本地路径, 相对路径, sha1)]
+        :param extras: 需要删除的相对路径
+        """
+        if compression is None:
+            compression = task_option(self._task.args, task_vars,
+                                      'compression',
+                                      'artifact_transfer_compression', 'none')
+
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(src='', dest=dest, sync=True, fetch_mode='controller',
+                 original_basename=None, delete_files=extras,
+                 files=dict((rel, checksum) for path, rel, checksum in send)))
+
+        if send:
+            if self._connection._shell.tmpdir is None:
+                self._make_tmp_path()
+            tmp = self._connection._shell.tmpdir
+            tmp_src = self._connection._shell.join_path(tmp, 'bundle')
+
+            bundle = make_bundle([(path, rel) for path, rel, checksum in send])
+            codec, packed_path = prepare_compressed(bundle, compression)
+            try:
+                remote_path = self._transfer_file(packed_path or bundle,
+                                                  tmp_src)
+            finally:
+                for path in (bundle, packed_path):
+                    if path:
+                        os.remove(path)
+            if remote_path:
+                self._fixup_perms2((tmp, remote_path))
+            new_module_args.update(dict(src=tmp_src, compression=codec))
+
+        module_return = self._execute_module(module_name='my_minio',
+                                             module_args=new_module_args,
+                                             task_vars=task_vars)
+
+        # 目标主机无法解压zstd时改用gzip重新传输
+        if (module_return.get('unsupported_compression')
+                and new_module_args.get('compression') != 'gzip'):
+            return self._push_bundle(send, extras, dest, task_vars,
+                                     compression='gzip')
+        return module_return
+
+    def _sync_dir(self, mcli, cache, task_vars):
+        """
+        目录同步：对比前缀下对象的清单（key/大小/ETag）与目标目录的清单（路径/大小/sha1），
+        只下载、传输新增或变化的文件，delete 为真时删除目标目录中多余的文件
+        """
+        prefix = mcli.src.rstrip('/') + '/'
+        mcli.src = prefix
+        lists = mcli.bucket_list_files()
+        if lists is None:
+            return dict(failed=True, msg='Failed to list objects under %s' % prefix)
+
+        objects = {}
+        for obj in lists:
+            if not obj.is_dir:
+                objects[safe_relpath(obj.object_name[len(prefix):])] = obj
+
+        # 目标目录的清单，只对大小一致的文件计算sha1
+        new_module_args = self._module_args(task_vars)
+        new_module_args.update(
+            dict(dest=mcli.dest, manifest=True, fetch_mode='controller',
+                 original_basename=None,
+                 sizes=dict((rel, obj.size) for rel, obj in objects.items())))
+        manifest = self._execute_module(module_name='my_minio',
+                                        module_args=new_module_args,
+                                        task_vars=task_vars)
+        if manifest.get('failed'):
+            return dict(failed=True, msg="Failed to get manifest of %s: %s"
+                        % (mcli.dest, manifest.get('msg', '')))
+        host_files = manifest['files']
+
+        concurrency = task_option(self._task.args, task_vars, 'concurrency',
+                                  'artifact_download_concurrency',
+                                  DEFAULT_CONCURRENCY)
+        retries = task_option(self._task.args, task_vars, 'retries',
+                              'artifact_download_retries', DEFAULT_RETRIES)
+
+        # 大小一致时用已知的sha1比较，不知道sha1的对象下载后再比较
+        def needs_fetch(item):
+            rel, obj = item
+            current = host_files.get(rel)
+            if current is None or current['size'] != obj.size:
+                return True
+            return mcli.expected_checksum(obj, cache) != current['checksum']
+
+        items = sorted(objects.items())
+        flags = run_parallel(needs_fetch, items, concurrency=concurrency,
+                             retries=retries, retry_on=RETRY_ERRORS)
+        candidates = [item for item, flag in zip(items, flags) if flag]
+
+        tmpdir = mcli.CreateTmp()
+        try:
+            downloaded = run_parallel(
+                lambda item: mcli.fget_object(item[1], tmpdir, cache),
+                candidates, concurrency=concurrency, retries=retries,
+                retry_on=RETRY_ERRORS)
+
+            send = [(res['fullname'], rel, res['checksum'])
+                    for (rel, obj), res in zip(candidates, downloaded)
+                    if host_files.get(rel, {}).get('checksum') != res['checksum']]
+            extras = []
+            if boolean(self._task.args.get('delete', False), strict=False):
+                extras = sorted(set(host_files) - set(objects))
+
+            result = dict(changed=False, dest=mcli.dest, objects=len(objects),
+                          changed_files=[], deleted_files=[])
+            if not send and not extras:
+                result['msg'] = "directory already in sync"
+                return result
+
+            module_return = self._push_bundle(send, extras, mcli.dest,
+                                              task_vars)
+        finally:
+            if os.path.isdir(tmpdir):
+                shutil.rmtree(tmpdir)
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+
+        if module_return.get('failed'):
+            return module_return
+        result.update(changed=module_return.get('changed', False),
+                      changed_files=module_return.get('changed_files', []),
+                      deleted_files=module_return.get('deleted_files', []))
+        return result
+
+    def _job_status(self, result, task_vars):
+        """
+        查询后台下载任务的状态，配合 until/retries 轮询
+        """
+        cache = ArtifactCache.from_task(self._task.args, task_vars)
+        if cache is None:
+            result['failed'] = True
+            result['msg'] = "job_id requires the artifact cache"
+            return result
+
+        status = job_status(cache, self._task.args['job_id'])
+        result.update(changed=False, job_id=status['job_id'],
+                      finished=status.get('finished', False),
+                      result=status.get('result'))
+        if status.get('failed'):
+            result['failed'] = True
+            result['msg'] = status.get('msg')
+        return result
+
+    def _start_background(self, result, module_args, cache, task_vars):
+        """
+        background=true：在管控端后台进程中下载并立即返回job_id，
+        相同对象的任务共用一个后台进程
+        """
+        if cache is None:
+            result['failed'] = True
+            result['msg'] = "background requires the artifact cache"
+            return result
+
+        params = dict(module_args)
+        params['concurrency'] = task_option(module_args, task_vars,
+                                            'concurrency',
+                                            'artifact_download_concurrency',
+                                            DEFAULT_CONCURRENCY)
+        for arg, var in (('source_limits', 'artifact_source_limits'),
+                         ('governor_dir', 'artifact_governor_dir')):
+            params[arg] = task_option(module_args, task_vars, arg, var)
+        job_id = ArtifactCache.make_key(
+            'my_minio', module_args['endpoint'], module_args['bucket'],
+            module_args['src'], module_args['dest'])[:16]
+        status = start_job(cache, os.path.abspath(__file__), params, job_id)
+        result.update(changed=False, job_id=job_id, started=status['started'],
+                      finished=False)
+        return result
+
     def run(self, tmp=None, task_vars=None):
         ''' handler for file transfer operations '''
 
         if task_vars is None:
             task_vars = dict()
 
+        # 任何返回路径或异常都要在分发树中留下记录，下级主机不必等到超时
+        self._published = False
+        try:
+            return self._run(tmp, task_vars)
+        finally:
+            if not self._published:
+                self._publish_unavailable(task_vars)
+
+    def _run(self, tmp, task_vars):
         result = super(ActionModule, self).run(tmp, task_vars)
         del tmp  # tmp no longer has any effect
 
         if result.get('skipped'):
             return result
 
+        # 查询后台下载任务的状态
+        if self._task.args.get('job_id'):
+            return self._job_status(result, task_vars)
+
         # 获取参数
         module_args = self._task.args.copy()
         module_args['src'] = self._task.args.get(
@@ -205,6 +914,23 @@ class ActionModule(ActionBase):
         module_args['secret_key'] = self._task.args.get(
             'secret_key', None)
 
+        # 大对象分段下载参数
+        module_args['chunk_size'] = task_option(
+            module_args, task_vars, 'chunk_size', 'artifact_download_chunk_size')
+        module_args['parts'] = task_option(
+            module_args, task_vars, 'parts', 'artifact_download_parts')
+        module_args['retries'] = task_option(
+            module_args, task_vars, 'retries', 'artifact_download_retries',
+            DEFAULT_RETRIES)
+        module_args['pool_size'] = task_option(
+            module_args, task_vars, 'pool_size', 'artifact_http_pool_size')
+        # 流式下载的块大小与每个fork的缓冲内存上限
+        module_args['stream_buffer'] = task_option(
+            module_args, task_vars, 'stream_buffer', 'artifact_stream_buffer')
+        module_args['memory_limit'] = task_option(
+            module_args, task_vars, 'memory_limit',
+            'artifact_stream_memory_limit')
+
         # 判定参数
         result['failed'] = True
         if module_args['src'] is None or module_args['dest'] is None:
@@ -217,15 +943,77 @@ class ActionModule(ActionBase):
             return self._ensure_invocation(result)
 
         # # 获取minio 文件
-        mcli = MinioUtils(module_args)
+        # 按端点限制拉取的带宽与并发连接数，所有fork共用
+        governor = Governor.from_task(module_args['endpoint'], module_args,
+                                      task_vars)
+        mcli = MinioUtils(module_args, governor)
         # print("开始下载")
-        res = mcli.fget_minio()
+        cache = ArtifactCache.from_task(module_args, task_vars)
+
+        # 后台下载到管控端缓存，立即返回job_id
+        if boolean(module_args.get('background', False), strict=False):
+            return self._start_background(result, module_args, cache,
+                                          task_vars)
+
+        # 目录同步：前缀下的对象与目标目录比对，只传输变化的文件
+        if boolean(module_args.get('sync', False), strict=False):
+            try:
+                result.update(self._sync_dir(mcli, cache, task_vars))
+            except (S3Error, HTTPError, AnsibleError, ValueError,
+                    OSError) as err:
+                result['failed'] = True
+                result['msg'] = to_text(err)
+            return result
+
+        # 先检查目标文件，已是最新时跳过下载
+        lists = None
+        checked = {}
+        check_dest_first = task_option(module_args, task_vars,
+                                       'check_dest_first',
+                                       'artifact_check_dest_first', True)
+        if boolean(check_dest_first, strict=False):
+            lists = mcli.bucket_list_files()
+            up_to_date, checked = self._check_dest_first(mcli, lists, cache,
+                                                         task_vars)
+            if up_to_date:
+                result['msg'] = "file already exists"
+                result['skipped'] = True
+                result['local_checksum'], result['dest'] = up_to_date
+                result['dest_checksum'] = result['local_checksum']
+                self._distribute(result['dest'], result['local_checksum'],
+                                 None, task_vars)
+                return result
+
+        fetch_mode = task_option(module_args, task_vars, 'fetch_mode',
+                                 'artifact_fetch_mode', 'controller')
+        if fetch_mode == 'remote':
+            if lists is None:
+                lists = mcli.bucket_list_files()
+            if not lists:
+                result['failed'] = True
+                result['msg'] = 'Object %s does not exist' % mcli.src
+                return result
+
+            result.update(self._fetch_remote(mcli, lists, cache, task_vars))
+            return result
+
+        res = mcli.fget_minio(
+            cache,
+            concurrency=task_option(module_args, task_vars, 'concurrency',
+                                    'artifact_download_concurrency',
+                                    DEFAULT_CONCURRENCY),
+            retries=module_args['retries'], lists=lists)
         # print("res: ", res)
 
+        if not isinstance(res, dict):
+            result['failed'] = True
+            result['msg'] = to_text(res)
+            return result
+
         # # 获取本地文件，不存在抛出异常
         try:
             source_full = self._loader.get_real_file(res['fullname'])
-            source_rel = os.path.basename(res['fullname'])
+            source_rel = res['basename']
 
             # print("source_full:", source_full)
             # print("source_rel:", source_rel)
@@ -241,17 +1029,17 @@ class ActionModule(ActionBase):
         # print("tmp_src", source_full)
 
         # # 判断文件保存的路径
-        descfull = ""
-        if len(module_args['dest'].split(".")) == 1:
-            descfull = "{}/{}".format(module_args['dest'], source_rel)
-        else:
-            descfull = module_args['dest']
+        descfull = self._dest_path(module_args['dest'], source_rel)
 
         # print("descfull:", descfull)
         # # 校验码校验，一致这不传输文件，不一致这传输
-        local_checksum = checksum(source_full)
-        dest_status = self._execute_remote_stat(
-            descfull, all_vars=task_vars, follow="yes", checksum="yes")
+        # 下载时已计算sha1（启用缓存时记录为 ETag→sha1），无需再读一遍文件
+        local_checksum = res['checksum']
+        # 启用差量传输时同时取回目标文件的分块签名；下载前已查询过时直接使用
+        block_size = self._delta_block_size(task_vars)
+        dest_status = checked.get(descfull)
+        if dest_status is None:
+            dest_status = self._dest_status(descfull, task_vars)
 
         module_return = None
         result["local_checksum"] = local_checksum
@@ -264,28 +1052,52 @@ class ActionModule(ActionBase):
                 文件相同，不传输文件
                 """
 
-                print("文件相同，不传输文件")
-                print("local_checksum", local_checksum)
-                print("desc_checksum", dest_status['checksum'])
+                display.vvv("%s is up to date (sha1 %s), not transferring"
+                            % (descfull, local_checksum))
                 result['msg'] = "file already exists"
                 result['skipped'] = True
+                self._distribute(descfull, local_checksum, None, task_vars)
                 return result
             else:
-                module_return = self._remote_copy(
-                    source_full, descfull, source_rel, local_checksum,  task_vars)
+                module_return = self._distribute(
+                    descfull, local_checksum, res['size'], task_vars,
+                    copy=lambda: self._remote_copy(
+                        source_full, descfull, source_rel, local_checksum,
+                        task_vars, signatures=dest_status.get('signatures'),
+                        block_size=block_size))
         else:
             """
             目标服务没有这个文件
             """
-            print("目标服务没有这个文件")
-            module_return = self._remote_copy(
-                source_full, descfull, source_rel, local_checksum, task_vars)
+            display.vvv("%s does not exist on the host" % descfull)
+            module_return = self._distribute(
+                descfull, local_checksum, res['size'], task_vars,
+                copy=lambda: self._remote_copy(
+                    source_full, descfull, source_rel, local_checksum,
+                    task_vars))
 
         # 清理临时文件
         # self._remove_tmp_path(res["fullname"])
         # os.remove(res["fullname"])
-        shutil.rmtree(res["tmpdir"])
-        result["msg"] = module_return["invocation"]["module_args"]
+        if os.path.isdir(res["tmpdir"]):
+            shutil.rmtree(res["tmpdir"])
+        self._remove_tmp_path(self._connection._shell.tmpdir)
+        result["cached"] = res['cached']
+        result["objects"] = [
+            dict(object_name=obj['object_name'], size=obj['size'],
+                 etag=obj['etag'], cached=obj['cached'])
+            for obj in res['objects']]
+        if module_return.get('distributed_from'):
+            result['distributed_from'] = module_return['distributed_from']
+
+        # 判断运行结果：远程校验、解压、差量重建等失败时任务失败
+        if module_return.get('failed'):
+            result['failed'] = True
+            result['msg'] = module_return.get('msg', '')
+            return result
+        result['changed'] = module_return.get('changed', False)
+        result["msg"] = module_return.get("invocation", {}).get(
+            "module_args", module_return.get('msg'))
 
         # 返回结果
         return result
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.plugins.action import ActionBase
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
+
+import importlib.util
+import os
+import sys
+
+# role 的 module_utils 目录，管控端插件共用的代码放在这里
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.append(MODULE_UTILS_DIR)
+
+from my_artifact_cache import ArtifactCache, task_option  # noqa: E402
+from my_download_pool import DEFAULT_CONCURRENCY, DEFAULT_RETRIES  # noqa: E402
+from my_compress import prepare_compressed  # noqa: E402
+from my_governor import Governor  # noqa: E402
+from my_sync import make_bundle  # noqa: E402
+
+# 预取目标：controller 只填充管控端缓存；host 同时暂存到目标主机
+TARGETS = ('controller', 'host')
+
+
+def _load_plugin(name):
+    """
+    加载同目录下的action插件，复用其中的 MinioUtils/GitlabUtils
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        name + '.py')
+    spec = importlib.util.spec_from_file_location('my_prefetch_' + name, path)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+class ActionModule(ActionBase):
+    """
+    预取制品：在部署窗口之前下载到管控端缓存，并可暂存到目标主机，
+    窗口内的 my_minio/my_gitlab 任务只需在主机本地 atomic_move
+    """
+
+    def _fetch_minio(self, artifact, cache, task_vars):
+        """
+        通过 my_minio 的 MinioUtils 下载对象到缓存
+        :return: [{'name', 'file', 'checksum', 'cached'}]
+        """
+        minio = _load_plugin('my_minio')
+        args = dict(artifact)
+        for arg in ('name', 'state', 'dest'):
+            args.setdefault(arg, '')
+        for arg, var in (('chunk_size', 'artifact_download_chunk_size'),
+                         ('parts', 'artifact_download_parts'),
+                         ('pool_size', 'artifact_http_pool_size'),
+                         ('stream_buffer', 'artifact_stream_buffer'),
+                         ('memory_limit', 'artifact_stream_memory_limit')):
+            args[arg] = task_option(args, task_vars, arg, var)
+        args['retries'] = task_option(args, task_vars, 'retries',
+                                      'artifact_download_retries',
+                                      DEFAULT_RETRIES)
+
+        governor = Governor.from_task(args['endpoint'], args, task_vars)
+        res = minio.MinioUtils(args, governor).fget_minio(
+            cache,
+            concurrency=task_option(args, task_vars, 'concurrency',
+                                    'artifact_download_concurrency',
+                                    DEFAULT_CONCURRENCY),
+            retries=args['retries'])
+        if not isinstance(res, dict):
+            raise AnsibleError(to_text(res))
+        return [dict(name=obj['object_name'], file=obj['fullname'],
+                     checksum=obj['checksum'], cached=obj['cached'])
+                for obj in res['objects']]
+
+    def _fetch_gitlab(self, artifact, cache, task_vars):
+        """
+        通过 my_gitlab 的 GitlabUtils 下载文件到缓存，branch 在同一个play内只解析一次
+        :return: [{'name', 'file', 'checksum', 'cached'}]
+        """
+        gitlab = _load_plugin('my_gitlab')
+        args = dict(artifact)
+        args.setdefault('branch', 'master')
+        args.setdefault('dest', '')
+        for arg, var in (('pool_size', 'artifact_http_pool_size'),
+                         ('stream_buffer', 'artifact_stream_buffer'),
+                         ('memory_limit', 'artifact_stream_memory_limit')):
+            args[arg] = task_option(args, task_vars, arg, var)
+
+        gl = gitlab.GitlabUtils(args, Governor.from_task(args['url'], args,
+                                                         task_vars))
+        try:
+            play_id = self._task.get_play()._uuid
+        except AttributeError:
+            play_id = None
+        gl.resolve_ref(cache, play_id)
+
+        if gl.is_batch():
+            items = gl.get_files(
+                cache,
+                batch_mode=task_option(args, task_vars, 'batch_mode',
+                                       'artifact_gitlab_batch_mode',
+                                       'concurrent'),
+                concurrency=task_option(args, task_vars, 'concurrency',
+                                        'artifact_download_concurrency',
+                                        DEFAULT_CONCURRENCY))
+        else:
+            res = gl.get_file(cache)
+            if not res['changed']:
+                raise AnsibleError(to_text(res['msg']))
+            items = [res]
+        return [dict(name=item['basename'], file=item['file'],
+                     checksum=item['checksum'], cached=item['cached'])
+                for item in items]
+
+    def _stage(self, files, staging_dir, task_vars, compression=None):
+        """
+        暂存到目标主机：一次查询已暂存的文件，缺少的打包一次传输，一次模块调用校验并移动
+        """
+        if compression is None:
+            compression = task_option(self._task.args, task_vars,
+                                      'compression',
+                                      'artifact_transfer_compression', 'none')
+        checksum_index = boolean(task_option(
+            self._task.args, task_vars, 'checksum_index',
+            'artifact_checksum_index', False), strict=False)
+
+        unique = {}
+        for item in files:
+            unique.setdefault(item['checksum'], item['file'])
+        batch = [dict(src=checksum, checksum=checksum) for checksum in unique]
+
+        status = self._execute_module(
+            module_name='my_prefetch',
+            module_args=dict(staging_dir=staging_dir, batch=batch,
+                             batch_stat=True, checksum_index=checksum_index),
+            task_vars=task_vars)
+        if status.get('failed'):
+            return status
+
+        missing = [entry for entry in batch
+                   if entry['checksum'] not in status['staged']]
+        if not missing:
+            return dict(changed=False, staged=len(batch))
+
+        if self._connection._shell.tmpdir is None:
+            self._make_tmp_path()
+        tmp = self._connection._shell.tmpdir
+        tmp_src = self._connection._shell.join_path(tmp, 'bundle')
+
+        bundle = make_bundle([(unique[entry['checksum']], entry['src'])
+                              for entry in missing])
+        codec, packed_path = prepare_compressed(bundle, compression)
+        try:
+            remote_path = self._transfer_file(packed_path or bundle, tmp_src)
+        finally:
+            for path in (bundle, packed_path):
+                if path:
+                    os.remove(path)
+        if remote_path:
+            self._fixup_perms2((tmp, remote_path))
+
+        module_return = self._execute_module(
+            module_name='my_prefetch',
+            module_args=dict(staging_dir=staging_dir, batch=missing,
+                             bundle=tmp_src, compression=codec,
+                             checksum_index=checksum_index),
+            task_vars=task_vars)
+
+        # 目标主机无法解压zstd时改用gzip重新传输
+        if module_return.get('unsupported_compression') and codec != 'gzip':
+            return self._stage(files, staging_dir, task_vars,
+                               compression='gzip')
+        module_return['staged'] = len(batch)
+        return module_return
+
+    def run(self, tmp=None, task_vars=None):
+        ''' handler for artifact prefetch '''
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        artifacts = self._task.args.get('artifacts') or []
+        target = task_option(self._task.args, task_vars, 'target',
+                             'artifact_prefetch_target', 'controller')
+        staging_dir = task_option(self._task.args, task_vars, 'staging_dir',
+                                  'artifact_staging_dir')
+
+        result['failed'] = True
+        cache = ArtifactCache.from_task(self._task.args, task_vars)
+        if not isinstance(artifacts, list):
+            result['msg'] = "artifacts must be a list"
+        elif target not in TARGETS:
+            result['msg'] = "target must be one of %s" % ', '.join(TARGETS)
+        elif cache is None:
+            result['msg'] = "my_prefetch requires the artifact cache"
+        elif target == 'host' and not staging_dir:
+            result['msg'] = "target=host requires staging_dir (artifact_staging_dir)"
+        else:
+            del result['failed']
+        if result.get('failed'):
+            return result
+
+        files = []
+        for artifact in artifacts:
+            kind = artifact.get('type', 'minio')
+            artifact = dict((k, v) for k, v in artifact.items() if k != 'type')
+            try:
+                if kind == 'minio':
+                    files.extend(self._fetch_minio(artifact, cache, task_vars))
+                elif kind == 'gitlab':
+                    files.extend(self._fetch_gitlab(artifact, cache,
+                                                    task_vars))
+                else:
+                    raise AnsibleError("unknown artifact type %s" % kind)
+            except Exception as err:
+                result['failed'] = True
+                result['msg'] = "failed to prefetch %s: %s" % (
+                    artifact.get('src'), to_text(err))
+                return result
+
+        result['changed'] = False
+        result['artifacts'] = [
+            dict(name=item['name'], checksum=item['checksum'],
+                 cached=item['cached']) for item in files]
+
+        if target == 'host' and files:
+            try:
+                module_return = self._stage(files, staging_dir, task_vars)
+            finally:
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+            if module_return.get('failed'):
+                result['failed'] = True
+                result['msg'] = module_return.get('msg')
+                return result
+            result['changed'] = module_return.get('changed', False)
+            result['staged'] = module_return.get('staged')
+            result['staging_dir'] = staging_dir
+
+        return result
@@ -1,13 +1,116 @@
 from ansible.plugins.action import ActionBase
+from ansible.module_utils._text import to_text
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+
+import os
+import sys
+
+# role 的 module_utils 目录，管控端插件共用的代码放在这里
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.append(MODULE_UTILS_DIR)
+
+from my_token_cache import (TokenCache, fetch_token, DEFAULT_TTL,  # noqa: E402
+                            DEFAULT_REFRESH_MARGIN)
+from my_api_client import (ApiClient, ARGUMENT_SPEC, ARGUMENT_RULES,  # noqa: E402
+                           apply_user, apply_users)
+from my_client_pool import get_http_session  # noqa: E402
+
+# 执行位置：host 在目标主机上运行模块；controller 在管控端进程内直接调用接口
+EXECUTIONS = ('host', 'controller')
+
 
 class ActionModule(ActionBase):
 
+    def _run_local(self, module_args, variables, refresh=None):
+        """
+        在管控端进程内执行，省去模块打包、传输与目标主机上的解释器启动
+        本次任务内的请求复用带连接池的会话
+        :param refresh: token失效（401）时获取新token
+        """
+        validated = ArgumentSpecValidator(
+            ARGUMENT_SPEC, **ARGUMENT_RULES).validate(module_args)
+        if validated.error_messages:
+            return dict(failed=True,
+                        msg=', '.join(validated.error_messages))
+        params = validated.validated_parameters
+
+        client = ApiClient(
+            params['base_url'], params['token'],
+            session=get_http_session(params['base_url'],
+                                     variables.get('api_http_pool_size')),
+            refresh=refresh)
+        if params['users'] is not None:
+            return apply_users(client, params['users'], params['parallelism'])
+        return apply_user(client, params)
+
     def run(self, tmp=None, task_vars=None):
 
-        result = super(ActionModule, self).run(tmp, task_vars)
+        super(ActionModule, self).run(tmp, task_vars)
+        warnings = []
 
+        variables = self._templar._available_variables
         module_args = self._task.args.copy()
-        module_args['base_url'] = self._templar._available_variables.get('base_url')
-        module_args['username'] = self._templar._available_variables.get('api_username')
-        module_args['password'] = self._templar._available_variables.get('api_password')
-        return self._execute_module(module_args=module_args, task_vars=task_vars, tmp=tmp)
+        execution = module_args.pop('execution', None) or variables.get(
+            'api_execution', 'host')
+        if execution not in EXECUTIONS:
+            return dict(failed=True, msg="execution must be one of %s"
+                        % ', '.join(EXECUTIONS))
+        module_args['base_url'] = variables.get('base_url')
+        module_args['username'] = variables.get('api_username')
+        module_args['password'] = variables.get('api_password')
+
+        # 在管控端获取token并缓存，所有主机与任务共用，不必每台主机各请求一次
+        refresh = None
+        if module_args['base_url'] and module_args['username']:
+            cache = TokenCache(variables.get('api_token_cache_dir'),
+                               ttl=variables.get('api_token_ttl', DEFAULT_TTL),
+                               margin=variables.get('api_token_refresh_margin',
+                                                    DEFAULT_REFRESH_MARGIN))
+            base_url = module_args['base_url']
+            username = module_args['username']
+            password = module_args['password']
+
+            def get_token():
+                return cache.get(base_url, username, lambda: fetch_token(
+                    base_url, username, password))
+
+            def refresh():
+                # 缓存的token已失效（如服务端重启），丢弃后重新获取
+                cache.invalidate(base_url, username)
+                return get_token()
+
+            try:
+                module_args['token'] = get_token()
+                # 已有token，密码不再下发到目标主机
+                module_args['password'] = None
+            except Exception as err:
+                refresh = None
+                # 管控端无法访问接口时仍由目标主机自行获取
+                warnings.append(
+                    "could not get API token on the controller: %s"
+                    % to_text(err))
+
+        if execution == 'controller' and module_args.get('token'):
+            result = self._run_local(module_args, variables, refresh)
+        else:
+            if execution == 'controller':
+                warnings.append("no API token on the controller, "
+                                "running on the host instead")
+            result = self._execute_module(module_args=module_args,
+                                          task_vars=task_vars, tmp=tmp)
+            if result.get('unauthorized') and refresh is not None:
+                # 目标主机上没有密码，由管控端刷新token后重试一次
+                try:
+                    module_args['token'] = refresh()
+                except Exception as err:
+                    warnings.append("could not refresh API token: %s"
+                                    % to_text(err))
+                else:
+                    result = self._execute_module(module_args=module_args,
+                                                  task_vars=task_vars,
+                                                  tmp=tmp)
+        if warnings:
+            result.setdefault('warnings', []).extend(warnings)
+        return result
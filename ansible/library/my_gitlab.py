@@ -5,8 +5,19 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 from ansible.module_utils.basic import *
+from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.my_remote_fetch import fetch_to_tmp, verify_fetched
+from ansible.module_utils.my_checksum_index import ChecksumIndex
+from ansible.module_utils.my_delta import (
+    apply_delta, block_signatures, DEFAULT_BLOCK_SIZE)
+from ansible.module_utils.my_compress import decompress_to_tmp
+from ansible.module_utils.my_digest import (ALGORITHMS, available,
+                                            file_digest, verify_source)
+from ansible.module_utils.my_sync import (batch_checksums, install_batch,
+                                          install_file)
 
 import os
+import tempfile
 
 module = None
 
@@ -31,8 +42,27 @@ def main():
             projectID=dict(type='str', required=True),
             src=dict(type='str', required=True),
             dest=dict(type='str', required=True),
-            checksum=dict(type='str', required=True),
+            checksum=dict(type='str', required=False),
             original_basename=dict(required=False),
+            fetch_mode=dict(type='str', default='controller',
+                            choices=['controller', 'remote']),
+            checksum_sha256=dict(type='str', required=False),
+            validate_certs=dict(type='bool', default=False),
+            checksum_index=dict(type='bool', default=False),
+            checksum_index_path=dict(type='path', required=False),
+            delta_signature=dict(type='bool', default=False),
+            delta=dict(type='bool', default=False),
+            delta_block_size=dict(type='int', default=DEFAULT_BLOCK_SIZE),
+            compression=dict(type='str', required=False,
+                             choices=['gzip', 'zstd']),
+            batch=dict(type='list', elements='dict', required=False),
+            bundle=dict(type='path', required=False),
+            batch_stat=dict(type='bool', default=False),
+            staging_dir=dict(type='path', required=False),
+            remove_src=dict(type='bool', default=False),
+            digest=dict(type='str', required=False),
+            digest_algorithm=dict(type='str', default='sha1',
+                                  choices=list(ALGORITHMS)),
         ),
         supports_check_mode=False,
     )
@@ -47,53 +77,181 @@ def main():
 
     b_src = to_bytes(src, errors='surrogate_or_strict')
     b_dest = to_bytes(dest, errors='surrogate_or_strict')
-
-    # 判断参数是否合规
-    if not os.path.exists(b_src):
-        module.fail_json(msg="Source %s not found" % (src))
-    if not os.access(b_src, os.R_OK):
-        module.fail_json(msg="Source %s not readable" % (src))
-    if os.path.isdir(b_src):
-        module.fail_json(
-            msg="Remote copy does not support recursive copy of directory: %s" % (src))
-
-    # 获取文件的sha1
+    fetch_mode = module.params['fetch_mode']
+    # 传输的文件经过解压/差量重建，或上传在目标文件旁（remove_src），临时文件需要自行清理
+    rebuilt = module.params['remove_src']
+    # 目标文件的sha1已与源文件一起计算
+    dest_checked = False
     checksum_dest = None
 
-    if os.path.isfile(src):
-        checksum_src = module.sha1(src)
-    else:
-        checksum_src = None
-
-    if checksum and checksum_src != checksum:
-        module.fail_json(
-            msg='Copied file does not match the expected checksum. Transfer failed.',
-            checksum=checksum_src,
-            expected_checksum=checksum
-        )
-
     changed = False
     # 确定dest文件路径
     if original_basename:
         dest = os.path.join(dest, original_basename)
         b_dest = to_bytes(dest, errors='surrogate_or_strict')
 
+    # 可选的校验值索引：目标文件stat信息未变化时不重新计算sha1
+    index = None
+    if module.params['checksum_index']:
+        index = ChecksumIndex(module, module.params['checksum_index_path'],
+                              hasher=file_digest)
+
+    if module.params['batch_stat']:
+        # 批量模式：一次返回多个目标文件的sha1，以及已由 my_prefetch 暂存的文件
+        batch = module.params['batch'] or []
+        staged = []
+        if module.params['staging_dir']:
+            staged = [entry['checksum'] for entry in batch
+                      if entry.get('checksum') and os.path.isfile(os.path.join(
+                          module.params['staging_dir'], entry['checksum']))]
+        module.exit_json(changed=False, staged=staged,
+                         results=batch_checksums(module, batch, index))
+
+    if module.params['batch'] is not None:
+        # 批量模式：一次调用校验并移动多个文件
+        # 提供 bundle 时 src 为其中的成员名，否则为已传输到主机上的文件
+        b_bundle = None
+        if module.params['bundle']:
+            b_bundle = to_bytes(module.params['bundle'],
+                                errors='surrogate_or_strict')
+            if module.params['compression']:
+                b_bundle = decompress_to_tmp(module, b_bundle,
+                                             module.params['compression'],
+                                             os.path.dirname(b_bundle))
+        results = install_batch(module, module.params['batch'], b_bundle,
+                                index)
+        if b_bundle:
+            os.remove(b_bundle)
+
+        changed = any(res['changed'] for res in results)
+        failed = [res for res in results if res.get('failed')]
+        if failed:
+            module.fail_json(msg="%d of %d files failed: %s"
+                             % (len(failed), len(results), failed[0]['msg']),
+                             changed=changed, results=results)
+        module.exit_json(changed=changed, results=results)
+
+    if module.params['delta_signature']:
+        # 返回目标文件的分块签名与sha1，供管控端生成差量
+        if os.path.isfile(b_dest) and os.access(b_dest, os.R_OK):
+            signatures, checksum_dest = block_signatures(
+                b_dest, module.params['delta_block_size'])
+            if index:
+                index.record(dest, checksum_dest)
+            module.exit_json(changed=False, dest=dest, exists=True,
+                             checksum=checksum_dest, signatures=signatures)
+        module.exit_json(changed=False, dest=dest, exists=False,
+                         checksum=None)
+
+    if fetch_mode == 'remote':
+        # 目标主机直接调用Gitlab API下载，sha256由管控端通过HEAD请求获得
+        url = "%s/api/v4/projects/%s/repository/files/%s/raw?ref=%s" % (
+            module.params['url'].rstrip('/'),
+            quote(module.params['projectID'], safe=''),
+            quote(src, safe=''), quote(module.params['branch'], safe=''))
+        b_src, digests, size = fetch_to_tmp(
+            module, url, dest,
+            headers={'PRIVATE-TOKEN': module.params['accessToken']},
+            algorithms=('sha1', 'sha256'))
+        verify_fetched(module, b_src, digests, size,
+                       dict(sha1=checksum,
+                            sha256=module.params['checksum_sha256']))
+        src = to_native(b_src)
+        checksum_src = digests['sha1']
+    else:
+        if module.params['digest'] and not available(
+                module.params['digest_algorithm']):
+            module.fail_json(msg="digest algorithm %s is not available"
+                             % module.params['digest_algorithm'],
+                             unsupported_digest=True)
+
+        if module.params['staging_dir']:
+            # 使用 my_prefetch 预先暂存的文件，按sha1查找，移动后即从暂存目录消失
+            if not checksum:
+                module.fail_json(msg="staging_dir requires checksum")
+            src = os.path.join(module.params['staging_dir'], checksum)
+            b_src = to_bytes(src, errors='surrogate_or_strict')
+            if not os.path.isfile(b_src):
+                module.fail_json(msg="%s is not staged in %s"
+                                 % (checksum, module.params['staging_dir']),
+                                 staged_missing=True)
+            rebuilt = True
+
+        # 判断参数是否合规
+        if not os.path.exists(b_src):
+            module.fail_json(msg="Source %s not found" % (src))
+        if not os.access(b_src, os.R_OK):
+            module.fail_json(msg="Source %s not readable" % (src))
+        if os.path.isdir(b_src):
+            module.fail_json(
+                msg="Remote copy does not support recursive copy of directory: %s" % (src))
+
+        if module.params['compression']:
+            # src 为压缩后的文件，解压到目标目录下的临时文件
+            b_src = decompress_to_tmp(module, b_src,
+                                      module.params['compression'],
+                                      os.path.dirname(b_dest))
+            src = to_native(b_src)
+            rebuilt = True
+
+        if module.params['delta']:
+            # src 为差量文件，结合目标文件重建到目标目录下的临时文件
+            b_delta = b_src
+            fd, b_src = tempfile.mkstemp(dir=os.path.dirname(b_dest) or None,
+                                         prefix=b'.ansible_tmp')
+            os.close(fd)
+            try:
+                apply_delta(b_dest, b_delta, b_src)
+            except (IOError, OSError, ValueError) as err:
+                os.remove(b_src)
+                module.fail_json(msg="failed to apply delta to %s: %s"
+                                 % (dest, to_native(err)))
+            os.remove(b_delta)
+            src = to_native(b_src)
+            rebuilt = True
+
+        # 源文件与目标文件的摘要并发计算，提供 digest 时按 digest_algorithm 校验
+        checksum_src, checksum_dest, verified = verify_source(
+            src, dest, checksum, index, module.params['digest'],
+            module.params['digest_algorithm'])
+        dest_checked = True
+
+        if not verified:
+            if rebuilt:
+                os.remove(b_src)
+            module.fail_json(
+                msg='Copied file does not match the expected checksum. Transfer failed.',
+                checksum=checksum_src,
+                expected_checksum=module.params['digest'] or checksum
+            )
+
     # 判断目标文件是否存在
-    if os.path.exists(dest):
+    if not dest_checked and os.path.exists(dest):
         if os.access(b_dest, os.R_OK):
-            checksum_dest = module.sha1(dest)
+            checksum_dest = index.sha1(dest) if index else module.sha1(dest)
 
     # checksum_dest = module.sha1(b_dest)
 
     # 源文件与目标文件sha1值不一致时覆盖源文件
     if checksum_src != checksum_dest:
         if not module.check_mode:
+            # 批量获取时 original_basename 可能带子目录
+            b_dest_dir = os.path.dirname(b_dest)
+            if b_dest_dir and not os.path.isdir(b_dest_dir):
+                os.makedirs(b_dest_dir)
             try:
-                module.atomic_move(b_src, b_dest)
+                install_file(module, b_src, b_dest)
             except IOError:
                 module.fail_json(msg="failed to copy: %s to %s" % (src, dest))
+            if index:
+                index.record(dest, checksum_src)
+                if module.params['digest']:
+                    index.record(dest, module.params['digest'],
+                                 module.params['digest_algorithm'])
             changed = True
     else:
+        if fetch_mode == 'remote' or rebuilt:
+            os.remove(b_src)
         module.exit_json(msg="file already exists",src=src, dest=dest, changed=False)
 
     # 返回值
@@ -2,8 +2,20 @@
 # -*- coding: utf-8 -*-
 
 from ansible.module_utils.basic import *
+from ansible.module_utils.my_remote_fetch import fetch_to_tmp, verify_fetched
+from ansible.module_utils.my_checksum_index import ChecksumIndex
+from ansible.module_utils.my_delta import (
+    apply_delta, block_signatures, DEFAULT_BLOCK_SIZE)
+from ansible.module_utils.my_compress import decompress_to_tmp
+from ansible.module_utils.my_digest import (ALGORITHMS, available,
+                                            file_digest, verify_source)
+from ansible.module_utils.my_sync import (
+    apply_bundle, batch_checksums, delete_files, dir_manifest, install_batch,
+    install_file)
 
 import os
+import tempfile
+import re
 import shutil
 
 
@@ -20,8 +32,36 @@ def main():
             bucket=dict(type='str', required=True),
             src=dict(type='str', required=True),
             dest=dict(type='str', required=True),
+            checksum=dict(type='str', required=False),
             original_basename=dict(required=False),
+            fetch_mode=dict(type='str', default='controller',
+                            choices=['controller', 'remote']),
+            presigned_url=dict(type='str', required=False, no_log=True),
+            etag=dict(type='str', required=False),
+            size=dict(type='int', required=False),
+            checksum_index=dict(type='bool', default=False),
+            checksum_index_path=dict(type='path', required=False),
+            stat_only=dict(type='bool', default=False),
+            delta_signature=dict(type='bool', default=False),
+            delta=dict(type='bool', default=False),
+            delta_block_size=dict(type='int', default=DEFAULT_BLOCK_SIZE),
+            compression=dict(type='str', required=False,
+                             choices=['gzip', 'zstd']),
+            batch=dict(type='list', elements='dict', required=False),
+            bundle=dict(type='path', required=False),
+            batch_stat=dict(type='bool', default=False),
+            manifest=dict(type='bool', default=False),
+            sizes=dict(type='dict', required=False),
+            sync=dict(type='bool', default=False),
+            files=dict(type='dict', required=False),
+            delete_files=dict(type='list', elements='str', default=[]),
+            staging_dir=dict(type='path', required=False),
+            remove_src=dict(type='bool', default=False),
+            digest=dict(type='str', required=False),
+            digest_algorithm=dict(type='str', default='sha1',
+                                  choices=list(ALGORITHMS)),
         ),
+        required_if=[('fetch_mode', 'remote', ['presigned_url'])],
         supports_check_mode=True,
     )
 
@@ -32,48 +72,224 @@ def main():
     b_src = to_bytes(src, errors='surrogate_or_strict')
     b_dest = to_bytes(dest, errors='surrogate_or_strict')
 
-    print("b_src --> ", b_src)
-    
-    # 判断参数是否合规
-    if not os.path.exists(b_src):
-        module.fail_json(msg="Source %s not found" % (src))
-    if not os.access(b_src, os.R_OK):
-        module.fail_json(msg="Source %s not readable" % (src))
-    if os.path.isdir(b_src):
-        module.fail_json(
-            msg="Remote copy does not support recursive copy of directory: %s" % (src))
-
-    # 获取文件的sha1
-    checksum_src = module.sha1(src)
+    checksum = module.params.get('checksum', None)
+    fetch_mode = module.params['fetch_mode']
+    # 传输的文件经过解压/差量重建，或上传在目标文件旁（remove_src），临时文件需要自行清理
+    rebuilt = module.params['remove_src']
+    # 目标文件的sha1已与源文件一起计算
+    dest_checked = False
     checksum_dest = None
-
-    changed = False
+    etag_verified = False
 
     # 确定dest文件路径
     if original_basename and dest.endswith(os.sep):
         dest = os.path.join(dest, original_basename)
         b_dest = to_bytes(dest, errors='surrogate_or_strict')
 
+    # 可选的校验值索引：目标文件stat信息未变化时不重新计算sha1
+    index = None
+    if module.params['checksum_index']:
+        index = ChecksumIndex(module, module.params['checksum_index_path'],
+                              hasher=file_digest)
+
+    if module.params['manifest']:
+        # 目录同步：返回目标目录的清单，只对大小与对象一致的文件计算sha1
+        if not os.path.isdir(b_dest):
+            module.exit_json(changed=False, dest=dest, exists=False, files={})
+        module.exit_json(changed=False, dest=dest, exists=True,
+                         files=dir_manifest(module, dest,
+                                            module.params['sizes'], index))
+
+    if module.params['sync']:
+        # 目录同步：src 为打包后的变化文件，逐个校验后移动到位，并删除多余文件
+        files = module.params['files'] or {}
+        changed_files = sorted(files)
+        if files:
+            b_bundle = b_src
+            if module.params['compression']:
+                b_bundle = decompress_to_tmp(module, b_src,
+                                             module.params['compression'],
+                                             os.path.dirname(b_src))
+
+            if not module.check_mode:
+                if not os.path.isdir(b_dest):
+                    os.makedirs(b_dest)
+                changed_files = apply_bundle(module, b_bundle, dest, files,
+                                             index)
+            os.remove(b_bundle)
+
+        deleted = module.params['delete_files']
+        if not module.check_mode:
+            deleted = delete_files(module, dest, deleted)
+        module.exit_json(changed=bool(changed_files or deleted), dest=dest,
+                         changed_files=changed_files, deleted_files=deleted)
+
+    if module.params['stat_only']:
+        # 只返回目标文件的sha1，供管控端在下载/传输前比对
+        if os.path.isfile(b_dest) and os.access(b_dest, os.R_OK):
+            checksum_dest = index.sha1(dest) if index else module.sha1(dest)
+            module.exit_json(changed=False, dest=dest, exists=True,
+                             checksum=checksum_dest)
+        module.exit_json(changed=False, dest=dest, exists=False,
+                         checksum=None)
+
+    if module.params['batch_stat']:
+        # 批量模式：一次返回多个目标文件的sha1
+        module.exit_json(changed=False, results=batch_checksums(
+            module, module.params['batch'] or [], index))
+
+    if module.params['batch'] is not None:
+        # 批量模式：一次调用校验并移动多个文件
+        # 提供 bundle 时 src 为其中的成员名，否则为已传输到主机上的文件
+        b_bundle = None
+        if module.params['bundle']:
+            b_bundle = to_bytes(module.params['bundle'],
+                                errors='surrogate_or_strict')
+            if module.params['compression']:
+                b_bundle = decompress_to_tmp(module, b_bundle,
+                                             module.params['compression'],
+                                             os.path.dirname(b_bundle))
+        results = install_batch(module, module.params['batch'], b_bundle,
+                                index)
+        if b_bundle:
+            os.remove(b_bundle)
+
+        changed = any(res['changed'] for res in results)
+        failed = [res for res in results if res.get('failed')]
+        if failed:
+            module.fail_json(msg="%d of %d files failed: %s"
+                             % (len(failed), len(results), failed[0]['msg']),
+                             changed=changed, results=results)
+        module.exit_json(changed=changed, results=results)
+
+    if module.params['delta_signature']:
+        # 返回目标文件的分块签名与sha1，供管控端生成差量
+        if os.path.isfile(b_dest) and os.access(b_dest, os.R_OK):
+            signatures, checksum_dest = block_signatures(
+                b_dest, module.params['delta_block_size'])
+            if index:
+                index.record(dest, checksum_dest)
+            module.exit_json(changed=False, dest=dest, exists=True,
+                             checksum=checksum_dest, signatures=signatures)
+        module.exit_json(changed=False, dest=dest, exists=False,
+                         checksum=None)
+
+    if fetch_mode == 'remote':
+        # 目标主机通过预签名URL直接从minio下载，下载过程中计算摘要
+        etag = module.params['etag']
+        etag_md5 = etag if etag and re.match(r'^[0-9a-f]{32}$', etag) else None
+        b_src, digests, size = fetch_to_tmp(
+            module, module.params['presigned_url'], dest,
+            algorithms=('sha1', 'md5') if etag_md5 else ('sha1',))
+        verify_fetched(module, b_src, digests, size,
+                       dict(sha1=checksum, md5=etag_md5,
+                            size=module.params['size']))
+        src = to_native(b_src)
+        checksum_src = digests['sha1']
+        etag_verified = etag_md5 is not None
+    else:
+        if module.params['digest'] and not available(
+                module.params['digest_algorithm']):
+            module.fail_json(msg="digest algorithm %s is not available"
+                             % module.params['digest_algorithm'],
+                             unsupported_digest=True)
+
+        if module.params['staging_dir']:
+            # 使用 my_prefetch 预先暂存的文件，按sha1查找，移动后即从暂存目录消失
+            if not checksum:
+                module.fail_json(msg="staging_dir requires checksum")
+            src = os.path.join(module.params['staging_dir'], checksum)
+            b_src = to_bytes(src, errors='surrogate_or_strict')
+            if not os.path.isfile(b_src):
+                module.fail_json(msg="%s is not staged in %s"
+                                 % (checksum, module.params['staging_dir']),
+                                 staged_missing=True)
+            rebuilt = True
+
+        module.debug("b_src --> %s" % to_native(b_src))
+
+        # 判断参数是否合规
+        if not os.path.exists(b_src):
+            module.fail_json(msg="Source %s not found" % (src))
+        if not os.access(b_src, os.R_OK):
+            module.fail_json(msg="Source %s not readable" % (src))
+        if os.path.isdir(b_src):
+            module.fail_json(
+                msg="Remote copy does not support recursive copy of directory: %s" % (src))
+
+        if module.params['compression']:
+            # src 为压缩后的文件，解压到目标目录下的临时文件
+            b_src = decompress_to_tmp(module, b_src,
+                                      module.params['compression'],
+                                      os.path.dirname(b_dest))
+            src = to_native(b_src)
+            rebuilt = True
+
+        if module.params['delta']:
+            # src 为差量文件，结合目标文件重建到目标目录下的临时文件
+            b_delta = b_src
+            fd, b_src = tempfile.mkstemp(dir=os.path.dirname(b_dest) or None,
+                                         prefix=b'.ansible_tmp')
+            os.close(fd)
+            try:
+                apply_delta(b_dest, b_delta, b_src)
+            except (IOError, OSError, ValueError) as err:
+                os.remove(b_src)
+                module.fail_json(msg="failed to apply delta to %s: %s"
+                                 % (dest, to_native(err)))
+            os.remove(b_delta)
+            src = to_native(b_src)
+            rebuilt = True
+
+        # 源文件与目标文件的摘要并发计算，提供 digest 时按 digest_algorithm 校验
+        checksum_src, checksum_dest, verified = verify_source(
+            src, dest, checksum, index, module.params['digest'],
+            module.params['digest_algorithm'])
+        dest_checked = True
+
+        if not verified:
+            if rebuilt:
+                os.remove(b_src)
+            module.fail_json(
+                msg='Copied file does not match the expected checksum. Transfer failed.',
+                checksum=checksum_src,
+                expected_checksum=module.params['digest'] or checksum
+            )
+
+    changed = False
+
     # 判断目标文件是否存在
-    if os.path.exists(b_dest):
+    if not dest_checked and os.path.exists(b_dest):
         if os.access(b_dest, os.R_OK):
-            checksum_dest = module.sha1(dest)
+            checksum_dest = index.sha1(dest) if index else module.sha1(dest)
 
     # 源文件与目标文件sha1值不一致时覆盖源文件
     if checksum_src != checksum_dest:
         if not module.check_mode:
             try:
-                module.atomic_move(b_src, b_dest)
+                install_file(module, b_src, b_dest)
             except IOError:
                 module.fail_json(msg="failed to copy: %s to %s" % (src, dest))
+            if index:
+                index.record(dest, checksum_src)
+                if module.params['digest']:
+                    index.record(dest, module.params['digest'],
+                                 module.params['digest_algorithm'])
             changed = True
     else:
-        module.exit_json(msg="file already exists",
-                         src=src, dest=dest, changed=False, skipped=1)
+        if fetch_mode == 'remote' or rebuilt:
+            os.remove(b_src)
+        module.exit_json(msg="file already exists", src=src, dest=dest,
+                         checksum=checksum_src, etag_verified=etag_verified,
+                         changed=False, skipped=1)
+
+    if (fetch_mode == 'remote' or rebuilt) and module.check_mode:
+        os.remove(b_src)
 
     # 返回值
     res_args = dict(
-        dest=dest, src=src, checksum=checksum_src, changed=changed
+        dest=dest, src=src, checksum=checksum_src, changed=changed,
+        etag_verified=etag_verified
     )
 
     module.exit_json(**res_args)
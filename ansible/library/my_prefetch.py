@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.my_checksum_index import ChecksumIndex
+from ansible.module_utils.my_digest import file_digest
+from ansible.module_utils.my_compress import decompress_to_tmp
+from ansible.module_utils.my_sync import batch_checksums, install_batch
+
+import os
+
+
+def main():
+    """
+    目标主机上的预取暂存目录：文件按sha1存放，my_minio/my_gitlab 通过 staging_dir 直接使用
+    """
+    module = AnsibleModule(
+        argument_spec=dict(
+            staging_dir=dict(type='path', required=True),
+            batch=dict(type='list', elements='dict', default=[]),
+            bundle=dict(type='path', required=False),
+            batch_stat=dict(type='bool', default=False),
+            compression=dict(type='str', required=False,
+                             choices=['gzip', 'zstd']),
+            checksum_index=dict(type='bool', default=False),
+            checksum_index_path=dict(type='path', required=False),
+        ),
+        supports_check_mode=True,
+    )
+
+    staging_dir = module.params['staging_dir']
+    index = None
+    if module.params['checksum_index']:
+        index = ChecksumIndex(module, module.params['checksum_index_path'],
+                              hasher=file_digest)
+
+    # 暂存路径由sha1决定，src 为 bundle 中的成员名
+    entries = [dict(src=entry.get('src'), checksum=entry['checksum'],
+                    dest=os.path.join(staging_dir, entry['checksum']))
+               for entry in module.params['batch']]
+
+    if module.params['batch_stat']:
+        results = batch_checksums(module, entries, index)
+        staged = [entry['checksum'] for entry, res in zip(entries, results)
+                  if res['checksum'] == entry['checksum']]
+        module.exit_json(changed=False, staging_dir=staging_dir,
+                         staged=staged)
+
+    b_bundle = None
+    if module.params['bundle']:
+        b_bundle = to_bytes(module.params['bundle'],
+                            errors='surrogate_or_strict')
+        if module.params['compression']:
+            b_bundle = decompress_to_tmp(module, b_bundle,
+                                         module.params['compression'],
+                                         os.path.dirname(b_bundle))
+    results = install_batch(module, entries, b_bundle, index)
+    if b_bundle:
+        os.remove(b_bundle)
+
+    changed = any(res['changed'] for res in results)
+    failed = [res for res in results if res.get('failed')]
+    if failed:
+        module.fail_json(msg="%d of %d files failed: %s"
+                         % (len(failed), len(results), failed[0]['msg']),
+                         changed=changed, results=results)
+    module.exit_json(changed=changed, staging_dir=staging_dir,
+                     results=results)
+
+
+if __name__ == '__main__':
+    main()
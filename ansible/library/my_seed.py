@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.my_fanout import (DEFAULT_PORT, DEFAULT_SEED_DIR,
+                                            DEFAULT_TTL, serve_file)
+
+import os
+
+
+def main():
+    """
+    树形分发：目标主机上已安装的文件通过HTTP提供给下级主机，下级按sha1校验
+    """
+    module = AnsibleModule(
+        argument_spec=dict(
+            path=dict(type='path', required=True),
+            checksum=dict(type='str', required=True),
+            seed_dir=dict(type='path', default=DEFAULT_SEED_DIR),
+            port=dict(type='int', default=DEFAULT_PORT),
+            ttl=dict(type='int', default=DEFAULT_TTL),
+            bind=dict(type='str', required=True),
+        ),
+        supports_check_mode=True,
+    )
+
+    path = module.params['path']
+    if not os.path.isfile(path):
+        module.fail_json(msg="%s not found" % path)
+    if module.check_mode:
+        module.exit_json(changed=False, serving=False)
+
+    try:
+        serving, token, msg = serve_file(path, module.params['checksum'],
+                                         module.params['bind'],
+                                         module.params['seed_dir'],
+                                         module.params['port'],
+                                         module.params['ttl'])
+    except (IOError, OSError, ValueError) as err:
+        serving, token, msg = False, None, to_native(err)
+    module.exit_json(changed=False, serving=serving, msg=msg, token=token,
+                     port=module.params['port'])
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@
 import json
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import open_url, ConnectionError, SSLValidationError
+from ansible.module_utils.my_api_client import (ApiClient, ARGUMENT_SPEC,
+                                                ARGUMENT_RULES, apply_user,
+                                                apply_users)
 
 DOCUMENTATION = '''
 ---
@@ -17,6 +20,14 @@ EXAMPLES = '''
     state: present
     email: test1@test.local
     admin: False
+
+- name: Onboard users in one task
+  our_api_module:
+    parallelism: 16
+    users:
+      - {name: test1, email: test1@test.local}
+      - {name: test2, email: test2@test.local, admin: true}
+      - {name: old1, state: absent}
 '''
 
 
@@ -33,8 +44,12 @@ class ApiModule(object):
         self.baseUrl = module.params['base_url']
         self.verifySsl =False
 
-        self.token = self.getToken()
+        # 管控端已获取并缓存token时直接使用，否则自行请求
+        self.token = module.params['token'] or self.getToken()
         # raise Exception(self.token)
+        # 有密码时token失效后可自行重新获取
+        self.client = ApiClient(self.baseUrl, self.token, self.verifySsl,
+                                refresh=self.getToken if self.password else None)
    
     def getToken(self):
         url = "{baseUrl}/API/get-token".format(baseUrl=self.baseUrl)
@@ -43,43 +58,25 @@ class ApiModule(object):
 
 def main():
     module = AnsibleModule(
-        argument_spec=dict(
-            state=dict(type='str', default='present',
-                       choices=['absent', 'present']),
-            name=dict(type='str', required=True),
-            email=dict(type='str', required=True),
-            admin=dict(type='bool', default=False),
-            base_url=dict(requred=False, default=None),
-            username=dict(requred=False, default=None),
-            password=dict(requred=False, default=None, no_log=True),
-        ),
+        argument_spec=ARGUMENT_SPEC,
         supports_check_mode=False,
+        **ARGUMENT_RULES
     )
   
     api = ApiModule(module)
 
-    rc = None
-    out = ''
-    err = ''
-    result = {}
-    result['name'] = api.name
-    result['state'] = api.state
-
-    # TODO logic to do something based on the state:
-
-
-    if rc is None:
-        result['changed'] = False
-    else:
-        result['changed'] = True
-    if out:
-        result['stdout'] = out
-    if err:
-        result['stderr'] = err
+    if module.params['users'] is not None:
+        result = apply_users(api.client, module.params['users'],
+                             module.params['parallelism'])
+        if result.get('failed'):
+            module.fail_json(**result)
+        module.exit_json(**result)
 
+    result = apply_user(api.client, module.params)
+    if result.get('failed'):
+        module.fail_json(**result)
     module.exit_json(**result)
 
 
-
 if __name__ == '__main__':
     main()
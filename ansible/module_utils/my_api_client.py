@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils._text import to_native
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import quote
+from ansible.module_utils.urls import open_url
+
+
+DEFAULT_PARALLELISM = 8
+HTTP_TIMEOUT = 30
+
+# our_api_module 的参数定义，目标主机上的模块与管控端本地执行共用
+ARGUMENT_SPEC = dict(
+    state=dict(type='str', default='present',
+               choices=['absent', 'present']),
+    name=dict(type='str', required=False),
+    email=dict(type='str', required=False),
+    admin=dict(type='bool', default=False),
+    base_url=dict(required=False, default=None),
+    username=dict(required=False, default=None),
+    password=dict(required=False, default=None, no_log=True),
+    token=dict(required=False, default=None, no_log=True),
+    users=dict(type='list', elements='dict', required=False,
+               options=dict(
+                   name=dict(type='str', required=True),
+                   email=dict(type='str', required=False),
+                   admin=dict(type='bool', default=False),
+                   state=dict(type='str', default='present',
+                              choices=['absent', 'present']),
+               )),
+    parallelism=dict(type='int', default=DEFAULT_PARALLELISM),
+)
+ARGUMENT_RULES = dict(
+    required_one_of=[('name', 'users')],
+    mutually_exclusive=[('name', 'users')],
+    required_by={'name': 'email'},
+)
+
+
+class UnauthorizedError(Exception):
+    """
+    接口返回401，token已失效
+    """
+
+
+class ApiClient(object):
+    """
+    用户管理接口
+    提供 session（requests.Session）时复用其连接池，否则每个请求使用 open_url
+    提供 refresh 时，401后调用 refresh() 获取新token并重试一次
+    """
+
+    def __init__(self, base_url, token, validate_certs=False,
+                 session=None, refresh=None) -> None:
+        self.base_url = base_url
+        self.token = token
+        self.validate_certs = validate_certs
+        self.session = session
+        self.refresh = refresh
+        self._lock = threading.Lock()
+
+    def _send(self, method, path, data, token):
+        url = "{baseUrl}/API/{path}".format(baseUrl=self.base_url, path=path)
+        headers = {'Authorization': 'Bearer %s' % token}
+        if self.session is not None:
+            response = self.session.request(
+                method, url, json=data, headers=headers,
+                verify=self.validate_certs, timeout=HTTP_TIMEOUT)
+            if response.status_code == 401:
+                raise UnauthorizedError("%s %s: 401 Unauthorized"
+                                        % (method, url))
+            response.raise_for_status()
+            return response.json() if response.content else None
+
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(data)
+        try:
+            response = open_url(url, method=method, data=data,
+                                headers=headers,
+                                validate_certs=self.validate_certs,
+                                timeout=HTTP_TIMEOUT)
+        except HTTPError as err:
+            if err.code == 401:
+                raise UnauthorizedError("%s %s: 401 Unauthorized"
+                                        % (method, url))
+            raise
+        body = response.read()
+        return json.loads(body) if body else None
+
+    def request(self, method, path, data=None):
+        token = self.token
+        try:
+            return self._send(method, path, data, token)
+        except UnauthorizedError:
+            if self.refresh is None:
+                raise
+        # 并发请求同时遇到401时只刷新一次，其余直接使用新token
+        with self._lock:
+            if self.token == token:
+                self.token = self.refresh()
+        return self._send(method, path, data, self.token)
+
+    def list_users(self):
+        """
+        一次请求读取全部用户
+        :return: {name: user}
+        """
+        return dict((user['name'], user)
+                    for user in self.request('GET', 'users'))
+
+    def create_user(self, user):
+        self.request('POST', 'users', dict(name=user['name'],
+                                           email=user['email'],
+                                           admin=user['admin']))
+
+    def delete_user(self, name):
+        self.request('DELETE', 'users/%s' % quote(name, safe=''))
+
+    def sync_users(self, users, parallelism=DEFAULT_PARALLELISM):
+        """
+        批量管理用户：读取一次当前用户列表与期望状态比对，
+        需要创建/删除的用户并发请求，每个用户单独返回结果
+        :return: [{'name', 'state', 'changed', 'failed', 'msg'}]
+        """
+        current = self.list_users()
+
+        def apply(user):
+            result = dict(name=user['name'], state=user['state'],
+                          changed=False)
+            try:
+                if user['state'] == 'present' and user['name'] not in current:
+                    self.create_user(user)
+                    result['changed'] = True
+                elif user['state'] == 'absent' and user['name'] in current:
+                    self.delete_user(user['name'])
+                    result['changed'] = True
+            except Exception as err:
+                result.update(failed=True, msg=to_native(err))
+            return result
+
+        if not users:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(int(parallelism),
+                                                       len(users)))) as pool:
+            return list(pool.map(apply, users))
+
+
+def apply_users(client, users, parallelism=DEFAULT_PARALLELISM):
+    """
+    users 参数的处理，返回任务结果，失败时带 failed/msg
+    """
+    missing = [user['name'] for user in users
+               if user['state'] == 'present' and not user['email']]
+    if missing:
+        return dict(failed=True, changed=False,
+                    msg="email is required for present users: %s"
+                    % ', '.join(missing))
+    try:
+        results = client.sync_users(users, parallelism)
+    except UnauthorizedError as err:
+        # 调用方可据此丢弃缓存的token后重试
+        return dict(failed=True, changed=False, unauthorized=True,
+                    msg="failed to list users: %s" % to_native(err))
+    except Exception as err:
+        return dict(failed=True, changed=False,
+                    msg="failed to list users: %s" % to_native(err))
+
+    changed = any(res['changed'] for res in results)
+    failed = [res for res in results if res.get('failed')]
+    if failed:
+        return dict(failed=True, changed=changed, users=results,
+                    msg="%d of %d users failed: %s"
+                    % (len(failed), len(results), failed[0]['msg']))
+    return dict(changed=changed, users=results)
+
+
+def apply_user(client, params):
+    """
+    name/email/admin/state 参数的处理：与 users 中的单个条目相同
+    """
+    user = dict((key, params[key])
+                for key in ('name', 'email', 'admin', 'state'))
+    result = apply_users(client, [user], 1)
+    result.update(name=user['name'], state=user['state'])
+    return result
@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.common.text.formatters import human_to_bytes
+from ansible.module_utils.parsing.convert_bool import boolean
+
+
+DEFAULT_CACHE_DIR = '~/.ansible/my_artifact_cache'
+DEFAULT_MAX_SIZE = '20G'
+
+# 下载中断遗留的临时文件超过该时间后清理
+STALE_TMP_SECONDS = 86400
+
+
+# 本进程正在使用的缓存对象：{pin文件路径: 持有共享锁的文件}，进程退出时锁自动释放
+_PINS = {}
+
+
+def task_option(task_args, task_vars, arg_name, var_name, default=None):
+    """
+    获取插件参数：任务参数优先，其次是role变量
+    """
+    value = task_args.get(arg_name)
+    if value is None:
+        value = task_vars.get(var_name)
+    if value is None:
+        value = default
+    return value
+
+
+class ArtifactCache(object):
+    """
+    管控端制品缓存
+
+    缓存键由来源的内容标识（ETag、对象版本、Gitlab blob SHA）生成，
+    同一个制品在多台主机、多次playbook运行之间只需下载一次。
+    写入通过同目录临时文件+原子改名完成，淘汰按最近使用时间（LRU）进行，
+    并由文件锁保护，多个fork可以同时使用。
+    未命中时按缓存键加锁（single-flight），同一对象只有一个fork下载，
+    其余fork等待其完成后直接复用结果。
+    """
+
+    def __init__(self, cache_dir=None, max_size=None) -> None:
+        self.cache_dir = os.path.abspath(
+            os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR))
+        self.max_size = human_to_bytes(max_size or DEFAULT_MAX_SIZE)
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        self.locks_dir = os.path.join(self.cache_dir, 'locks')
+        self.checksums_dir = os.path.join(self.cache_dir, 'checksums')
+        self.meta_dir = os.path.join(self.cache_dir, 'meta')
+        self.lock_path = os.path.join(self.cache_dir, '.lock')
+
+        for path in (self.objects_dir, self.tmp_dir, self.locks_dir,
+                     self.checksums_dir, self.meta_dir):
+            os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_task(cls, task_args, task_vars):
+        """
+        根据任务参数/role变量构建缓存，未启用时返回None
+        """
+        enabled = task_option(task_args, task_vars,
+                              'cache', 'artifact_cache_enabled', True)
+        if not boolean(enabled, strict=False):
+            return None
+
+        return cls(
+            cache_dir=task_option(task_args, task_vars,
+                                  'cache_dir', 'artifact_cache_dir'),
+            max_size=task_option(task_args, task_vars,
+                                 'cache_max_size', 'artifact_cache_max_size'),
+        )
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        生成缓存键
+        :param parts: 来源标识，如 ('minio', endpoint, bucket, object, etag)
+        :return: sha256 十六进制字符串
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(to_bytes(part if part is not None else ''))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        缓存对象的本地路径
+        """
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def marker_path(self, key):
+        """
+        下载中标记文件，内容为下载进程的pid
+        """
+        return os.path.join(self.locks_dir, key + '.inprogress')
+
+    def pin_path(self, key):
+        return os.path.join(self.locks_dir, key + '.pin')
+
+    def pin(self, key):
+        """
+        标记本进程正在使用该缓存对象：持有其共享锁直到进程退出
+        （Ansible 每个任务一个fork），淘汰时跳过被其它进程使用的对象
+        """
+        path = self.pin_path(key)
+        if path in _PINS:
+            return
+        fp = open(path, 'a')
+        fcntl.flock(fp, fcntl.LOCK_SH)
+        _PINS[path] = fp
+
+    @contextmanager
+    def lock(self, path=None, shared=False):
+        """
+        文件锁，默认锁整个缓存目录
+        """
+        with open(path or self.lock_path, 'a') as fp:
+            fcntl.flock(fp, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield fp
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """
+        命中时返回缓存文件路径并刷新其使用时间，未命中返回None
+        命中的对象在本进程退出前不会被淘汰
+        """
+        path = self.path(key)
+        self.pin(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def mkstemp(self):
+        """
+        在缓存目录内创建临时文件，与缓存对象位于同一文件系统，便于原子改名
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        return tmp_path
+
+    def partial_path(self, key):
+        """
+        未完成下载的数据路径，路径固定，中断后可以续传
+        """
+        return os.path.join(self.tmp_dir, key + '.part')
+
+    def put(self, key, src):
+        """
+        将下载好的文件移入缓存，返回缓存文件路径
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if os.path.dirname(os.path.abspath(src)) != self.tmp_dir:
+            tmp_path = self.mkstemp()
+            shutil.copyfile(src, tmp_path)
+            src = tmp_path
+
+        os.replace(src, path)
+        self.evict()
+        return path
+
+    def fetch(self, key, fetcher):
+        """
+        缓存命中直接返回，否则调用 fetcher(tmp_path) 下载后放入缓存
+        fetcher 返回下载过程中计算出的sha1时一并记录
+        同一对象同时只有一个fork下载，其余fork阻塞在该对象的锁上，
+        下载完成后直接使用缓存结果
+        :return: (缓存文件路径, 是否命中)
+        """
+        path = self.get(key)
+        if path is not None:
+            return path, True
+
+        with self.lock(os.path.join(self.locks_dir, key + '.lock')):
+            # 等待期间其它fork可能已经下载完成
+            path = self.get(key)
+            if path is not None:
+                return path, True
+
+            # 标记残留说明上一个下载进程异常退出（锁已随进程释放），直接覆盖
+            marker = self.marker_path(key)
+            with open(marker, 'w') as fp:
+                fp.write('%d\n' % os.getpid())
+
+            tmp_path = self.mkstemp()
+            try:
+                checksum = fetcher(tmp_path)
+                if checksum:
+                    self.set_checksum(key, checksum)
+                self.pin(key)
+                path = self.put(key, tmp_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                os.remove(marker)
+
+        return path, False
+
+    @staticmethod
+    def _read_value(path):
+        try:
+            with open(path) as fp:
+                return fp.read().strip() or None
+        except (IOError, OSError):
+            return None
+
+    def _write_value(self, path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(value)
+        os.replace(tmp_path, path)
+
+    def get_checksum(self, key):
+        """
+        获取缓存键对应内容的sha1，缓存对象被淘汰后记录仍然保留
+        """
+        return self._read_value(os.path.join(self.checksums_dir, key))
+
+    def set_checksum(self, key, value):
+        """
+        记录缓存键对应内容的sha1
+        """
+        self._write_value(os.path.join(self.checksums_dir, key), value)
+
+    def memoize(self, key, func):
+        """
+        记忆化小段文本（如分支对应的commit SHA、目录列表），
+        多个fork与多次运行之间共用，同一个键只有一个fork调用 func()
+        """
+        path = os.path.join(self.meta_dir, key)
+        value = self._read_value(path)
+        if value is not None:
+            return value
+
+        with self.lock(os.path.join(self.locks_dir, key + '.lock')):
+            value = self._read_value(path)
+            if value is None:
+                value = func()
+                self._write_value(path, value)
+        return value
+
+    def file_checksum(self, key):
+        """
+        缓存对象的sha1：下载时已记录则直接返回，否则读取文件计算一次并记录
+        """
+        value = self.get_checksum(key)
+        if value is None:
+            digest = hashlib.sha1()
+            with open(self.path(key), 'rb') as fp:
+                for data in iter(lambda: fp.read(1024 * 1024), b''):
+                    digest.update(data)
+            value = digest.hexdigest()
+            self.set_checksum(key, value)
+        return value
+
+    def _entries(self):
+        entries = []
+        for root, dirs, files in os.walk(self.objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        按LRU淘汰缓存，直到总大小不超过上限
+        正在被任一进程使用（pin）的对象不淘汰
+        """
+        now = time.time()
+        with self.lock():
+            # 记忆化的元数据按play区分或可以重新获取，后台任务的状态也只需保留一段时间，同样过期清理
+            jobs_dir = os.path.join(self.cache_dir, 'jobs')
+            for dirname in (self.tmp_dir, self.meta_dir, jobs_dir):
+                if not os.path.isdir(dirname):
+                    continue
+                for name in os.listdir(dirname):
+                    tmp_path = os.path.join(dirname, name)
+                    try:
+                        if now - os.stat(tmp_path).st_mtime > STALE_TMP_SECONDS:
+                            os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+            entries = self._entries()
+            total = sum(size for mtime, size, path in entries)
+            if total <= self.max_size:
+                return
+
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                with open(self.pin_path(os.path.basename(path)), 'a') as fp:
+                    try:
+                        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except (IOError, OSError):
+                        continue
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        pass
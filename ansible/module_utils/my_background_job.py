@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from ansible.module_utils._text import to_text
+
+
+# 后台任务启动后写入pid之前，在该时间内视为正在运行
+STARTUP_SECONDS = 60
+
+
+def _job_dir(cache):
+    path = os.path.join(cache.cache_dir, 'jobs')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def _write_json(path, data, mode=0o600):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    os.fchmod(fd, mode)
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(data, fp, default=to_text)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _running(status):
+    if status is None or status.get('finished'):
+        return False
+    pid = status.get('pid')
+    if pid is None:
+        return time.time() - status.get('started', 0) < STARTUP_SECONDS
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def job_status(cache, job_id):
+    """
+    查询后台任务状态
+    :return: {'job_id', 'started', 'finished', 'failed', 'msg', 'result'}
+    """
+    status = _read_json(os.path.join(_job_dir(cache), job_id + '.json'))
+    if status is None:
+        return dict(job_id=job_id, failed=True, finished=True,
+                    msg="job %s not found" % job_id)
+    if not status.get('finished') and not _running(status):
+        # 进程已退出却没有写入结果，按失败处理
+        status.update(finished=True, failed=True,
+                      msg="job %s exited unexpectedly" % job_id)
+    return status
+
+
+def start_job(cache, plugin_path, params, job_id):
+    """
+    在管控端启动脱离当前worker的后台下载进程
+    同一个 job_id 正在运行时直接返回已有任务，多台主机共用一次下载
+    :param plugin_path: 提供 background_fetch(params, cache) 的action插件文件
+    :param params: 传给 background_fetch 的参数，含凭据，只保存到权限为0600的文件
+    """
+    job_dir = _job_dir(cache)
+    status_path = os.path.join(job_dir, job_id + '.json')
+    args_path = os.path.join(job_dir, job_id + '.args')
+
+    with cache.lock(os.path.join(job_dir, job_id + '.lock')):
+        status = _read_json(status_path)
+        if _running(status):
+            return status
+
+        _write_json(args_path, dict(
+            plugin_path=plugin_path, params=params,
+            cache_dir=cache.cache_dir, max_size=cache.max_size))
+        status = dict(job_id=job_id, started=time.time(), finished=False,
+                      failed=False, pid=None)
+        _write_json(status_path, status)
+
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                              job_id, job_dir],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, start_new_session=True)
+    return status
+
+
+def _run(job_id, job_dir):
+    """
+    后台进程入口：执行插件的 background_fetch 并记录结果
+    """
+    status_path = os.path.join(job_dir, job_id + '.json')
+    args_path = os.path.join(job_dir, job_id + '.args')
+    status = _read_json(status_path) or dict(job_id=job_id,
+                                             started=time.time())
+    status['pid'] = os.getpid()
+    _write_json(status_path, status)
+
+    try:
+        job = _read_json(args_path)
+        # 读取后立即删除，凭据不留在磁盘上
+        os.remove(args_path)
+
+        from my_artifact_cache import ArtifactCache
+        cache = ArtifactCache(job['cache_dir'], job['max_size'])
+        spec = importlib.util.spec_from_file_location(
+            'my_background_plugin', job['plugin_path'])
+        plugin = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(plugin)
+
+        status['result'] = plugin.background_fetch(job['params'], cache)
+        status['failed'] = False
+    except Exception as err:
+        status['failed'] = True
+        status['msg'] = to_text(err)
+        status['exception'] = traceback.format_exc()
+
+    status['finished'] = True
+    status['ended'] = time.time()
+    _write_json(status_path, status)
+
+
+if __name__ == '__main__':
+    _run(sys.argv[1], sys.argv[2])
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import threading
+
+from ansible.module_utils._text import to_bytes, to_text
+
+try:
+    import sqlite3
+    HAS_SQLITE3 = True
+except ImportError:
+    HAS_SQLITE3 = False
+
+
+DEFAULT_INDEX_PATH = '~/.ansible/my_checksum_index.db'
+
+# 按 (算法, 路径) 记录，sha1 与 checksum_algorithm 指定的摘要各自缓存
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    algorithm TEXT NOT NULL,
+    path TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (algorithm, path)
+)
+"""
+
+
+class ChecksumIndex(object):
+    """
+    目标主机上的文件校验值索引
+
+    以 (算法, 路径) 为键记录 (dev, inode, size, mtime, ctime) 与摘要，
+    文件的stat信息未变化时直接返回记录的摘要，变化时才重新计算。
+    主机上没有sqlite3时退化为每次都计算。
+    :param hasher: hasher(path, algorithm) 计算摘要，默认使用 module.digest_from_file
+    """
+
+    def __init__(self, module, path=None, hasher=None) -> None:
+        self.module = module
+        self.hasher = hasher or module.digest_from_file
+        self.conn = None
+        self._lock = threading.Lock()
+        if not HAS_SQLITE3:
+            return
+
+        path = os.path.expanduser(path or DEFAULT_INDEX_PATH)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # 摘要可能在其它线程中计算（见 my_digest.verify_source），连接由锁保护
+            self.conn = sqlite3.connect(path, timeout=30,
+                                        check_same_thread=False)
+            self.conn.execute(SCHEMA)
+            self.conn.commit()
+        except (OSError, sqlite3.Error) as err:
+            self.module.warn("checksum index %s unavailable: %s"
+                             % (path, to_text(err)))
+            self.conn = None
+
+    @staticmethod
+    def _stat_key(path):
+        st = os.stat(to_bytes(path, errors='surrogate_or_strict'))
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                st.st_ctime_ns)
+
+    def sha1(self, path):
+        """
+        获取文件sha1，stat信息与记录一致时不读取文件
+        """
+        return self.digest(path, 'sha1')
+
+    def digest(self, path, algorithm='sha1'):
+        """
+        获取文件摘要，stat信息与记录一致时不读取文件
+        """
+        if self.conn is None:
+            return self.hasher(path, algorithm)
+
+        path = os.path.abspath(path)
+        stat_key = self._stat_key(path)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT dev, ino, size, mtime_ns, ctime_ns, checksum "
+                "FROM digests WHERE algorithm = ? AND path = ?",
+                (algorithm, path)).fetchone()
+        if row is not None and tuple(row[:5]) == stat_key:
+            return row[5]
+
+        checksum = self.hasher(path, algorithm)
+        self._store(algorithm, path, stat_key, checksum)
+        return checksum
+
+    def record(self, path, checksum, algorithm='sha1'):
+        """
+        记录刚写入文件的摘要（如 atomic_move 之后），下次无需重新计算
+        """
+        if self.conn is None:
+            return
+        path = os.path.abspath(path)
+        self._store(algorithm, path, self._stat_key(path), checksum)
+
+    def _store(self, algorithm, path, stat_key, checksum):
+        try:
+            with self._lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO digests "
+                    "(algorithm, path, dev, ino, size, mtime_ns, ctime_ns, checksum) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (algorithm, path) + stat_key + (checksum,))
+                self.conn.commit()
+        except sqlite3.Error as err:
+            self.module.warn("failed to update checksum index: %s"
+                             % to_text(err))
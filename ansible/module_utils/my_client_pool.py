@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import os
+import threading
+
+from ansible.module_utils._text import to_bytes
+
+
+DEFAULT_POOL_SIZE = 32
+# minio客户端默认的超时与重试设置
+HTTP_TIMEOUT = 300
+HTTP_RETRIES = 5
+
+# Ansible 为每台主机的每个任务fork一个worker，客户端只在一次任务内有效：
+# 前缀下的多个对象、分段下载的多个线程、缓存检查与下载等多次请求共用同一个客户端及其长连接
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _pool_key(*parts):
+    """
+    客户端的键，凭据只以摘要形式保存
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(to_bytes(part if part is not None else ''))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_client(key, factory):
+    """
+    按键复用本次任务中已创建的客户端，多个线程共用
+    """
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+        return client
+
+
+def get_minio_client(endpoint, access_key, secret_key, secure=False,
+                     pool_size=None):
+    """
+    获取minio客户端，底层 urllib3 连接池保持长连接
+    :param pool_size: 每个主机的最大连接数，应不小于并发下载数
+    """
+    pool_size = int(pool_size or DEFAULT_POOL_SIZE)
+
+    def factory():
+        import certifi
+        import urllib3
+        from minio import Minio
+
+        http_client = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=HTTP_TIMEOUT, read=HTTP_TIMEOUT),
+            maxsize=pool_size,
+            block=False,
+            cert_reqs='CERT_REQUIRED',
+            ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+            retries=urllib3.Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=0.2,
+                status_forcelist=[500, 502, 503, 504],
+            ),
+        )
+        return Minio(endpoint, access_key=access_key, secret_key=secret_key,
+                     secure=secure, http_client=http_client)
+
+    key = _pool_key('minio', endpoint, access_key, secret_key, secure,
+                    pool_size)
+    return get_client(key, factory)
+
+
+def get_gitlab_client(url, private_token, ssl_verify=False, pool_size=None):
+    """
+    获取gitlab客户端，共用一个带连接池的 requests.Session
+    """
+    pool_size = int(pool_size or DEFAULT_POOL_SIZE)
+
+    def factory():
+        import gitlab
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return gitlab.Gitlab(url, private_token, api_version='4',
+                             ssl_verify=ssl_verify, session=session)
+
+    key = _pool_key('gitlab', url, private_token, ssl_verify, pool_size)
+    return get_client(key, factory)
+
+
+def get_http_session(base_url, pool_size=None):
+    """
+    获取带连接池的 requests.Session，本次任务中对同一地址的请求复用长连接
+    """
+    pool_size = int(pool_size or DEFAULT_POOL_SIZE)
+
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    key = _pool_key('http', base_url, pool_size)
+    return get_client(key, factory)
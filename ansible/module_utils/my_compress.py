@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import subprocess
+import tempfile
+import zlib
+
+try:
+    import zstandard
+    HAS_ZSTANDARD = True
+except ImportError:
+    HAS_ZSTANDARD = False
+
+
+BUFSIZE = 1024 * 1024
+# 小于该大小的文件直接传输
+MIN_SIZE = 64 * 1024
+# 采样压缩率高于该值时认为内容不可压缩
+MAX_SAMPLE_RATIO = 0.9
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# 已压缩格式的文件头
+COMPRESSED_MAGIC = (
+    b'\x1f\x8b',                    # gzip
+    b'\x28\xb5\x2f\xfd',            # zstd
+    b'\xfd7zXZ\x00',                # xz
+    b'BZh',                         # bzip2
+    b'\x04\x22\x4d\x18',            # lz4
+    b'PK\x03\x04',                  # zip/jar/whl
+    b'7z\xbc\xaf\x27\x1c',          # 7z
+    b'\x89PNG',
+    b'\xff\xd8\xff',                # jpeg
+)
+
+
+class UnsupportedCompression(Exception):
+    pass
+
+
+def pick_codec(preferred='auto'):
+    """
+    选择压缩算法：auto 在有zstandard时使用zstd，否则使用gzip
+    """
+    if preferred == 'auto':
+        return 'zstd' if HAS_ZSTANDARD else 'gzip'
+    if preferred == 'zstd' and not HAS_ZSTANDARD:
+        return 'gzip'
+    return preferred
+
+
+def worth_compressing(path):
+    """
+    根据文件头与开头一段数据的压缩率判断是否值得压缩
+    """
+    if os.path.getsize(path) < MIN_SIZE:
+        return False
+    with open(path, 'rb') as fp:
+        sample = fp.read(BUFSIZE)
+    if sample.startswith(COMPRESSED_MAGIC):
+        return False
+    return len(zlib.compress(sample, 1)) < MAX_SAMPLE_RATIO * len(sample)
+
+
+def compress_file(path, codec):
+    """
+    在管控端流式压缩文件
+    :return: 压缩后的临时文件路径，由调用方删除
+    """
+    fd, out_path = tempfile.mkstemp(suffix='.' + codec)
+    try:
+        with open(path, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+            if codec == 'zstd':
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(
+                    fsrc, fdst, read_size=BUFSIZE, write_size=BUFSIZE)
+            else:
+                compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+                for data in iter(lambda: fsrc.read(BUFSIZE), b''):
+                    fdst.write(compressor.compress(data))
+                fdst.write(compressor.flush())
+    except BaseException:
+        os.remove(out_path)
+        raise
+    return out_path
+
+
+def prepare_compressed(path, preferred):
+    """
+    按需压缩待传输的文件，内容已压缩或压缩收益低时不处理
+    :return: (算法, 压缩文件路径)，未压缩时为 (None, None)
+    """
+    if not preferred or preferred == 'none' or not worth_compressing(path):
+        return None, None
+    codec = pick_codec(preferred)
+    return codec, compress_file(path, codec)
+
+
+def decompress_file(src, dest, codec, zstd_bin=None):
+    """
+    在目标主机上流式解压
+    zstd 优先使用 python zstandard，没有时使用 zstd 命令，都没有时抛出 UnsupportedCompression
+    """
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        if codec == 'gzip':
+            decompressor = zlib.decompressobj(31)
+            for data in iter(lambda: fsrc.read(BUFSIZE), b''):
+                fdst.write(decompressor.decompress(data))
+            fdst.write(decompressor.flush())
+            if not decompressor.eof:
+                raise ValueError("truncated gzip stream")
+        elif codec == 'zstd' and HAS_ZSTANDARD:
+            zstandard.ZstdDecompressor().copy_stream(
+                fsrc, fdst, read_size=BUFSIZE, write_size=BUFSIZE)
+        elif codec == 'zstd' and zstd_bin:
+            subprocess.check_call([zstd_bin, '-d', '-c', '-q'],
+                                  stdin=fsrc, stdout=fdst)
+        elif codec == 'zstd':
+            raise UnsupportedCompression(codec)
+        else:
+            raise ValueError("unknown compression %s" % codec)
+
+
+def decompress_to_tmp(module, b_src, codec, b_dir=None):
+    """
+    目标主机上把传输来的压缩文件解压到 b_dir 下的临时文件，并删除压缩文件
+    无法解压时模块失败，unsupported_compression 提示管控端改用gzip
+    :return: 临时文件路径
+    """
+    if b_dir and not os.path.isdir(b_dir):
+        os.makedirs(b_dir)
+    fd, b_tmp = tempfile.mkstemp(dir=b_dir or None, prefix=b'.ansible_tmp')
+    os.close(fd)
+    try:
+        decompress_file(b_src, b_tmp, codec,
+                        zstd_bin=module.get_bin_path('zstd'))
+    except UnsupportedCompression:
+        os.remove(b_tmp)
+        module.fail_json(msg="%s decompression is not available" % codec,
+                         unsupported_compression=True)
+    except Exception as err:
+        os.remove(b_tmp)
+        module.fail_json(msg="failed to decompress %s: %s" % (b_src, err))
+    os.remove(b_src)
+    return b_tmp
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import os
+import struct
+import tempfile
+
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# 差量文件超过源文件的该比例时直接传输整个文件
+MAX_DELTA_RATIO = 0.8
+
+MAGIC = b'MYDELTA1'
+HEADER = struct.Struct('>Q')
+COPY = struct.Struct('>QQ')
+DATA = struct.Struct('>Q')
+
+
+def block_signatures(path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    在目标主机上计算已有文件的分块签名，同时得到整个文件的sha1
+    :return: ([每块的sha1], 文件sha1)
+    """
+    signatures = []
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            signatures.append(hashlib.sha1(block).hexdigest())
+            digest.update(block)
+    return signatures, digest.hexdigest()
+
+
+def make_delta(src_path, signatures, block_size, delta_path):
+    """
+    在管控端按目标文件的分块签名生成差量文件
+    源文件按块对齐比对，目标文件任意位置有相同内容的块只记录块号，
+    其余块原样写入
+    :return: (差量文件大小, 复用的块数, 总块数)
+    """
+    index = {}
+    for i, signature in enumerate(signatures):
+        index.setdefault(signature, i)
+
+    matched = total = 0
+    run_start = run_count = None
+
+    with open(src_path, 'rb') as fsrc, open(delta_path, 'wb') as fdst:
+        fdst.write(MAGIC + HEADER.pack(block_size))
+
+        def flush():
+            if run_count:
+                fdst.write(b'C' + COPY.pack(run_start, run_count))
+
+        for block in iter(lambda: fsrc.read(block_size), b''):
+            total += 1
+            i = index.get(hashlib.sha1(block).hexdigest())
+            if i is not None:
+                matched += 1
+                # 连续的块合并为一条复制记录
+                if run_count and run_start + run_count == i:
+                    run_count += 1
+                else:
+                    flush()
+                    run_start, run_count = i, 1
+                continue
+
+            flush()
+            run_start = run_count = None
+            fdst.write(b'D' + DATA.pack(len(block)))
+            fdst.write(block)
+        flush()
+
+    return os.path.getsize(delta_path), matched, total
+
+
+def prepare_delta(src_path, signatures, block_size):
+    """
+    管控端生成临时差量文件，没有可复用的块或差量不够小时返回None
+    :return: 差量文件路径，由调用方删除
+    """
+    fd, delta_path = tempfile.mkstemp(suffix='.delta')
+    os.close(fd)
+    try:
+        delta_size, matched, total = make_delta(src_path, signatures,
+                                                block_size, delta_path)
+    except BaseException:
+        os.remove(delta_path)
+        raise
+
+    if not matched or delta_size > MAX_DELTA_RATIO * os.path.getsize(src_path):
+        os.remove(delta_path)
+        return None
+    return delta_path
+
+
+def apply_delta(base_path, delta_path, out_path):
+    """
+    在目标主机上根据已有文件与差量文件重建新文件
+    """
+    with open(delta_path, 'rb') as fdelta, open(base_path, 'rb') as fbase, \
+            open(out_path, 'wb') as fout:
+        if fdelta.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a delta file" % delta_path)
+        block_size, = HEADER.unpack(fdelta.read(HEADER.size))
+
+        while True:
+            op = fdelta.read(1)
+            if not op:
+                break
+            if op == b'C':
+                start, count = COPY.unpack(fdelta.read(COPY.size))
+                fbase.seek(start * block_size)
+                remaining = count * block_size
+                while remaining > 0:
+                    data = fbase.read(min(remaining, block_size))
+                    if not data:
+                        break
+                    fout.write(data)
+                    remaining -= len(data)
+            elif op == b'D':
+                length, = DATA.unpack(fdelta.read(DATA.size))
+                data = fdelta.read(length)
+                if len(data) != length:
+                    raise ValueError("truncated delta file %s" % delta_path)
+                fout.write(data)
+            else:
+                raise ValueError("corrupt delta file %s" % delta_path)
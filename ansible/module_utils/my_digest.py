@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import mmap
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+    HAS_XXHASH = True
+except ImportError:
+    HAS_XXHASH = False
+
+
+# 单次送入摘要的大小，hashlib 对大块数据计算时释放GIL，多个文件可真正并行
+BLOCK_SIZE = 8 * 1024 * 1024
+ALGORITHMS = ('sha1', 'sha256', 'blake2b', 'xxh64', 'xxh3_128')
+XXHASH_ALGORITHMS = ('xxh64', 'xxh3_128')
+
+
+class UnsupportedDigest(ValueError):
+    pass
+
+
+def available(algorithm):
+    """
+    本机能否计算该摘要，xxhash 系列需要安装 xxhash
+    """
+    if algorithm in XXHASH_ALGORITHMS:
+        return HAS_XXHASH and hasattr(xxhash, algorithm)
+    return algorithm in ALGORITHMS
+
+
+def new_hasher(algorithm):
+    if not available(algorithm):
+        raise UnsupportedDigest("digest algorithm %s is not available"
+                                % algorithm)
+    if algorithm in XXHASH_ALGORITHMS:
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def file_digest(path, algorithm='sha1'):
+    """
+    通过mmap分块读取计算文件摘要，不经过用户态缓冲区拷贝
+    无法mmap的文件（空文件、特殊文件）按普通读取
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except (OSError, ValueError):
+            mm = None
+
+        if mm is None:
+            for data in iter(lambda: fp.read(BLOCK_SIZE), b''):
+                hasher.update(data)
+            return hasher.hexdigest()
+
+        with mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mm)
+            try:
+                for offset in range(0, size, BLOCK_SIZE):
+                    hasher.update(view[offset:offset + BLOCK_SIZE])
+            finally:
+                view.release()
+    return hasher.hexdigest()
+
+
+def run_concurrently(funcs):
+    """
+    并发执行多个摘要计算，None 项直接返回None
+    :return: 与 funcs 顺序一致的结果
+    """
+    jobs = [func for func in funcs if func is not None]
+    if len(jobs) <= 1:
+        return [func() if func is not None else None for func in funcs]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(func) if func is not None else None
+                   for func in funcs]
+        return [future.result() if future is not None else None
+                for future in futures]
+
+
+def verify_source(src, dest, checksum, index=None, digest=None,
+                  algorithm='sha1'):
+    """
+    并发计算源文件与目标文件的摘要，供模块校验传输结果并判断是否需要移动
+    提供 digest 时按 algorithm 校验，源文件与管控端一致，其sha1即 checksum
+    目标文件的摘要提供 index（ChecksumIndex）时按 (算法, 路径) 从索引获取
+    :return: (源文件摘要, 目标文件sha1（不存在或不同时可能为None）, 源文件是否与期望一致)
+    """
+    algorithm = algorithm if digest else 'sha1'
+    has_src = os.path.isfile(src)
+    has_dest = os.path.isfile(dest) and os.access(dest, os.R_OK)
+
+    def dest_digest():
+        if index:
+            return index.digest(dest, algorithm)
+        return file_digest(dest, algorithm)
+
+    digest_src, digest_dest = run_concurrently([
+        (lambda: file_digest(src, algorithm)) if has_src else None,
+        dest_digest if has_dest else None])
+
+    if not digest:
+        return (digest_src, digest_dest,
+                not checksum or digest_src == checksum)
+    if digest_src != digest:
+        return digest_src, None, False
+    return checksum, checksum if digest_dest == digest_src else None, True
+
+
+def source_digest(path, algorithm, cache=None):
+    """
+    管控端源文件的摘要，提供缓存（ArtifactCache）时按路径、大小与修改时间记忆化，
+    多个fork与多次运行之间只计算一次
+    """
+    if cache is None:
+        return file_digest(path, algorithm)
+    st = os.stat(path)
+    key = cache.make_key('digest', algorithm, os.path.abspath(path),
+                         st.st_size, st.st_mtime_ns)
+    return cache.memoize(key, lambda: file_digest(path, algorithm))
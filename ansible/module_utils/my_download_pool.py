@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RETRIES = 3
+# 重试退避时间上限（秒）
+MAX_BACKOFF = 10
+
+
+def with_retries(func, item, retries=DEFAULT_RETRIES, retry_on=(Exception,)):
+    """
+    执行 func(item)，失败时按指数退避重试
+    :param retries: 失败后的重试次数
+    :param retry_on: 需要重试的异常类型
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(item)
+        except retry_on:
+            if attempt >= retries:
+                raise
+            time.sleep(min(2 ** attempt, MAX_BACKOFF))
+            attempt += 1
+
+
+def run_parallel(func, items, concurrency=DEFAULT_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, retry_on=(Exception,)):
+    """
+    有界线程池并发执行 func(item)，每一项单独重试
+    任一项重试后仍失败时取消未开始的任务并抛出该异常
+    :return: 与 items 顺序一致的结果列表
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    concurrency = max(1, min(int(concurrency), len(items)))
+    retries = int(retries)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(with_retries, func, item, retries, retry_on)
+                   for item in items]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        for future in futures:
+            if future in done and future.exception() is not None:
+                raise future.exception()
+
+    return [future.result() for future in futures]
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import errno
+import hmac
+import json
+import os
+import re
+import secrets
+import stat
+import tempfile
+import time
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_FANOUT = 4
+DEFAULT_PORT = 8765
+# 主机提供下载的时间（秒），每次新增文件时顺延
+DEFAULT_TTL = 900
+# 等待上级主机完成的最长时间（秒），超时后改为从管控端传输
+DEFAULT_TIMEOUT = 1800
+DEFAULT_BOARD_DIR = '~/.ansible/my_artifact_fanout'
+# 目标主机上的私有目录（0700，属主为运行模块的用户）
+DEFAULT_SEED_DIR = '~/.ansible/my_artifact_seed'
+BOARD_POLL_MIN = 0.2
+BOARD_POLL_MAX = 2.0
+# 超过该时间的完成记录在发布时清理
+BOARD_MAX_AGE = 86400
+# 下载路径 /<token>/<sha1>，token 每次启动服务时随机生成
+SEED_PATH_RE = re.compile(r'^/([0-9a-f]+)/([0-9a-f]{40})$')
+TOKEN_BYTES = 16
+
+
+def tree_parent(hosts, host, fanout=DEFAULT_FANOUT):
+    """
+    分发树中 host 的上级主机
+
+    按 hosts 的顺序编号，前 fanout 台直接从管控端获取，
+    之后第 i 台从第 (i - fanout) // fanout 台获取，每台最多转发给 fanout 台，
+    树的深度随主机数按对数增长。上级的编号总是更小，
+    linear 策略按顺序占用fork，等待中的主机不会阻塞其上级。
+    :return: 上级主机名，直接从管控端获取时为None
+    """
+    fanout = max(int(fanout), 1)
+    try:
+        i = list(hosts).index(host)
+    except ValueError:
+        return None
+    if i < fanout:
+        return None
+    return hosts[(i - fanout) // fanout]
+
+
+class Board(object):
+    """
+    管控端记录分发树中各主机的完成情况，所有fork通过文件共享
+
+    每个任务一个目录，每台主机完成（或失败）后写入一个记录，
+    下级主机轮询上级的记录，取得可下载的URL。
+    """
+
+    def __init__(self, key, board_dir=None) -> None:
+        root = os.path.abspath(os.path.expanduser(
+            board_dir or DEFAULT_BOARD_DIR))
+        self.path = os.path.join(root, key)
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        self._clean(root)
+
+    def _marker(self, host):
+        return os.path.join(self.path, re.sub(r'[^\w.-]', '_', host) + '.json')
+
+    def publish(self, host, checksum, url=None):
+        """
+        记录 host 已完成，url 为None表示 host 无法提供下载，下级改为从管控端获取
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(dict(host=host, checksum=checksum, url=url), fp)
+        os.replace(tmp_path, self._marker(host))
+
+    def wait(self, host, timeout=DEFAULT_TIMEOUT):
+        """
+        等待 host 完成
+        :return: host 的记录，超时返回None
+        """
+        deadline = time.time() + float(timeout)
+        delay = BOARD_POLL_MIN
+        path = self._marker(host)
+        while True:
+            try:
+                with open(path) as fp:
+                    return json.load(fp)
+            except (IOError, OSError, ValueError):
+                pass
+            if time.time() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, BOARD_POLL_MAX)
+
+    @staticmethod
+    def _clean(root):
+        now = time.time()
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                if now - os.path.getmtime(path) < BOARD_MAX_AGE:
+                    continue
+                for child in os.listdir(path):
+                    os.remove(os.path.join(path, child))
+                os.rmdir(path)
+            except OSError:
+                pass
+
+
+class SeedHandler(SimpleHTTPRequestHandler):
+    """
+    只提供 /<token>/<sha1> 形式的文件，token 不符时返回404，不列目录
+    """
+    token = None
+
+    def send_head(self):
+        match = SEED_PATH_RE.match(self.path.split('?', 1)[0])
+        if (not match or not self.token
+                or not hmac.compare_digest(match.group(1), self.token)):
+            self.send_error(404)
+            return None
+        self.path = '/' + match.group(2)
+        return SimpleHTTPRequestHandler.send_head(self)
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def log_message(self, format, *args):
+        pass
+
+
+def private_dir(path):
+    """
+    创建或检查私有目录：不能是符号链接，属主为当前用户且组与其他用户无权限
+    不满足时抛出 OSError，避免在他人可控的目录中写入或删除文件
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    try:
+        os.makedirs(path, mode=0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(errno.ENOTDIR, "%s is not a directory" % path)
+    if st.st_uid != os.geteuid() or st.st_mode & 0o077:
+        raise OSError(errno.EPERM, "%s must be owned by uid %d with mode 0700"
+                      % (path, os.geteuid()))
+    return path
+
+
+def _write_private(directory, name, data):
+    """
+    通过 O_EXCL 创建的临时文件写入后替换，不跟随已有的符号链接
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(data)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+def _read_private(directory, name):
+    try:
+        fd = os.open(os.path.join(directory, name),
+                     os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd) as fp:
+        return fp.read().strip()
+
+
+def _alive(seed_dir):
+    try:
+        os.kill(int(_read_private(seed_dir, '.pid')), 0)
+    except (TypeError, OSError, ValueError):
+        return False
+    return True
+
+
+def serve_file(path, checksum, bind, seed_dir=None, port=DEFAULT_PORT,
+               ttl=DEFAULT_TTL):
+    """
+    在目标主机上通过HTTP提供 path 的下载，供分发树的下级主机获取
+
+    seed_dir 下以sha1命名的符号链接指向 path，每台主机只运行一个脱离模块进程的
+    HTTP服务，只监听 bind 地址，URL中需带上启动时随机生成的token。
+    超过 ttl 没有新文件加入时退出并清理 seed_dir。
+    下级主机下载后按sha1校验，path 在此期间被替换不会导致错误的文件落盘。
+    :return: (是否正在提供下载, token, 说明)
+    """
+    if not re.match(r'^[0-9a-f]{40}$', checksum):
+        raise ValueError("invalid checksum %s" % checksum)
+    seed_dir = private_dir(seed_dir or DEFAULT_SEED_DIR)
+
+    # 符号链接以随机名称创建后替换，创建时已存在同名文件会失败
+    tmp_link = os.path.join(seed_dir, '.tmp' + secrets.token_hex(8))
+    os.symlink(os.path.abspath(path), tmp_link)
+    os.replace(tmp_link, os.path.join(seed_dir, checksum))
+
+    _write_private(seed_dir, '.expires', '%f' % (time.time() + float(ttl)))
+
+    if _alive(seed_dir):
+        token = _read_private(seed_dir, '.token')
+        if token:
+            return True, token, "already serving"
+
+    token = secrets.token_hex(TOKEN_BYTES)
+    handler_class = type('TokenSeedHandler', (SeedHandler,), dict(token=token))
+
+    def handler(*args, **kwargs):
+        return handler_class(*args, directory=seed_dir, **kwargs)
+
+    try:
+        server = ThreadingHTTPServer((bind, int(port)), handler)
+    except (IOError, OSError) as err:
+        token = _read_private(seed_dir, '.token')
+        if err.errno == errno.EADDRINUSE and _alive(seed_dir) and token:
+            return True, token, "already serving"
+        return False, None, "cannot listen on %s:%s: %s" % (bind, port, err)
+    # 退出前等待进行中的下载完成
+    server.daemon_threads = False
+    _write_private(seed_dir, '.token', token)
+
+    # 两次fork脱离模块进程，模块返回后服务继续运行
+    pid = os.fork()
+    if pid:
+        server.server_close()
+        os.waitpid(pid, 0)
+        return True, token, "serving on %s:%s" % (bind, port)
+
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    try:
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        _write_private(seed_dir, '.pid', '%d' % os.getpid())
+        _serve_until_expired(server, seed_dir)
+    finally:
+        os._exit(0)
+
+
+def _serve_until_expired(server, seed_dir):
+    server.timeout = 1
+    while True:
+        try:
+            expires = float(_read_private(seed_dir, '.expires'))
+        except (TypeError, ValueError):
+            expires = 0
+        if time.time() >= expires:
+            break
+        server.handle_request()
+
+    server.server_close()
+    # 只删除本服务创建的符号链接与状态文件
+    for name in os.listdir(seed_dir):
+        path = os.path.join(seed_dir, name)
+        if (os.path.islink(path) and re.match(r'^[0-9a-f]{40}$', name)) or (
+                name.startswith('.') and os.path.isfile(path)
+                and not os.path.islink(path)):
+            os.remove(path)
+    try:
+        os.rmdir(seed_dir)
+    except OSError:
+        pass
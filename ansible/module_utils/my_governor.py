@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.common.text.formatters import human_to_bytes
+
+from my_artifact_cache import task_option
+
+
+DEFAULT_STATE_DIR = '~/.ansible/my_artifact_governor'
+# 累计到该字节数才更新一次共享的令牌桶，减少加锁次数
+THROTTLE_QUANTUM = 256 * 1024
+# 等待空闲连接槽位的轮询间隔（秒）
+SLOT_POLL_MIN = 0.05
+SLOT_POLL_MAX = 1.0
+
+
+class Governor(object):
+    """
+    管控端从同一来源（minio端点、gitlab地址）拉取数据的限速与并发限制
+
+    所有fork进程共用：令牌桶（字节/秒）的状态保存在文件中，由文件锁保护，
+    允许令牌为负（预约），超出的部分按速率换算为等待时间；
+    并发连接数通过 connections 个槽位锁文件限制，进程退出时锁自动释放。
+    """
+
+    def __init__(self, name, rate=None, connections=None,
+                 state_dir=None) -> None:
+        self.rate = human_to_bytes(rate) if rate else 0
+        # 桶容量为一秒的流量
+        self.burst = max(self.rate, THROTTLE_QUANTUM)
+        self.connections = int(connections or 0)
+        self.state_dir = os.path.abspath(
+            os.path.expanduser(state_dir or DEFAULT_STATE_DIR))
+        os.makedirs(self.state_dir, exist_ok=True)
+
+        key = hashlib.sha256(to_bytes(name)).hexdigest()[:16]
+        self.bucket_path = os.path.join(self.state_dir, key + '.bucket')
+        self.slot_prefix = os.path.join(self.state_dir, key + '.slot')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @classmethod
+    def from_task(cls, name, task_args, task_vars):
+        """
+        按来源读取 artifact_source_limits 中的限制，没有配置时返回None
+        """
+        limits = task_option(task_args, task_vars, 'source_limits',
+                             'artifact_source_limits') or {}
+        limit = limits.get(name) or limits.get('default')
+        if not limit or not (limit.get('rate') or limit.get('connections')):
+            return None
+        return cls(name, rate=limit.get('rate'),
+                   connections=limit.get('connections'),
+                   state_dir=task_option(task_args, task_vars, 'governor_dir',
+                                         'artifact_governor_dir'))
+
+    @contextmanager
+    def connection(self):
+        """
+        占用一个连接槽位，没有空闲槽位时等待
+        """
+        if not self.connections:
+            yield
+            return
+
+        fp = None
+        delay = SLOT_POLL_MIN
+        while fp is None:
+            for i in range(self.connections):
+                slot = open('%s.%d' % (self.slot_prefix, i), 'a')
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    slot.close()
+                    continue
+                fp = slot
+                break
+            else:
+                time.sleep(delay)
+                delay = min(delay * 2, SLOT_POLL_MAX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+            fp.close()
+
+    def throttle(self, nbytes):
+        """
+        记录已读取的字节数，超出速率时阻塞相应的时间
+        """
+        if not self.rate:
+            return
+        with self._pending_lock:
+            self._pending += nbytes
+            if self._pending < THROTTLE_QUANTUM:
+                return
+            nbytes, self._pending = self._pending, 0
+
+        fd = os.open(self.bucket_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                tokens, stamp = [float(v) for v in fp.read().split()]
+            except ValueError:
+                tokens, stamp = self.burst, now
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            tokens -= nbytes
+            fp.seek(0)
+            fp.truncate()
+            fp.write('%f %f' % (tokens, now))
+
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+
+class NullGovernor(object):
+    """
+    未配置限制时使用，不做任何限制
+    """
+
+    @contextmanager
+    def connection(self):
+        yield
+
+    def throttle(self, nbytes):
+        pass
+
+
+NULL_GOVERNOR = NullGovernor()
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import threading
+
+from ansible.module_utils.common.text.formatters import human_to_bytes
+
+from my_download_pool import run_parallel, with_retries, DEFAULT_RETRIES
+from my_governor import NULL_GOVERNOR
+from my_stream import BUDGET, buffer_size as stream_buffer_size
+from my_sync import preallocate
+
+
+DEFAULT_CHUNK_SIZE = '64M'
+DEFAULT_PARTS = 4
+# 计算摘要时单次读取的大小
+STREAM_BUFFER = 1024 * 1024
+
+
+class RangedDownloadError(IOError):
+    pass
+
+
+class OrderedHasher(object):
+    """
+    按偏移顺序计算分段下载文件的sha1
+
+    分段完成的顺序不确定，每当文件开头连续的分段都已完成时，
+    立即读取这些刚写入的数据（通常仍在页缓存中）更新摘要，
+    下载结束时摘要也随之完成，无需再完整读一遍文件。
+    """
+
+    def __init__(self, path, chunks) -> None:
+        self.path = path
+        self.chunks = chunks
+        self.next = 0
+        self.done = set()
+        self.digest = hashlib.sha1()
+        self._lock = threading.Lock()
+
+    def mark(self, offset):
+        """
+        标记一个分段已完成，并推进摘要
+        """
+        with self._lock:
+            self.done.add(offset)
+            while (self.next < len(self.chunks)
+                   and self.chunks[self.next][0] in self.done):
+                self._update(*self.chunks[self.next])
+                self.next += 1
+
+    def _update(self, offset, length):
+        with open(self.path, 'rb') as fp:
+            fp.seek(offset)
+            while length > 0:
+                data = fp.read(min(STREAM_BUFFER, length))
+                if not data:
+                    break
+                self.digest.update(data)
+                length -= len(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class RangedDownloader(object):
+    """
+    分段并发下载minio大对象
+
+    对象按 chunk_size 切分，多个分段通过 Range GET 并发下载，
+    按偏移写入预分配好的文件。每个分段请求带 If-Match: ETag，
+    下载期间对象被替换时直接失败。已完成的分段记录在状态文件中，
+    中断后再次下载只补齐缺失的分段。
+    下载过程中同时计算sha1，调用方不需要再读一遍文件。
+    提供 governor 时每个连接占用一个槽位，读取的数据计入限速。
+    每个连接按 buffer_size 读取响应流，读取前在进程的内存额度中预留（见 my_stream）。
+    """
+
+    def __init__(self, client, chunk_size=None, parts=None, retries=None,
+                 retry_on=(Exception,), governor=None,
+                 buffer_size=None) -> None:
+        self.client = client
+        self.chunk_size = human_to_bytes(chunk_size or DEFAULT_CHUNK_SIZE)
+        self.parts = int(parts or DEFAULT_PARTS)
+        self.retries = int(retries if retries is not None else DEFAULT_RETRIES)
+        self.retry_on = retry_on
+        self.governor = governor or NULL_GOVERNOR
+        self.buffer_size = stream_buffer_size(buffer_size)
+        self._state_lock = threading.Lock()
+
+    def download(self, bucket, object_name, file_path, part_path=None,
+                 version_id=None):
+        """
+        下载对象到 file_path，不超过一个分段的对象单连接流式下载
+        :param part_path: 未完成数据的保存路径，相同路径可断点续传
+        :return: (对象信息（stat_object 结果）, 文件sha1)
+        """
+        stat = self.client.stat_object(bucket, object_name,
+                                       version_id=version_id)
+        part_path = part_path or file_path + '.part'
+        for path in (file_path, part_path):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if stat.size <= self.chunk_size:
+            checksum = self._fetch_stream(bucket, object_name, version_id,
+                                          stat, part_path)
+            os.replace(part_path, file_path)
+            return stat, checksum
+
+        state_path = part_path + '.json'
+        chunks = [(offset, min(self.chunk_size, stat.size - offset))
+                  for offset in range(0, stat.size, self.chunk_size)]
+
+        state = self._load_state(state_path, part_path, stat)
+        if state is None:
+            state = {'etag': stat.etag, 'size': stat.size,
+                     'chunk_size': self.chunk_size, 'done': []}
+            self._preallocate(part_path, stat.size)
+            self._save_state(state_path, state)
+
+        hasher = OrderedHasher(part_path, chunks)
+        for offset in list(state['done']):
+            hasher.mark(offset)
+        missing = [chunk for chunk in chunks if chunk[0] not in state['done']]
+
+        def fetch_chunk(chunk):
+            with_retries(
+                lambda c: self._fetch_range(bucket, object_name, version_id,
+                                            stat.etag, part_path, c),
+                chunk, self.retries, self.retry_on)
+            with self._state_lock:
+                state['done'].append(chunk[0])
+                self._save_state(state_path, state)
+            hasher.mark(chunk[0])
+
+        # 分段内部已重试，这里不再重试
+        run_parallel(fetch_chunk, missing, concurrency=self.parts, retries=0)
+
+        if os.path.getsize(part_path) != stat.size:
+            raise RangedDownloadError(
+                "size mismatch for %s: expected %d, got %d"
+                % (object_name, stat.size, os.path.getsize(part_path)))
+
+        os.replace(part_path, file_path)
+        os.remove(state_path)
+        return stat, hasher.hexdigest()
+
+    def _fetch_stream(self, bucket, object_name, version_id, stat, part_path):
+        """
+        单连接流式下载整个对象，边写边计算sha1
+        """
+        digest = hashlib.sha1()
+        written = 0
+        with BUDGET.reserve(self.buffer_size), self.governor.connection():
+            response = self.client.get_object(
+                bucket, object_name, request_headers={'If-Match': stat.etag},
+                version_id=version_id)
+            try:
+                with open(part_path, 'wb') as fp:
+                    for data in response.stream(amt=self.buffer_size):
+                        fp.write(data)
+                        digest.update(data)
+                        written += len(data)
+                        self.governor.throttle(len(data))
+            finally:
+                response.close()
+                response.release_conn()
+
+        if written != stat.size:
+            raise RangedDownloadError(
+                "short read for %s: expected %d, got %d"
+                % (object_name, stat.size, written))
+        return digest.hexdigest()
+
+    def _fetch_range(self, bucket, object_name, version_id, etag, part_path,
+                     chunk):
+        """
+        下载一个分段并写入对应偏移
+        """
+        offset, length = chunk
+        written = 0
+        with BUDGET.reserve(self.buffer_size), self.governor.connection():
+            response = self.client.get_object(
+                bucket, object_name, offset=offset, length=length,
+                request_headers={'If-Match': etag}, version_id=version_id)
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                for data in response.stream(amt=self.buffer_size):
+                    os.pwrite(fd, data, offset + written)
+                    written += len(data)
+                    self.governor.throttle(len(data))
+            finally:
+                os.close(fd)
+                response.close()
+                response.release_conn()
+
+        if written != length:
+            raise RangedDownloadError(
+                "short read for %s at offset %d: expected %d, got %d"
+                % (object_name, offset, length, written))
+
+    @staticmethod
+    def _preallocate(part_path, size):
+        """
+        创建完整大小的文件，各分段按偏移写入；预留空间与 install_file 相同（见 my_sync）
+        """
+        with open(part_path, 'wb') as fp:
+            preallocate(fp.fileno(), size)
+            fp.truncate(size)
+
+    def _load_state(self, state_path, part_path, stat):
+        """
+        读取断点状态，对象或分段大小变化时作废
+        """
+        if not (os.path.exists(state_path) and os.path.exists(part_path)):
+            return None
+        try:
+            with open(state_path) as fp:
+                state = json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+        if (state.get('etag') != stat.etag or state.get('size') != stat.size
+                or state.get('chunk_size') != self.chunk_size
+                or os.path.getsize(part_path) != stat.size):
+            return None
+        return state
+
+    @staticmethod
+    def _save_state(state_path, state):
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(state, fp)
+        os.replace(tmp_path, state_path)
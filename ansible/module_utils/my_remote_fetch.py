@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import os
+import tempfile
+
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.urls import fetch_url
+
+
+# 单次从响应流读取的大小
+BUFSIZE = 1024 * 1024
+
+
+def fetch_to_tmp(module, url, dest, headers=None, algorithms=('sha1',),
+                 timeout=60):
+    """
+    在目标主机上直接下载url，写入dest所在目录的临时文件，边下载边计算摘要
+    :param algorithms: 需要计算的摘要算法
+    :return: (临时文件路径, {算法: 十六进制摘要}, 文件大小)
+    """
+    b_dest_dir = os.path.dirname(to_bytes(dest, errors='surrogate_or_strict'))
+    if b_dest_dir and not os.path.isdir(b_dest_dir):
+        module.fail_json(msg="Destination directory %s does not exist"
+                         % to_native(b_dest_dir))
+
+    response, info = fetch_url(module, url, headers=headers, timeout=timeout)
+    if info['status'] != 200:
+        module.fail_json(msg="Failed to download %s: %s"
+                         % (module.params['src'], info.get('msg')),
+                         status=info['status'])
+
+    digests = dict((name, hashlib.new(name)) for name in algorithms)
+    fd, tmp_path = tempfile.mkstemp(dir=b_dest_dir or None,
+                                    prefix=b'.ansible_tmp')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            while True:
+                data = response.read(BUFSIZE)
+                if not data:
+                    break
+                fp.write(data)
+                size += len(data)
+                for digest in digests.values():
+                    digest.update(data)
+    except Exception as err:
+        os.remove(tmp_path)
+        module.fail_json(msg="Failed to download %s: %s"
+                         % (module.params['src'], to_native(err)))
+
+    return (tmp_path, dict((name, digest.hexdigest())
+                           for name, digest in digests.items()), size)
+
+
+def verify_fetched(module, tmp_path, digests, size, expected):
+    """
+    校验下载结果，不一致时删除临时文件并失败
+    :param expected: {'size': ..., 算法: 期望摘要}，值为None的项不校验
+    """
+    actual = dict(digests, size=size)
+    for name, value in expected.items():
+        if value is None or actual.get(name) is None:
+            continue
+        if actual[name] != value:
+            os.remove(tmp_path)
+            module.fail_json(
+                msg='Downloaded file does not match the expected %s. Transfer failed.' % name,
+                checksum=actual[name], expected_checksum=value)
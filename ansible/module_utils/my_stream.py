@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import threading
+
+from contextlib import contextmanager
+
+from ansible.module_utils.common.text.formatters import human_to_bytes
+
+from my_governor import NULL_GOVERNOR
+
+
+# 单次从响应流读取并写入文件的大小
+DEFAULT_BUFFER_SIZE = '1M'
+# 每个进程（fork）同时持有的流缓冲总量上限
+DEFAULT_MEMORY_LIMIT = '256M'
+
+
+class MemoryBudget(object):
+    """
+    进程内流式下载缓冲的内存上限
+
+    每个流在读取前按缓冲大小预留额度，总额超出上限时等待其它流结束，
+    并发下载数、分段数再多，一个fork持有的缓冲也不超过上限。
+    单个流的缓冲超过上限时按上限计算，不会永远等待。
+    """
+
+    def __init__(self, limit=DEFAULT_MEMORY_LIMIT) -> None:
+        self.limit = human_to_bytes(limit)
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def configure(self, limit):
+        """
+        调整上限，已预留的额度不受影响
+        """
+        with self._cond:
+            self.limit = human_to_bytes(limit or DEFAULT_MEMORY_LIMIT)
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        with self._cond:
+            nbytes = min(nbytes, self.limit)
+            while self.used + nbytes > self.limit:
+                self._cond.wait()
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+
+BUDGET = MemoryBudget()
+
+
+def buffer_size(size=None):
+    return human_to_bytes(size or DEFAULT_BUFFER_SIZE)
+
+
+class StreamSink(object):
+    """
+    流式下载的回调：数据块直接写入文件，同时计算sha1并计入限速
+    """
+
+    def __init__(self, fp, governor=None, digest=True) -> None:
+        self.fp = fp
+        self.governor = governor or NULL_GOVERNOR
+        self.digest = hashlib.sha1() if digest else None
+        self.size = 0
+
+    def __call__(self, chunk):
+        self.fp.write(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        self.size += len(chunk)
+        self.governor.throttle(len(chunk))
+
+    def hexdigest(self):
+        return self.digest.hexdigest() if self.digest is not None else None
+
+
+def stream_to_file(fetch, filename, governor=None, size=None, digest=True):
+    """
+    以 size 大小的块把响应流写入 filename
+    :param fetch: fetch(action, chunk_size)，对每个数据块调用 action
+    :return: 文件sha1，digest=False 时为None
+    """
+    size = buffer_size(size)
+    governor = governor or NULL_GOVERNOR
+    with BUDGET.reserve(size), governor.connection(), \
+            open(filename, 'wb') as fp:
+        sink = StreamSink(fp, governor, digest)
+        fetch(sink, size)
+    return sink.hexdigest()
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import errno
+import fcntl
+import hashlib
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+
+try:
+    import ctypes
+    _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int,
+                           ctypes.c_longlong, ctypes.c_longlong]
+except (ImportError, OSError, AttributeError):
+    _fallocate = None
+
+from ansible.module_utils._text import to_bytes, to_native, to_text
+
+
+BUFSIZE = 1024 * 1024
+# 传输/解压过程中的临时文件，不计入目录清单
+TMP_PREFIX = '.ansible_tmp'
+# linux/falloc.h，只预留空间不改变文件大小，写入不完整时不会留下填充的0
+FALLOC_FL_KEEP_SIZE = 0x01
+# linux/fs.h，reflink：目标与源共享数据块
+FICLONE = 0x40049409
+# 单次 copy_file_range/sendfile 的最大长度
+COPY_CHUNK = 1024 * 1024 * 1024
+# 内核或文件系统不支持某种复制方式时的错误，改用下一种
+COPY_FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                        errno.EOPNOTSUPP, errno.ENOTTY, errno.EPERM,
+                        errno.EBADF)
+
+
+def safe_relpath(rel):
+    """
+    清单中的相对路径不能越出目标目录
+    """
+    rel = posixpath.normpath(rel)
+    if rel.startswith(('/', '../')) or rel in ('.', '..'):
+        raise ValueError("unsafe path in manifest: %s" % rel)
+    return rel
+
+
+def dir_manifest(module, dest, sizes=None, index=None):
+    """
+    目标主机上目录的清单
+    :param sizes: {相对路径: 大小}，只对大小一致的文件计算sha1，为None时全部计算
+    :param index: ChecksumIndex，提供时通过索引获取sha1
+    :return: {相对路径: {'size': 大小, 'checksum': sha1或None}}
+    """
+    manifest = {}
+    b_dest = to_bytes(dest, errors='surrogate_or_strict')
+    for b_root, dirs, files in os.walk(b_dest):
+        for b_name in files:
+            if b_name.startswith(to_bytes(TMP_PREFIX)):
+                continue
+            b_path = os.path.join(b_root, b_name)
+            if not os.path.isfile(b_path):
+                continue
+            rel = to_text(os.path.relpath(b_path, b_dest)).replace(os.sep, '/')
+            size = os.path.getsize(b_path)
+            checksum = None
+            if sizes is None or sizes.get(rel) == size:
+                path = to_native(b_path)
+                checksum = index.sha1(path) if index else module.sha1(path)
+            manifest[rel] = dict(size=size, checksum=checksum)
+    return manifest
+
+
+def make_bundle(files):
+    """
+    管控端把多个文件打包为一个tar，一次传输
+    :param files: [(本地路径, 相对路径)]
+    :return: tar临时文件路径，由调用方删除
+    """
+    fd, bundle = tempfile.mkstemp(suffix='.tar')
+    os.close(fd)
+    try:
+        with tarfile.open(bundle, 'w') as tar:
+            for path, rel in files:
+                tar.add(path, arcname=rel, recursive=False)
+    except BaseException:
+        os.remove(bundle)
+        raise
+    return bundle
+
+
+def batch_checksums(module, entries, index=None):
+    """
+    一次获取多个目标文件的sha1
+    :param entries: [{'dest': 目标路径}]
+    :return: [{'dest', 'exists', 'checksum'}]
+    """
+    results = []
+    for entry in entries:
+        dest = entry['dest']
+        b_dest = to_bytes(dest, errors='surrogate_or_strict')
+        if os.path.isfile(b_dest) and os.access(b_dest, os.R_OK):
+            checksum = index.sha1(dest) if index else module.sha1(dest)
+            results.append(dict(dest=dest, exists=True, checksum=checksum))
+        else:
+            results.append(dict(dest=dest, exists=False, checksum=None))
+    return results
+
+
+def preallocate(fd, size):
+    """
+    为即将写入的文件预留磁盘空间，减少碎片并提前发现空间不足
+    不使用 posix_fallocate：文件系统不支持时glibc会逐块写0，等于多写一遍
+    """
+    if _fallocate is None or not size:
+        return
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise OSError(err, os.strerror(err))
+
+
+def _copy_fd(fsrc, fdst, size):
+    """
+    依次尝试 reflink、copy_file_range、sendfile，数据不经过用户态
+    都不可用时按普通读写复制，从已复制的位置继续
+    :return: 最后使用的复制方式
+    """
+    try:
+        fcntl.ioctl(fdst, FICLONE, fsrc)
+        return 'reflink'
+    except (IOError, OSError):
+        pass
+
+    preallocate(fdst, size)
+    offset = 0
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while offset < size:
+                count = min(COPY_CHUNK, size - offset)
+                if method == 'copy_file_range':
+                    copied = os.copy_file_range(fsrc, fdst, count,
+                                                offset, offset)
+                else:
+                    os.lseek(fdst, offset, os.SEEK_SET)
+                    copied = os.sendfile(fdst, fsrc, offset, count)
+                if not copied:
+                    break
+                offset += copied
+            if offset == size:
+                return method
+        except OSError as err:
+            if err.errno not in COPY_FALLBACK_ERRORS:
+                raise
+
+    os.lseek(fsrc, offset, os.SEEK_SET)
+    os.lseek(fdst, offset, os.SEEK_SET)
+    with open(fsrc, 'rb', closefd=False) as src_fp:
+        with open(fdst, 'wb', closefd=False) as dst_fp:
+            shutil.copyfileobj(src_fp, dst_fp, BUFSIZE)
+    return 'copy'
+
+
+def same_filesystem(b_src, b_dest):
+    """
+    b_src 与 b_dest 所在目录是否在同一文件系统，是则 atomic_move 只需rename
+    """
+    try:
+        return (os.stat(b_src).st_dev
+                == os.stat(os.path.dirname(b_dest) or b'.').st_dev)
+    except OSError:
+        return False
+
+
+def install_file(module, b_src, b_dest):
+    """
+    把 b_src 移动为 b_dest
+    同一文件系统时直接 atomic_move（rename）；否则先在目标目录下复制出临时文件，
+    再rename，避免 atomic_move 回退为普通复制
+    :return: rename/reflink/copy_file_range/sendfile/copy
+    """
+    if same_filesystem(b_src, b_dest):
+        module.atomic_move(b_src, b_dest)
+        return 'rename'
+
+    fd, b_tmp = tempfile.mkstemp(dir=os.path.dirname(b_dest) or None,
+                                 prefix=to_bytes(TMP_PREFIX))
+    try:
+        with open(b_src, 'rb') as src_fp:
+            try:
+                method = _copy_fd(src_fp.fileno(), fd,
+                                  os.fstat(src_fp.fileno()).st_size)
+            finally:
+                os.close(fd)
+        module.atomic_move(b_tmp, b_dest)
+    except BaseException:
+        if os.path.exists(b_tmp):
+            os.remove(b_tmp)
+        raise
+    os.remove(b_src)
+    return method
+
+
+def _install(module, entry, b_tmp, checksum_src, owned, index, compare_dest):
+    """
+    校验单个文件并 atomic_move 到目标路径
+    :param owned: b_tmp 是否为本函数负责清理的临时文件
+    """
+    dest = entry['dest']
+    b_dest = to_bytes(dest, errors='surrogate_or_strict')
+    result = dict(dest=dest, checksum=checksum_src, changed=False)
+
+    def discard():
+        if owned and os.path.exists(b_tmp):
+            os.remove(b_tmp)
+
+    expected = entry.get('checksum')
+    if expected and checksum_src != expected:
+        discard()
+        result.update(failed=True, expected_checksum=expected,
+                      msg='%s does not match the expected checksum. Transfer failed.' % dest)
+        return result
+
+    if compare_dest and os.path.isfile(b_dest):
+        current = index.sha1(dest) if index else module.sha1(dest)
+        if current == checksum_src:
+            discard()
+            return result
+
+    if module.check_mode:
+        discard()
+        result['changed'] = True
+        return result
+
+    try:
+        b_dir = os.path.dirname(b_dest)
+        if b_dir and not os.path.isdir(b_dir):
+            os.makedirs(b_dir)
+        install_file(module, b_tmp, b_dest)
+    except (IOError, OSError) as err:
+        discard()
+        result.update(failed=True, msg="failed to copy: %s to %s: %s"
+                      % (entry.get('src'), dest, to_native(err)))
+        return result
+
+    if index:
+        index.record(dest, checksum_src)
+    result['changed'] = True
+    return result
+
+
+def install_batch(module, entries, bundle=None, index=None,
+                  compare_dest=True):
+    """
+    一次模块调用中校验并移动多个文件
+    :param entries: [{'src', 'dest', 'checksum'}]，提供 bundle 时 src 为tar中的成员名，
+        否则为目标主机上已传输的文件路径
+    :param compare_dest: 目标文件sha1一致时不移动
+    :return: 与 entries 顺序一致的每个文件的结果
+    """
+    results = {}
+
+    if bundle is not None:
+        pending = {}
+        for i, entry in enumerate(entries):
+            pending.setdefault(posixpath.normpath(entry['src']), []).append(i)
+
+        with tarfile.open(bundle, 'r:') as tar:
+            for member in tar:
+                name = posixpath.normpath(member.name)
+                if not member.isfile() or name not in pending:
+                    continue
+                for i in pending.pop(name):
+                    entry = entries[i]
+                    b_dir = os.path.dirname(
+                        to_bytes(entry['dest'], errors='surrogate_or_strict'))
+                    if b_dir and not os.path.isdir(b_dir):
+                        os.makedirs(b_dir)
+                    fd, b_tmp = tempfile.mkstemp(dir=b_dir or None,
+                                                 prefix=to_bytes(TMP_PREFIX))
+                    digest = hashlib.sha1()
+                    preallocate(fd, member.size)
+                    with os.fdopen(fd, 'wb') as fdst:
+                        fsrc = tar.extractfile(member)
+                        for data in iter(lambda: fsrc.read(BUFSIZE), b''):
+                            fdst.write(data)
+                            digest.update(data)
+                    results[i] = _install(module, entry, b_tmp,
+                                          digest.hexdigest(), True, index,
+                                          compare_dest)
+
+        for name, indexes in pending.items():
+            for i in indexes:
+                results[i] = dict(dest=entries[i]['dest'], changed=False,
+                                  failed=True,
+                                  msg="%s missing from bundle" % name)
+    else:
+        for i, entry in enumerate(entries):
+            b_src = to_bytes(entry['src'], errors='surrogate_or_strict')
+            if not os.path.isfile(b_src) or not os.access(b_src, os.R_OK):
+                results[i] = dict(dest=entry['dest'], changed=False,
+                                  failed=True,
+                                  msg="Source %s not found" % entry['src'])
+                continue
+            results[i] = _install(module, entry, b_src,
+                                  module.sha1(entry['src']), False, index,
+                                  compare_dest)
+
+    return [results[i] for i in range(len(entries))]
+
+
+def apply_bundle(module, bundle, dest, files, index=None):
+    """
+    目录同步时解包：逐个写入目标目录下的临时文件，校验sha1后 atomic_move
+    :param files: {相对路径: 期望的sha1}，bundle 中其它成员忽略
+    :return: 已更新的相对路径列表
+    """
+    try:
+        entries = [dict(src=safe_relpath(rel), checksum=checksum,
+                        dest=os.path.join(dest, safe_relpath(rel)))
+                   for rel, checksum in sorted(files.items())]
+    except ValueError as err:
+        module.fail_json(msg=to_native(err))
+    # 清单比对时已确认这些文件不同，无需再计算目标文件的sha1
+    results = install_batch(module, entries, bundle, index,
+                            compare_dest=False)
+    changed = [entry['src'] for entry, res in zip(entries, results)
+               if res['changed']]
+    failed = [res for res in results if res.get('failed')]
+    if failed:
+        module.fail_json(msg=failed[0]['msg'], results=results,
+                         changed_files=changed)
+    return changed
+
+
+def delete_files(module, dest, files):
+    """
+    删除目标目录中多余的文件，并清理删除后变空的子目录
+    :return: 已删除的相对路径列表
+    """
+    deleted = []
+    # 去掉末尾的 /，清理空目录时才能在目标目录处停下
+    b_dest = os.path.normpath(to_bytes(dest, errors='surrogate_or_strict'))
+    # 先校验全部路径，避免删除到一半才失败
+    try:
+        rels = [(rel, safe_relpath(rel)) for rel in files]
+    except ValueError as err:
+        module.fail_json(msg=to_native(err))
+    for rel, safe_rel in rels:
+        b_path = os.path.join(b_dest, to_bytes(safe_rel))
+        if not os.path.lexists(b_path):
+            continue
+        os.remove(b_path)
+        deleted.append(rel)
+
+        # 只清理目标目录以下的子目录，不越过目标目录
+        b_dir = os.path.dirname(b_path)
+        while b_dir.startswith(b_dest + b'/') and not os.listdir(b_dir):
+            os.rmdir(b_dir)
+            b_dir = os.path.dirname(b_dir)
+    return deleted
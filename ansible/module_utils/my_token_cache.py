@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.urls import open_url
+
+
+DEFAULT_STATE_DIR = '~/.ansible/my_api_tokens'
+# 接口没有返回有效期时token的缓存时间（秒）
+DEFAULT_TTL = 300
+# 距离过期不足该时间（秒）时提前刷新，避免任务执行中途失效
+DEFAULT_REFRESH_MARGIN = 30
+
+
+def fetch_token(base_url, username, password, validate_certs=False):
+    """
+    请求 /API/get-token
+    :return: (token, 有效期秒数)，接口没有返回 expires_in 时有效期为None
+    """
+    url = "{baseUrl}/API/get-token".format(baseUrl=base_url)
+    response = open_url(url, method="GET", url_username=username,
+                        url_password=password, validate_certs=validate_certs)
+    data = json.loads(response.read())
+    return data['token'], data.get('expires_in')
+
+
+class TokenCache(object):
+    """
+    管控端缓存API token，所有fork共用
+
+    按 (base_url, username) 保存在权限为0600的文件中，由文件锁保护，
+    同一时间只有一个fork请求新token，其余fork等待后直接使用。
+    """
+
+    def __init__(self, state_dir=None, ttl=DEFAULT_TTL,
+                 margin=DEFAULT_REFRESH_MARGIN) -> None:
+        self.state_dir = os.path.abspath(
+            os.path.expanduser(state_dir or DEFAULT_STATE_DIR))
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+        self.ttl = int(ttl)
+        self.margin = int(margin)
+
+    def _path(self, base_url, username):
+        key = hashlib.sha256(to_bytes('%s\n%s' % (base_url, username)))
+        return os.path.join(self.state_dir, key.hexdigest()[:32] + '.json')
+
+    def get(self, base_url, username, fetch):
+        """
+        返回未过期的token，否则调用 fetch() 获取并缓存
+        :param fetch: 返回 (token, 有效期秒数或None)
+        """
+        path = self._path(base_url, username)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as fp:
+                    cached = json.load(fp)
+                if cached['expires'] - self.margin > time.time():
+                    return cached['token']
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+
+            token, ttl = fetch()
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(dict(token=token,
+                               expires=time.time() + int(ttl or self.ttl)), fp)
+            os.replace(tmp_path, path)
+            return token
+
+    def invalidate(self, base_url, username):
+        try:
+            os.remove(self._path(base_url, username))
+        except OSError:
+            pass
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import sys
+
+import pytest
+
+# 与 action_plugins 相同，直接从 role 的 module_utils 目录导入
+MODULE_UTILS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))), 'module_utils')
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.insert(0, MODULE_UTILS_DIR)
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule(object):
+    """
+    模块函数用到的 AnsibleModule 接口
+    """
+
+    check_mode = False
+
+    def atomic_move(self, src, dest):
+        os.replace(src, dest)
+
+    def sha1(self, path):
+        with open(path, 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+
+    def fail_json(self, **kwargs):
+        raise ModuleFailed(kwargs)
+
+
+@pytest.fixture
+def module():
+    return FakeModule()
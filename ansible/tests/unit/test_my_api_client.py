@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from my_api_client import ApiClient, UnauthorizedError, apply_user, apply_users
+from my_token_cache import TokenCache
+
+
+class Response(object):
+
+    def __init__(self, status_code, data=None) -> None:
+        self.status_code = status_code
+        self.data = data
+        self.content = b'x' if data is not None else b''
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('HTTP %d' % self.status_code)
+
+    def json(self):
+        return self.data
+
+
+class Session(object):
+    """
+    用户接口：只接受 valid 中的token
+    """
+
+    def __init__(self, valid='fresh') -> None:
+        self.valid = valid
+        self.users = {'old': dict(name='old', email='o@x')}
+        self.requests = []
+
+    def request(self, method, url, json=None, headers=None, **kwargs):
+        self.requests.append((method, url.rsplit('/API/', 1)[1]))
+        if headers['Authorization'] != 'Bearer %s' % self.valid:
+            return Response(401)
+        if method == 'GET':
+            return Response(200, list(self.users.values()))
+        if method == 'POST':
+            self.users[json['name']] = json
+            return Response(201, json)
+        self.users.pop(url.rsplit('/', 1)[1], None)
+        return Response(204)
+
+
+USERS = [dict(name='new', email='n@x', admin=False, state='present'),
+         dict(name='old', email=None, admin=False, state='absent')]
+
+
+def test_401_refreshes_the_token_once(tmp_path):
+    cache = TokenCache(str(tmp_path))
+    cache.get('http://api', 'admin', lambda: ('stale', None))
+    fetched = []
+
+    def refresh():
+        cache.invalidate('http://api', 'admin')
+        return cache.get('http://api', 'admin',
+                         lambda: (fetched.append(1) or 'fresh', None))
+
+    session = Session()
+    client = ApiClient('http://api', 'stale', session=session,
+                       refresh=refresh)
+    result = apply_users(client, USERS)
+
+    assert not result.get('failed')
+    assert sorted(session.users) == ['new']
+    assert fetched == [1]
+    # 新token已写入缓存，其它fork直接使用
+    assert cache.get('http://api', 'admin', lambda: ('unused', None)) == 'fresh'
+
+
+def test_401_without_refresh_is_reported():
+    client = ApiClient('http://api', 'stale', session=Session())
+
+    result = apply_users(client, USERS)
+
+    assert result['failed'] and result['unauthorized']
+
+
+def test_second_401_is_not_retried_again():
+    session = Session(valid='never')
+    client = ApiClient('http://api', 'stale', session=session,
+                       refresh=lambda: 'also-stale')
+
+    with pytest.raises(UnauthorizedError):
+        client.list_users()
+    assert session.requests == [('GET', 'users'), ('GET', 'users')]
+
+
+def test_single_user():
+    session = Session()
+    client = ApiClient('http://api', 'fresh', session=session)
+    params = dict(name='new', email='n@x', admin=True, state='present')
+
+    assert apply_user(client, params)['changed']
+    assert session.users['new']['admin'] is True
+    assert not apply_user(client, params)['changed']
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+from my_artifact_cache import ArtifactCache
+
+
+def write(path, data):
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def test_fetch_downloads_once_for_concurrent_callers(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    key = ArtifactCache.make_key('minio', 'bucket', 'object', 'etag')
+    calls = []
+
+    def fetcher(path):
+        calls.append(path)
+        time.sleep(0.2)
+        write(path, b'payload')
+        return 'c' * 40
+
+    results = []
+
+    def worker():
+        results.append(cache.fetch(key, fetcher))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert {path for path, hit in results} == {cache.path(key)}
+    assert sorted(hit for path, hit in results) == [False, True, True, True]
+    assert cache.get_checksum(key) == 'c' * 40
+    assert not os.path.exists(cache.marker_path(key))
+
+
+def test_fetch_failure_leaves_no_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    key = ArtifactCache.make_key('failing')
+
+    def fetcher(path):
+        raise IOError('boom')
+
+    try:
+        cache.fetch(key, fetcher)
+    except IOError:
+        pass
+    assert cache.get(key) is None
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size='1K')
+    keys = [ArtifactCache.make_key(name) for name in ('a', 'b', 'c')]
+    for i, key in enumerate(keys):
+        src = str(tmp_path / ('src%d' % i))
+        write(src, b'x' * 6)
+        cache.put(key, src)
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+
+    cache.max_size = 12
+    cache.evict()
+
+    assert not os.path.exists(cache.path(keys[0]))
+    assert os.path.exists(cache.path(keys[1]))
+    assert os.path.exists(cache.path(keys[2]))
+
+
+def test_evict_skips_entries_in_use(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size='1K')
+    keys = [ArtifactCache.make_key(name) for name in ('old', 'mid', 'new')]
+    for i, key in enumerate(keys):
+        src = str(tmp_path / ('src%d' % i))
+        write(src, b'x' * 6)
+        cache.put(key, src)
+    # 最旧的对象正在被本进程使用
+    cache.get(keys[0])
+    for i, key in enumerate(keys):
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+
+    cache.max_size = 12
+    cache.evict()
+
+    assert os.path.exists(cache.path(keys[0]))
+    assert not os.path.exists(cache.path(keys[1]))
+    assert os.path.exists(cache.path(keys[2]))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+import time
+
+import my_background_job
+from my_artifact_cache import ArtifactCache
+from my_background_job import job_status, start_job
+
+
+PLUGIN = '''
+def background_fetch(params, cache):
+    if params.get('fail'):
+        raise IOError('download failed')
+    return dict(fetched=params['src'])
+'''
+
+
+def wait_finished(cache, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        status = job_status(cache, job_id)
+        if status.get('finished') or time.time() > deadline:
+            return status
+        time.sleep(0.1)
+
+
+def plugin_path(tmp_path):
+    path = tmp_path / 'plugin.py'
+    path.write_text(PLUGIN)
+    return str(path)
+
+
+def job_dir(cache):
+    return os.path.join(cache.cache_dir, 'jobs')
+
+
+def test_job_runs_and_removes_credentials(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    start_job(cache, plugin_path(tmp_path),
+              dict(src='object', secret_key='secret'), 'job1')
+    status = wait_finished(cache, 'job1')
+
+    assert status['finished'] and not status['failed']
+    assert status['result'] == dict(fetched='object')
+    assert not os.path.exists(os.path.join(job_dir(cache), 'job1.args'))
+    mode = os.stat(os.path.join(job_dir(cache), 'job1.json')).st_mode
+    assert mode & 0o077 == 0
+
+
+def test_failed_job_removes_credentials(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    start_job(cache, plugin_path(tmp_path),
+              dict(src='object', secret_key='secret', fail=True), 'job2')
+    status = wait_finished(cache, 'job2')
+
+    assert status['finished'] and status['failed']
+    assert 'download failed' in status['msg']
+    assert not os.path.exists(os.path.join(job_dir(cache), 'job2.args'))
+    with open(os.path.join(job_dir(cache), 'job2.json')) as fp:
+        assert 'secret' not in fp.read()
+
+
+def write_status(cache, job_id, **status):
+    os.makedirs(job_dir(cache), exist_ok=True)
+    status.setdefault('job_id', job_id)
+    with open(os.path.join(job_dir(cache), job_id + '.json'), 'w') as fp:
+        json.dump(status, fp)
+
+
+def test_status_of_dead_process_is_failed(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    write_status(cache, 'dead', started=time.time(), finished=False,
+                 pid=proc.pid)
+
+    status = job_status(cache, 'dead')
+
+    assert status['finished'] and status['failed']
+    assert 'exited unexpectedly' in status['msg']
+
+
+def test_status_of_live_process_is_running(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    write_status(cache, 'live', started=time.time(), finished=False,
+                 pid=os.getpid())
+
+    status = job_status(cache, 'live')
+
+    assert not status['finished']
+
+
+def test_status_before_pid_is_written(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    write_status(cache, 'new', started=time.time(), finished=False, pid=None)
+    write_status(cache, 'stale', finished=False, pid=None,
+                 started=time.time() - my_background_job.STARTUP_SECONDS - 1)
+
+    assert not job_status(cache, 'new')['finished']
+    assert job_status(cache, 'stale')['failed']
+
+
+def test_unknown_job(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    status = job_status(cache, 'missing')
+
+    assert status['finished'] and status['failed']
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import pytest
+
+from my_checksum_index import ChecksumIndex
+
+
+class Hasher(object):
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def __call__(self, path, algorithm='sha1'):
+        self.calls.append((path, algorithm))
+        with open(path, 'rb') as fp:
+            return hashlib.new(algorithm, fp.read()).hexdigest()
+
+
+class Module(object):
+
+    def __init__(self) -> None:
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+
+@pytest.fixture
+def hasher():
+    return Hasher()
+
+
+@pytest.fixture
+def index(tmp_path, hasher):
+    return ChecksumIndex(Module(), str(tmp_path / 'index.db'), hasher=hasher)
+
+
+def write(path, data):
+    with open(str(path), 'wb') as fp:
+        fp.write(data)
+    return str(path)
+
+
+def test_unchanged_file_is_not_rehashed(tmp_path, index, hasher):
+    path = write(tmp_path / 'f', b'data')
+
+    assert index.sha1(path) == hashlib.sha1(b'data').hexdigest()
+    assert index.sha1(path) == hashlib.sha1(b'data').hexdigest()
+    assert len(hasher.calls) == 1
+
+
+def test_stat_change_invalidates_entry(tmp_path, index, hasher):
+    path = write(tmp_path / 'f', b'data')
+    index.sha1(path)
+
+    # 大小相同、只改变 mtime 也要重新计算
+    write(path, b'DATA')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert index.sha1(path) == hashlib.sha1(b'DATA').hexdigest()
+
+    # 替换为新文件（inode 变化）
+    replacement = write(tmp_path / 'g', b'other')
+    os.replace(replacement, path)
+    assert index.sha1(path) == hashlib.sha1(b'other').hexdigest()
+    assert len(hasher.calls) == 3
+
+
+def test_record_skips_next_hash(tmp_path, index, hasher):
+    path = write(tmp_path / 'f', b'data')
+
+    index.record(path, 'recorded')
+
+    assert index.sha1(path) == 'recorded'
+    assert hasher.calls == []
+
+
+def test_algorithms_are_cached_separately(tmp_path, index, hasher):
+    path = write(tmp_path / 'f', b'data')
+
+    assert index.digest(path, 'sha256') == hashlib.sha256(b'data').hexdigest()
+    assert index.sha1(path) == hashlib.sha1(b'data').hexdigest()
+    index.digest(path, 'sha256')
+    index.sha1(path)
+
+    assert hasher.calls == [(os.path.abspath(path), 'sha256'),
+                            (os.path.abspath(path), 'sha1')]
+
+
+def test_index_is_shared_between_instances(tmp_path, hasher):
+    path = write(tmp_path / 'f', b'data')
+    db = str(tmp_path / 'index.db')
+
+    ChecksumIndex(Module(), db, hasher=hasher).sha1(path)
+    ChecksumIndex(Module(), db, hasher=hasher).sha1(path)
+
+    assert len(hasher.calls) == 1
+
+
+def test_unusable_index_falls_back_to_hashing(tmp_path, hasher):
+    path = write(tmp_path / 'f', b'data')
+    blocker = write(tmp_path / 'file', b'')
+    module = Module()
+
+    index = ChecksumIndex(module, os.path.join(blocker, 'index.db'),
+                          hasher=hasher)
+
+    assert index.sha1(path) == hashlib.sha1(b'data').hexdigest()
+    assert index.sha1(path) == hashlib.sha1(b'data').hexdigest()
+    assert len(hasher.calls) == 2
+    assert module.warnings
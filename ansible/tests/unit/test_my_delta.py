@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from my_delta import apply_delta, block_signatures, make_delta, prepare_delta
+
+
+BLOCK = 4
+
+
+def write(path, data):
+    with open(path, 'wb') as fp:
+        fp.write(data)
+    return str(path)
+
+
+def read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize('base, src', [
+    (b'aaaabbbbcccc', b'bbbbXXXXaaaacc'),
+    (b'aaaabbbbcccc', b'aaaabbbbccccdddd'),
+    (b'aaaabbbbcccc', b''),
+    (b'', b'new file'),
+    (b'aaaabbbbcc', b'ccccaaaabbbbcc'),
+])
+def test_round_trip(tmp_path, base, src):
+    base_path = write(tmp_path / 'base', base)
+    src_path = write(tmp_path / 'src', src)
+    delta_path = str(tmp_path / 'delta')
+    out_path = str(tmp_path / 'out')
+
+    signatures, checksum = block_signatures(base_path, BLOCK)
+    make_delta(src_path, signatures, BLOCK, delta_path)
+    apply_delta(base_path, delta_path, out_path)
+
+    assert read(out_path) == src
+
+
+def test_delta_reuses_blocks(tmp_path):
+    base_path = write(tmp_path / 'base', b'aaaabbbbcccc')
+    src_path = write(tmp_path / 'src', b'aaaabbbbXXXX')
+    signatures, checksum = block_signatures(base_path, BLOCK)
+
+    delta_size, matched, total = make_delta(src_path, signatures, BLOCK,
+                                            str(tmp_path / 'delta'))
+
+    assert (matched, total) == (2, 3)
+
+
+def test_prepare_delta_skips_unrelated_files(tmp_path):
+    base_path = write(tmp_path / 'base', b'aaaabbbbcccc')
+    src_path = write(tmp_path / 'src', b'XXXXYYYYZZZZ')
+    signatures, checksum = block_signatures(base_path, BLOCK)
+
+    assert prepare_delta(src_path, signatures, BLOCK) is None
+
+
+def test_prepare_delta_sends_full_file_after_insert(tmp_path):
+    # 只按对齐的块比对：开头插入的字节使后面所有块错位，退回传输整个文件
+    base = b''.join(bytes([i]) * BLOCK for i in range(32))
+    base_path = write(tmp_path / 'base', base)
+    src_path = write(tmp_path / 'src', b'X' + base)
+    signatures, checksum = block_signatures(base_path, BLOCK)
+
+    delta_size, matched, total = make_delta(src_path, signatures, BLOCK,
+                                            str(tmp_path / 'delta'))
+    assert matched == 0
+    assert prepare_delta(src_path, signatures, BLOCK) is None
+
+
+def test_apply_rejects_other_files(tmp_path):
+    base_path = write(tmp_path / 'base', b'aaaa')
+    bogus = write(tmp_path / 'bogus', b'not a delta')
+
+    with pytest.raises(ValueError):
+        apply_delta(base_path, bogus, str(tmp_path / 'out'))
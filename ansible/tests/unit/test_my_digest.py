@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+from my_artifact_cache import ArtifactCache
+from my_checksum_index import ChecksumIndex
+from my_digest import (available, file_digest, source_digest,
+                       UnsupportedDigest, verify_source)
+
+
+DATA = b'0123456789' * 1000
+
+
+def write(path, data):
+    with open(str(path), 'wb') as fp:
+        fp.write(data)
+    return str(path)
+
+
+class Module(object):
+
+    def warn(self, msg):
+        raise AssertionError(msg)
+
+
+@pytest.mark.parametrize('algorithm', ['sha1', 'sha256', 'blake2b'])
+@pytest.mark.parametrize('data', [b'', b'x', DATA])
+def test_file_digest_matches_hashlib(tmp_path, algorithm, data):
+    path = write(tmp_path / 'f', data)
+
+    assert file_digest(path, algorithm) == hashlib.new(
+        algorithm, data).hexdigest()
+
+
+def test_unknown_algorithm(tmp_path):
+    path = write(tmp_path / 'f', DATA)
+
+    assert not available('md4')
+    with pytest.raises(UnsupportedDigest):
+        file_digest(path, 'md4')
+
+
+def test_verify_sha1(tmp_path):
+    src = write(tmp_path / 'src', DATA)
+    dest = write(tmp_path / 'dest', DATA)
+    sha1 = hashlib.sha1(DATA).hexdigest()
+
+    assert verify_source(src, dest, sha1) == (sha1, sha1, True)
+    assert verify_source(src, dest, 'bad')[2] is False
+    assert verify_source(src, str(tmp_path / 'missing'), sha1) == (
+        sha1, None, True)
+
+
+def test_verify_other_algorithm(tmp_path):
+    src = write(tmp_path / 'src', DATA)
+    dest = write(tmp_path / 'dest', b'old')
+    sha1 = hashlib.sha1(DATA).hexdigest()
+    blake2b = hashlib.blake2b(DATA).hexdigest()
+
+    # 源文件与管控端一致时返回其sha1，目标文件不同则为None
+    assert verify_source(src, dest, sha1, digest=blake2b,
+                         algorithm='blake2b') == (sha1, None, True)
+    write(dest, DATA)
+    assert verify_source(src, dest, sha1, digest=blake2b,
+                         algorithm='blake2b') == (sha1, sha1, True)
+    assert verify_source(src, dest, sha1, digest='bad',
+                         algorithm='blake2b')[2] is False
+
+
+def test_verify_uses_index_per_algorithm(tmp_path):
+    src = write(tmp_path / 'src', DATA)
+    dest = write(tmp_path / 'dest', DATA)
+    sha1 = hashlib.sha1(DATA).hexdigest()
+    blake2b = hashlib.blake2b(DATA).hexdigest()
+    calls = []
+
+    def hasher(path, algorithm):
+        calls.append(algorithm)
+        return file_digest(path, algorithm)
+
+    # 目标文件的摘要在另一个线程中从索引读取
+    index = ChecksumIndex(Module(), str(tmp_path / 'index.db'), hasher=hasher)
+    for _ in range(2):
+        assert verify_source(src, dest, sha1, index, digest=blake2b,
+                             algorithm='blake2b') == (sha1, sha1, True)
+    assert calls == ['blake2b']
+
+
+def test_source_digest_is_memoized(tmp_path, monkeypatch):
+    import my_digest
+    path = write(tmp_path / 'src', DATA)
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    calls = []
+    real = my_digest.file_digest
+
+    def counting(path, algorithm='sha1'):
+        calls.append(algorithm)
+        return real(path, algorithm)
+
+    monkeypatch.setattr(my_digest, 'file_digest', counting)
+    first = source_digest(path, 'sha256', cache)
+    second = source_digest(path, 'sha256', cache)
+
+    assert first == second == hashlib.sha256(DATA).hexdigest()
+    assert calls == ['sha256']
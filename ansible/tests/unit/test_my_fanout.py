@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from my_fanout import Board, private_dir, tree_parent
+
+
+HOSTS = ['h%d' % i for i in range(20)]
+
+
+def test_first_hosts_get_the_file_from_the_controller():
+    assert [tree_parent(HOSTS, host, 4) for host in HOSTS[:4]] == [None] * 4
+    assert tree_parent(HOSTS, 'unknown', 4) is None
+
+
+@pytest.mark.parametrize('fanout', [1, 2, 3, 4])
+def test_parents_come_first_and_serve_at_most_fanout(fanout):
+    children = {}
+    for i, host in enumerate(HOSTS):
+        parent = tree_parent(HOSTS, host, fanout)
+        if parent is None:
+            assert i < fanout
+            continue
+        assert HOSTS.index(parent) < i
+        children.setdefault(parent, []).append(host)
+
+    assert all(len(hosts) <= fanout for hosts in children.values())
+    assert sum(len(hosts) for hosts in children.values()) == (
+        len(HOSTS) - fanout)
+
+
+def test_parent_numbering():
+    assert [tree_parent(HOSTS[:8], host, 2) for host in HOSTS[:8]] == [
+        None, None, 'h0', 'h0', 'h1', 'h1', 'h2', 'h2']
+    # fanout 小于1时按1处理，主机依次串联
+    assert [tree_parent(HOSTS[:3], host, 0) for host in HOSTS[:3]] == [
+        None, 'h0', 'h1']
+
+
+def test_board_publish_and_wait(tmp_path):
+    board = Board('task', str(tmp_path))
+    board.publish('h0', 'a' * 40, 'http://h0:8765/token/' + 'a' * 40)
+    board.publish('h1', None)
+
+    assert board.wait('h0', 1)['url'].startswith('http://h0')
+    assert board.wait('h1', 1)['url'] is None
+    # 另一个fork读取同一任务的记录
+    assert Board('task', str(tmp_path)).wait('h0', 1)['checksum'] == 'a' * 40
+
+
+def test_board_wait_times_out(tmp_path):
+    board = Board('task', str(tmp_path))
+
+    start = time.time()
+    assert board.wait('h9', 0.3) is None
+    assert time.time() - start < 5
+
+
+def test_private_dir(tmp_path):
+    path = str(tmp_path / 'seed')
+
+    private_dir(path)
+    assert os.stat(path).st_mode & 0o777 == 0o700
+
+    os.chmod(path, 0o755)
+    with pytest.raises(OSError):
+        private_dir(path)
+
+    link = str(tmp_path / 'link')
+    os.symlink(str(tmp_path), link)
+    with pytest.raises(OSError):
+        private_dir(link)
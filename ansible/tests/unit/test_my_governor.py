@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import threading
+
+import pytest
+
+import my_governor
+from my_governor import Governor, THROTTLE_QUANTUM
+
+
+class Clock(object):
+    """
+    替换 my_governor 中的 time.time/time.sleep，sleep 只记录并推进时间
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(my_governor.time, 'time', clock.time)
+    monkeypatch.setattr(my_governor.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_throttle_waits_when_bucket_is_empty(tmp_path, clock):
+    governor = Governor('minio', rate='1M', state_dir=str(tmp_path))
+    rate = governor.rate
+
+    governor.throttle(rate)
+    assert clock.sleeps == []
+
+    governor.throttle(rate // 2)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_throttle_refills_over_time(tmp_path, clock):
+    governor = Governor('minio', rate='1M', state_dir=str(tmp_path))
+    rate = governor.rate
+    governor.throttle(rate)
+
+    # 令牌按速率补充，最多补满一秒的流量
+    clock.now += 10
+    governor.throttle(rate)
+    assert clock.sleeps == []
+
+    clock.now += 0.5
+    governor.throttle(rate)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_throttle_is_shared_between_instances(tmp_path, clock):
+    first = Governor('minio', rate='1M', state_dir=str(tmp_path))
+    second = Governor('minio', rate='1M', state_dir=str(tmp_path))
+    other = Governor('gitlab', rate='1M', state_dir=str(tmp_path))
+
+    first.throttle(first.rate)
+    other.throttle(other.rate)
+    assert clock.sleeps == []
+    second.throttle(second.rate)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_throttle_batches_small_reads(tmp_path, clock):
+    governor = Governor('minio', rate='1M', state_dir=str(tmp_path))
+
+    governor.throttle(THROTTLE_QUANTUM - 1)
+    assert not any(path.suffix == '.bucket' for path in tmp_path.iterdir())
+
+
+def slot_is_free(governor, i):
+    with open('%s.%d' % (governor.slot_prefix, i), 'a') as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        fcntl.flock(fp, fcntl.LOCK_UN)
+        return True
+
+
+def test_connection_slot_is_released(tmp_path):
+    governor = Governor('minio', connections=1, state_dir=str(tmp_path))
+
+    with governor.connection():
+        assert not slot_is_free(governor, 0)
+    assert slot_is_free(governor, 0)
+
+    with pytest.raises(IOError):
+        with governor.connection():
+            raise IOError('read failed')
+    assert slot_is_free(governor, 0)
+
+
+def test_connection_waits_for_a_free_slot(tmp_path):
+    governor = Governor('minio', connections=1, state_dir=str(tmp_path))
+    entered = threading.Event()
+
+    def worker():
+        with governor.connection():
+            entered.set()
+
+    with governor.connection():
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not entered.wait(0.3)
+    assert entered.wait(5)
+    thread.join()
+
+
+def test_from_task_without_limits():
+    assert Governor.from_task('minio', {}, {}) is None
+    assert Governor.from_task('minio', {}, dict(
+        artifact_source_limits={'gitlab': {'rate': '1M'}})) is None
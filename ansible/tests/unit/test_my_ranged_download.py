@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import pytest
+
+from my_ranged_download import RangedDownloader
+
+
+DATA = bytes(bytearray(range(256))) * 4 + b'tail'
+
+
+class FakeStat(object):
+
+    def __init__(self, data) -> None:
+        self.size = len(data)
+        self.etag = hashlib.md5(data).hexdigest()
+
+
+class FakeResponse(object):
+
+    def __init__(self, data) -> None:
+        self.data = data
+
+    def stream(self, amt):
+        for start in range(0, len(self.data), amt):
+            yield self.data[start:start + amt]
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeClient(object):
+    """
+    minio 客户端：记录分段请求，可在指定偏移处失败
+    """
+
+    def __init__(self, data, fail_at=None) -> None:
+        self.data = data
+        self.fail_at = fail_at
+        self.offsets = []
+
+    def stat_object(self, bucket, object_name, version_id=None):
+        return FakeStat(self.data)
+
+    def get_object(self, bucket, object_name, offset=0, length=None,
+                   request_headers=None, version_id=None):
+        assert request_headers['If-Match'] == FakeStat(self.data).etag
+        if offset == self.fail_at:
+            raise ConnectionError('connection reset')
+        self.offsets.append(offset)
+        end = len(self.data) if length is None else offset + length
+        return FakeResponse(self.data[offset:end])
+
+
+def test_download_creates_missing_directories(tmp_path):
+    path = str(tmp_path / 'a' / 'b' / 'object')
+    downloader = RangedDownloader(FakeClient(DATA), chunk_size='256',
+                                  parts=2, retries=0)
+
+    stat, checksum = downloader.download('bucket', 'object', path)
+
+    assert stat.size == len(DATA)
+    assert checksum == hashlib.sha1(DATA).hexdigest()
+    with open(path, 'rb') as fp:
+        assert fp.read() == DATA
+    assert not os.path.exists(path + '.part')
+    assert not os.path.exists(path + '.part.json')
+
+
+def test_download_small_object_streams(tmp_path):
+    path = str(tmp_path / 'dir' / 'small')
+    downloader = RangedDownloader(FakeClient(b'small'), retries=0)
+
+    stat, checksum = downloader.download('bucket', 'small', path)
+
+    assert checksum == hashlib.sha1(b'small').hexdigest()
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'small'
+
+
+def test_download_resumes_missing_chunks(tmp_path):
+    path = str(tmp_path / 'object')
+    failing = FakeClient(DATA, fail_at=512)
+    with pytest.raises(ConnectionError):
+        RangedDownloader(failing, chunk_size='256', parts=1,
+                         retries=0).download('bucket', 'object', path)
+    assert 512 not in failing.offsets
+    assert os.path.exists(path + '.part.json')
+
+    client = FakeClient(DATA)
+    stat, checksum = RangedDownloader(client, chunk_size='256', parts=1,
+                                      retries=0).download('bucket', 'object',
+                                                          path)
+
+    # 只补齐上次没有完成的分段
+    assert sorted(client.offsets) == sorted(
+        {0, 256, 512, 768, 1024} - set(failing.offsets))
+    assert checksum == hashlib.sha1(DATA).hexdigest()
+    with open(path, 'rb') as fp:
+        assert fp.read() == DATA
+    assert not os.path.exists(path + '.part.json')
+
+
+def test_download_restarts_when_object_changes(tmp_path):
+    path = str(tmp_path / 'object')
+    with pytest.raises(ConnectionError):
+        RangedDownloader(FakeClient(DATA, fail_at=512), chunk_size='256',
+                         parts=1, retries=0).download('bucket', 'object', path)
+
+    changed = DATA[::-1]
+    client = FakeClient(changed)
+    stat, checksum = RangedDownloader(client, chunk_size='256', parts=1,
+                                      retries=0).download('bucket', 'object',
+                                                          path)
+
+    assert client.offsets == [0, 256, 512, 768, 1024]
+    assert checksum == hashlib.sha1(changed).hexdigest()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import pytest
+
+from conftest import ModuleFailed
+from my_sync import apply_bundle, delete_files, make_bundle, safe_relpath
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def make_tree(root, files):
+    for rel, data in files.items():
+        path = os.path.join(str(root), rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    files = {'a.txt': b'alpha', 'sub/b.txt': b'beta', 'extra.txt': b'skip'}
+    make_tree(tmp_path / 'src', files)
+    path = make_bundle([(str(tmp_path / 'src' / rel), rel) for rel in files])
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def test_apply_bundle_installs_listed_files(tmp_path, module, bundle):
+    dest = str(tmp_path / 'dest')
+    os.makedirs(dest)
+
+    changed = apply_bundle(module, bundle, dest, {
+        'a.txt': sha1(b'alpha'), 'sub/b.txt': sha1(b'beta')})
+
+    assert changed == ['a.txt', 'sub/b.txt']
+    assert read(os.path.join(dest, 'a.txt')) == b'alpha'
+    assert read(os.path.join(dest, 'sub', 'b.txt')) == b'beta'
+    assert sorted(os.listdir(dest)) == ['a.txt', 'sub']
+
+
+def test_apply_bundle_rejects_checksum_mismatch(tmp_path, module, bundle):
+    dest = str(tmp_path / 'dest')
+    make_tree(dest, {'a.txt': b'old'})
+
+    with pytest.raises(ModuleFailed) as err:
+        apply_bundle(module, bundle, dest, {'a.txt': sha1(b'other')})
+
+    assert 'does not match' in err.value.args[0]['msg']
+    assert read(os.path.join(dest, 'a.txt')) == b'old'
+    assert os.listdir(dest) == ['a.txt']
+
+
+@pytest.mark.parametrize('rel', ['../evil', '/etc/passwd', 'a/../../evil',
+                                 '.'])
+def test_apply_bundle_rejects_unsafe_paths(tmp_path, module, bundle, rel):
+    dest = str(tmp_path / 'dest')
+    os.makedirs(dest)
+
+    with pytest.raises(ModuleFailed) as err:
+        apply_bundle(module, bundle, dest, {rel: sha1(b'alpha')})
+
+    assert 'unsafe path' in err.value.args[0]['msg']
+    assert os.listdir(dest) == []
+    assert not os.path.exists(str(tmp_path / 'evil'))
+
+
+def test_delete_files_prunes_empty_directories(tmp_path, module):
+    dest = str(tmp_path / 'dest')
+    make_tree(dest, {'keep.txt': b'k', 'sub/deep/old.txt': b'o',
+                     'sub/other.txt': b'x'})
+
+    deleted = delete_files(module, dest, ['sub/deep/old.txt', 'missing.txt'])
+
+    assert deleted == ['sub/deep/old.txt']
+    assert not os.path.exists(os.path.join(dest, 'sub', 'deep'))
+    assert os.path.exists(os.path.join(dest, 'sub', 'other.txt'))
+    assert os.path.exists(os.path.join(dest, 'keep.txt'))
+
+
+def test_delete_files_keeps_dest_with_trailing_slash(tmp_path, module):
+    dest = str(tmp_path / 'a' / 'b' / 'dest')
+    make_tree(dest, {'f': b'f'})
+
+    deleted = delete_files(module, dest + '/', ['f'])
+
+    assert deleted == ['f']
+    assert os.listdir(dest) == []
+    assert os.path.isdir(str(tmp_path / 'a' / 'b'))
+
+
+def test_delete_files_checks_every_path_first(tmp_path, module):
+    dest = str(tmp_path / 'dest')
+    make_tree(dest, {'a.txt': b'a'})
+    make_tree(tmp_path, {'outside.txt': b'o'})
+
+    with pytest.raises(ModuleFailed):
+        delete_files(module, dest, ['a.txt', '../outside.txt'])
+
+    assert os.path.exists(os.path.join(dest, 'a.txt'))
+    assert os.path.exists(str(tmp_path / 'outside.txt'))
+
+
+def test_safe_relpath_normalizes():
+    assert safe_relpath('a/./b/../c') == 'a/c'
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+
+import pytest
+
+import my_token_cache
+from my_token_cache import TokenCache
+
+
+BASE_URL = 'https://api.example.com'
+
+
+class Fetcher(object):
+
+    def __init__(self, ttl=None) -> None:
+        self.ttl = ttl
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return 'token%d' % self.calls, self.ttl
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(my_token_cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_token_is_reused_until_margin(tmp_path, clock):
+    cache = TokenCache(str(tmp_path), ttl=300, margin=30)
+    fetch = Fetcher()
+
+    assert cache.get(BASE_URL, 'admin', fetch) == 'token1'
+    clock[0] += 269
+    assert cache.get(BASE_URL, 'admin', fetch) == 'token1'
+    # 距离过期不足 margin 时提前刷新
+    clock[0] += 2
+    assert cache.get(BASE_URL, 'admin', fetch) == 'token2'
+    assert fetch.calls == 2
+
+
+def test_expires_in_overrides_ttl(tmp_path, clock):
+    cache = TokenCache(str(tmp_path), ttl=300, margin=30)
+    fetch = Fetcher(ttl=100)
+
+    cache.get(BASE_URL, 'admin', fetch)
+    clock[0] += 71
+    assert cache.get(BASE_URL, 'admin', fetch) == 'token2'
+
+
+def test_tokens_are_kept_per_user(tmp_path, clock):
+    cache = TokenCache(str(tmp_path))
+    admin, other = Fetcher(), Fetcher()
+
+    cache.get(BASE_URL, 'admin', admin)
+    cache.get(BASE_URL, 'other', other)
+    cache.get(BASE_URL, 'admin', admin)
+
+    assert (admin.calls, other.calls) == (1, 1)
+
+
+def test_invalidate_drops_the_token(tmp_path, clock):
+    cache = TokenCache(str(tmp_path))
+    fetch = Fetcher()
+
+    cache.get(BASE_URL, 'admin', fetch)
+    cache.invalidate(BASE_URL, 'admin')
+    cache.invalidate(BASE_URL, 'admin')
+
+    assert cache.get(BASE_URL, 'admin', fetch) == 'token2'
+
+
+def test_token_file_is_private(tmp_path, clock):
+    cache = TokenCache(str(tmp_path))
+    cache.get(BASE_URL, 'admin', Fetcher())
+
+    path = cache._path(BASE_URL, 'admin')
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600